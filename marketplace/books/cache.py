@@ -0,0 +1,51 @@
+"""
+Cache helpers for catalog data.
+
+Cached catalog entries embed a catalog version in their key. Book.save()
+and Book.delete() bump the version, so every stale entry is abandoned at
+once instead of being deleted key by key.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = "books:catalog_version"
+ISBN_LOOKUP_TIMEOUT = 300
+
+# Cached value standing for "no book has this ISBN".
+NOT_FOUND = "__not_found__"
+
+
+def catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, 1, timeout=None)
+
+
+async def acatalog_version():
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every versioned catalog cache entry."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        cache.incr(CATALOG_VERSION_KEY)
+
+
+def bump_now_and_on_commit(bump):
+    """
+    Run the version bump ``bump`` now and again when the transaction commits.
+
+    A reader racing the open transaction could re-cache the old rows under
+    the first bumped version; the second bump abandons that entry too.
+    """
+    bump()
+    transaction.on_commit(bump)
+
+
+def isbn_key(version, isbn):
+    return f"books:isbn:{version}:{isbn}"
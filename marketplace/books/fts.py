@@ -0,0 +1,164 @@
+"""
+Full-text search helpers backed by the SQLite FTS5 index on books.
+
+The ``books_book_fts`` virtual table (see migration 0003) mirrors the
+title/author/course columns of ``books_book`` using the trigram tokenizer,
+so any substring of three or more characters can be matched and
+highlighted by the engine itself. Triggers on ``books_book`` keep it in
+sync; SQLite drops them whenever a migration rebuilds that table, so such
+migrations call ``create_fts_triggers`` again.
+"""
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+FTS_TABLE = "books_book_fts"
+FTS_COLUMNS = ("title", "author", "course")
+
+# The trigram tokenizer cannot match terms shorter than this.
+MIN_TERM_LENGTH = 3
+
+# Control characters used as highlight markers; they never appear in titles.
+_OPEN = "\x02"
+_CLOSE = "\x03"
+
+
+CREATE_TABLE_SQL = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author, course,
+        content='books_book', content_rowid='id', tokenize='trigram'
+    )
+"""
+
+TRIGGER_SQL = {
+    "books_book_fts_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS books_book_fts_ai AFTER INSERT ON books_book BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, author, course)
+            VALUES (new.id, new.title, new.author, new.course);
+        END
+    """,
+    "books_book_fts_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS books_book_fts_ad AFTER DELETE ON books_book BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, course)
+            VALUES ('delete', old.id, old.title, old.author, old.course);
+        END
+    """,
+    "books_book_fts_au": f"""
+        CREATE TRIGGER IF NOT EXISTS books_book_fts_au AFTER UPDATE OF title, author, course ON books_book BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, course)
+            VALUES ('delete', old.id, old.title, old.author, old.course);
+            INSERT INTO {FTS_TABLE}(rowid, title, author, course)
+            VALUES (new.id, new.title, new.author, new.course);
+        END
+    """,
+}
+
+
+def create_fts_index(schema_editor):
+    """Create the FTS5 table and its triggers, then index the existing books."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    create_fts_triggers(schema_editor)
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def create_fts_triggers(schema_editor):
+    """(Re)create whichever of the sync triggers are missing."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in TRIGGER_SQL.values():
+        schema_editor.execute(statement)
+
+
+def drop_fts_index(schema_editor):
+    """Drop the triggers and the FTS5 table."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for name in TRIGGER_SQL:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def fts_available() -> bool:
+    """Return True when the FTS5 index exists on the current database."""
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def phrase(term: str) -> str:
+    """Quote a user-supplied term as an FTS5 phrase."""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def column_phrase(column: str, term: str):
+    """
+    Build a column-filtered FTS5 phrase, or None if the term is too short
+    to be matched by the trigram tokenizer.
+    """
+    if len(term) < MIN_TERM_LENGTH:
+        return None
+    return f"{column} : {phrase(term)}"
+
+
+def highlight_matches(match_expression: str, queryset) -> dict:
+    """
+    Run a single FTS5 query returning highlighted fields for the books in
+    ``queryset`` that match ``match_expression``.
+
+    Args:
+        match_expression: An FTS5 MATCH expression.
+        queryset: Book queryset restricting which rows are highlighted.
+
+    Returns:
+        dict: ``{book_id: {field: {"html": SafeString, "offsets": [[start, end], ...]}}}``
+              containing only fields with at least one match.
+    """
+    if not match_expression or not fts_available():
+        return {}
+
+    ids_sql, ids_params = queryset.order_by().values("id").query.sql_with_params()
+    highlight_columns = ", ".join(
+        f"highlight({FTS_TABLE}, {index}, %s, %s)" for index in range(len(FTS_COLUMNS))
+    )
+    sql = (
+        f"SELECT rowid, {highlight_columns} FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({ids_sql})"
+    )
+    params = [_OPEN, _CLOSE] * len(FTS_COLUMNS) + [match_expression, *ids_params]
+
+    highlights = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            fields = {}
+            for column, marked in zip(FTS_COLUMNS, row[1:]):
+                if marked and _OPEN in marked:
+                    html, offsets = _render_marked(marked)
+                    fields[column] = {"html": html, "offsets": offsets}
+            highlights[row[0]] = fields
+    return highlights
+
+
+def _render_marked(marked: str):
+    """
+    Convert engine-marked text into escaped HTML with <mark> tags and the
+    character offsets of each match in the original (unmarked) text.
+    """
+    parts = []
+    offsets = []
+    position = 0
+    for chunk_index, chunk in enumerate(marked.split(_OPEN)):
+        if chunk_index == 0:
+            parts.append(escape(chunk))
+            position += len(chunk)
+            continue
+        matched, _, rest = chunk.partition(_CLOSE)
+        offsets.append([position, position + len(matched)])
+        position += len(matched)
+        parts.append(f"<mark>{escape(matched)}</mark>{escape(rest)}")
+        position += len(rest)
+    return mark_safe("".join(parts)), offsets
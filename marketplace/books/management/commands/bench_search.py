@@ -0,0 +1,242 @@
+"""
+Offline relevance and latency benchmark for BookSearchService.
+
+Builds (or loads) a catalog plus a query set with judged relevant books,
+runs every registered search strategy over it and reports recall@k, MRR,
+latency percentiles and SQL query counts. Everything happens inside a
+transaction that is rolled back, so run it against an empty database
+(e.g. a scratch settings file or ``--database``).
+
+Usage:
+    python manage.py bench_search --size 100000 --output bench.json
+    python manage.py bench_search --catalog books.json --queries queries.json
+"""
+import json
+import math
+import random
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from books.models import Book
+from books.search_strategies import BookSearchService
+
+SYLLABLES = [
+    consonant + vowel
+    for consonant in "bcdfgklmnprstvz"
+    for vowel in "aeiou"
+]
+FIELDS = ("title", "author", "course")
+
+
+class _Rollback(Exception):
+    """Raised to discard the benchmark catalog at the end of a run."""
+
+
+def synthetic_word(rng):
+    """Return a pronounceable pseudo-word of two to four syllables."""
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def generate_catalog(size, rng):
+    """
+    Generate ``size`` synthetic books.
+
+    Vocabulary sizes scale with the catalog so each title word, author and
+    course is shared by a handful of books, keeping judged relevant sets
+    small enough for recall@k to be meaningful at every size.
+    """
+    title_words = [synthetic_word(rng).capitalize() for _ in range(max(size // 2, 10))]
+    authors = [
+        f"{synthetic_word(rng).capitalize()} {synthetic_word(rng).capitalize()}"
+        for _ in range(max(size // 5, 5))
+    ]
+    courses = [f"MC{number:06d}" for number in rng.sample(range(10 ** 6), max(size // 5, 5))]
+    return [
+        {
+            "title": " ".join(rng.sample(title_words, 3)),
+            "author": rng.choice(authors),
+            "course": rng.choice(courses),
+        }
+        for _ in range(size)
+    ]
+
+
+def _tokens(value):
+    return {token.lower() for token in value.split()}
+
+
+def generate_queries(catalog, count, rng):
+    """
+    Generate ``count`` queries with judged relevant catalog positions.
+
+    Each query picks a field and a token of a random book; the relevant set
+    is every book whose field contains that whole token.
+    """
+    postings = defaultdict(list)
+    for position, book in enumerate(catalog):
+        for field in FIELDS:
+            for token in _tokens(book[field]):
+                postings[field, token].append(position)
+
+    queries = []
+    for _ in range(count):
+        field = rng.choice(FIELDS)
+        token = rng.choice(sorted(_tokens(rng.choice(catalog)[field])))
+        queries.append({
+            "field": field,
+            "params": {"q": token, field: token},
+            "relevant": postings[field, token],
+        })
+    return queries
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def evaluate(strategy_name, queries, ids, k, sort, using):
+    """Run one strategy over the query set and aggregate its metrics."""
+    service = BookSearchService(strategy_name)
+    connection = connections[using]
+    latencies = []
+    recalls = []
+    reciprocal_ranks = []
+    sql_queries = 0
+
+    for query in queries:
+        relevant = {ids[position] for position in query["relevant"]}
+        params = dict(query["params"], sort=sort)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            results = list(
+                service.search_params(params).using(using).values_list("id", flat=True)[:k]
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+        sql_queries += len(captured)
+
+        hits = [book_id in relevant for book_id in results]
+        recalls.append(sum(hits) / len(relevant) if relevant else 0.0)
+        reciprocal_ranks.append(1 / (hits.index(True) + 1) if True in hits else 0.0)
+
+    return {
+        f"recall_at_{k}": round(sum(recalls) / len(recalls), 4),
+        "mrr": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 4),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "mean": round(sum(latencies) / len(latencies), 3),
+        },
+        "sql_queries": {
+            "total": sql_queries,
+            "per_query": round(sql_queries / len(queries), 2),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark relevance (recall@k, MRR) and latency of every book search strategy."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=10000,
+                            help="Synthetic catalog size, e.g. 10000, 100000 or 1000000.")
+        parser.add_argument("--queries-count", type=int, default=200,
+                            help="Number of synthetic queries to generate.")
+        parser.add_argument("--catalog", help="JSON list of {title, author, course} to load instead of generating.")
+        parser.add_argument("--queries", help="JSON list of {params, relevant} with catalog positions as judgments.")
+        parser.add_argument("--k", type=int, default=10, help="Cut-off for recall@k and MRR.")
+        parser.add_argument("--sort", default="relevance", help="Sort order passed to every strategy.")
+        parser.add_argument("--strategy", action="append",
+                            help="Only run this strategy (repeatable). Defaults to all registered strategies.")
+        parser.add_argument("--seed", type=int, default=656)
+        parser.add_argument("--output", help="Write the JSON report to this path.")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        rng = random.Random(options["seed"])
+
+        if options["catalog"]:
+            with open(options["catalog"]) as handle:
+                catalog = json.load(handle)
+        else:
+            catalog = generate_catalog(options["size"], rng)
+        if not catalog:
+            raise CommandError("The catalog is empty.")
+
+        if options["queries"]:
+            with open(options["queries"]) as handle:
+                queries = json.load(handle)
+        else:
+            queries = generate_queries(catalog, options["queries_count"], rng)
+        queries = [query for query in queries if query["relevant"]]
+        if not queries:
+            raise CommandError("No query has judged relevant results.")
+
+        strategies = options["strategy"] or list(BookSearchService.strategies)
+        unknown = set(strategies) - set(BookSearchService.strategies)
+        if unknown:
+            raise CommandError(f"Unknown strategies: {', '.join(sorted(unknown))}")
+
+        if Book.objects.using(using).exists():
+            raise CommandError(
+                "bench_search needs an empty books table so judgments are complete; "
+                "point it at a scratch database."
+            )
+
+        report = {
+            "meta": {
+                "catalog_size": len(catalog),
+                "queries": len(queries),
+                "k": options["k"],
+                "sort": options["sort"],
+                "seed": options["seed"],
+                "vendor": connections[using].vendor,
+                "started_at": timezone.now().isoformat(),
+            },
+            "strategies": {},
+        }
+
+        try:
+            with transaction.atomic(using=using):
+                self.stderr.write(f"Loading {len(catalog)} books...")
+                created = Book.objects.using(using).bulk_create(
+                    [Book(**book) for book in catalog], batch_size=5000
+                )
+                ids = [book.pk for book in created]
+                for name in strategies:
+                    self.stderr.write(f"Running strategy '{name}'...")
+                    report["strategies"][name] = evaluate(
+                        name, queries, ids, options["k"], options["sort"], using
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as handle:
+                handle.write(output + "\n")
+        self._print_summary(report)
+
+    def _print_summary(self, report):
+        k = report["meta"]["k"]
+        self.stdout.write(
+            f"{'strategy':<10} {'recall@' + str(k):>10} {'mrr':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/q':>6}"
+        )
+        for name, metrics in report["strategies"].items():
+            latency = metrics["latency_ms"]
+            self.stdout.write(
+                f"{name:<10} {metrics[f'recall_at_{k}']:>10.4f} {metrics['mrr']:>7.4f} "
+                f"{latency['p50']:>8.3f} {latency['p95']:>8.3f} {latency['p99']:>8.3f} "
+                f"{metrics['sql_queries']['per_query']:>6}"
+            )
@@ -0,0 +1,174 @@
+"""
+Load test comparing the sync and async catalog API views.
+
+Start the project under an ASGI server first, for example:
+
+    uvicorn marketplace.asgi:application --workers 1
+
+then run:
+
+    python manage.py loadtest_views --username alice --concurrency 1 10 50 200
+
+Each sync endpoint is paired with its async counterpart and hit with the
+same number of requests at every concurrency level. The report lists
+throughput and p50/p95/p99 latency per endpoint, and can be saved as JSON.
+Only 2xx responses count as served requests; redirects (e.g. to the login
+page when the session is rejected) are reported apart from errors.
+Only the standard library is used on the client side.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from .bench_search import percentile
+
+ENDPOINT_PAIRS = {
+    "book_list": ("/books/api/books/", "/books/api/async/books/"),
+    "search": ("/books/api/search/?q=intro", "/books/api/async/search/?q=intro"),
+    "isbn": ("/books/api/books/isbn/{isbn}/", "/books/api/async/books/isbn/{isbn}/"),
+}
+
+
+async def _request(reader, writer, host, path, cookie):
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n"
+        f"Connection: keep-alive\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Server closed the connection")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _worker(queue, host, port, cookie, latencies, redirects, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                status = await _request(reader, writer, host, path, cookie)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                errors.append("connection")
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            if 200 <= status < 300:
+                latencies.append((time.perf_counter() - started) * 1000)
+            elif 300 <= status < 400:
+                redirects.append(status)
+            else:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_level(host, port, cookie, path, concurrency, total):
+    """Send ``total`` requests to ``path`` over ``concurrency`` keep-alive connections."""
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(path)
+    latencies, redirects, errors = [], [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(queue, host, port, cookie, latencies, redirects, errors) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    if not latencies:
+        return {"redirects": len(redirects), "errors": len(errors)}
+    return {
+        "requests": len(latencies),
+        "redirects": len(redirects),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare concurrency and tail latency of sync vs async book API views under an ASGI server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--username", required=True,
+                            help="Existing user to authenticate as (a session is created for it).")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+        parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint and level.")
+        parser.add_argument("--endpoint", action="append", choices=sorted(ENDPOINT_PAIRS),
+                            help="Only test this endpoint pair (repeatable).")
+        parser.add_argument("--isbn", default="9780596520687", help="ISBN used by the lookup endpoints.")
+        parser.add_argument("--output", help="Write the JSON report to this path.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["base_url"])
+        if url.scheme != "http" or not url.hostname:
+            raise CommandError("--base-url must be a plain http:// URL.")
+        host, port = url.hostname, url.port or 80
+
+        try:
+            user = get_user_model().objects.get(username=options["username"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self._session_for(user)}"
+
+        report = {"base_url": options["base_url"], "requests": options["requests"], "results": {}}
+        for name in options["endpoint"] or sorted(ENDPOINT_PAIRS):
+            for flavour, path in zip(("sync", "async"), ENDPOINT_PAIRS[name]):
+                path = path.format(isbn=options["isbn"])
+                for concurrency in options["concurrency"]:
+                    result = asyncio.run(
+                        run_level(host, port, cookie, path, concurrency, options["requests"])
+                    )
+                    report["results"].setdefault(name, {}).setdefault(flavour, {})[concurrency] = result
+                    self._print_row(name, flavour, concurrency, result)
+
+        if options["output"]:
+            with open(options["output"], "w") as handle:
+                json.dump(report, handle, indent=2)
+
+    def _session_for(self, user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return session.session_key
+
+    def _print_row(self, name, flavour, concurrency, result):
+        if "latency_ms" not in result:
+            self.stdout.write(
+                f"{name:<10} {flavour:<5} c={concurrency:<4} no 2xx responses "
+                f"(redirects={result['redirects']} errors={result['errors']})"
+            )
+            return
+        latency = result["latency_ms"]
+        self.stdout.write(
+            f"{name:<10} {flavour:<5} c={concurrency:<4} {result['throughput_rps']:>8} rps  "
+            f"p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms "
+            f"redirects={result['redirects']} errors={result['errors']}"
+        )
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from books import fts
+
+
+def create_fts_index(apps, schema_editor):
+    # FTS5 is SQLite-specific; other backends simply skip highlighting.
+    fts.create_fts_index(schema_editor)
+
+
+def drop_fts_index(apps, schema_editor):
+    fts.drop_fts_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_book_isbn'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
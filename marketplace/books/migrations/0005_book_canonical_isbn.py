@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:08
+
+from django.db import migrations, models
+
+from books.utils import to_isbn13
+
+
+def backfill_canonical_isbn(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    books = list(Book.objects.exclude(isbn=None).only('id', 'isbn'))
+    for book in books:
+        book.canonical_isbn = to_isbn13(book.isbn)
+    Book.objects.bulk_update(books, ['canonical_isbn'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='canonical_isbn',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='ISBN-13 form of isbn, so ISBN-10 and ISBN-13 editions match', max_length=13, null=True),
+        ),
+        migrations.RunPython(backfill_canonical_isbn, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from books import fts
+
+
+def restore_fts_triggers(apps, schema_editor):
+    # Adding or removing a NOT NULL column makes SQLite rebuild books_book,
+    # which drops the triggers keeping the FTS index in sync.
+    fts.create_fts_triggers(schema_editor)
+
+
+def count_available(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    DonationListing = apps.get_model('donations', 'DonationListing')
+    available = (
+        DonationListing.objects.filter(book=OuterRef('pk'), status='A')
+        .order_by()
+        .values('book')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    Book.objects.update(available_count=Coalesce(Subquery(available), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_book_canonical_isbn'),
+        ('donations', '0009_stat_rollups'),
+    ]
+
+    operations = [
+        # Reversed last, after RemoveField has rebuilt the table again.
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='book',
+            name='available_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Available donation listings, kept up to date by the donations transitions'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-available_count', '-id'], name='book_available_idx'),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+        migrations.RunPython(count_available, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.exceptions import ValidationError
-from .utils import validate_isbn, normalize_isbn
+from .cache import bump_catalog_version, bump_now_and_on_commit
+from .utils import validate_isbn, normalize_isbn, to_isbn13
 
 
 class Book(models.Model):
@@ -14,6 +15,19 @@ class Book(models.Model):
         unique=True,
         help_text="ISBN-10 or ISBN-13 (stored normalized without hyphens/spaces)"
     )
+    canonical_isbn = models.CharField(
+        max_length=13,
+        blank=True,
+        null=True,
+        db_index=True,
+        editable=False,
+        help_text="ISBN-13 form of isbn, so ISBN-10 and ISBN-13 editions match"
+    )
+    available_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Available donation listings, kept up to date by the donations transitions"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -43,9 +57,27 @@ class Book(models.Model):
             if not self.isbn:
                 self.isbn = None
         
+        self.canonical_isbn = to_isbn13(self.isbn) if self.isbn else None
+
         # Now validate
         self.full_clean()
         super().save(*args, **kwargs)
+        self._invalidate_caches()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self._invalidate_caches()
+        return result
+
+    def _invalidate_caches(self):
+        bump_now_and_on_commit(bump_catalog_version)
     
     class Meta:
-        ordering = ['-created_at']
+        # No default ordering: every listing picks an explicit sort order
+        # (see search_strategies.SORT_ORDERS) matching one of these indexes.
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+            models.Index(fields=['author', 'title', 'id'], name='book_author_idx'),
+            models.Index(fields=['-created_at', '-id'], name='book_newest_idx'),
+            models.Index(fields=['-available_count', '-id'], name='book_available_idx'),
+        ]
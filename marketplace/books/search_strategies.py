@@ -1,57 +1,82 @@
-from django.db.models import Q
+from django.db.models import Case, IntegerField, Q, Value, When
+from .fts import column_phrase, highlight_matches, phrase, MIN_TERM_LENGTH
 from .models import Book
+from .utils import normalize_isbn
 
 
 # === Base Strategy ===
 class BookSearchStrategy:
     """Base class for all book search strategies."""
     def search(self, request):
-        raise NotImplementedError("Search method must be implemented by subclass")
+        return self.filter(request.GET)
+
+    def filter(self, params):
+        """Return the Book queryset matching a dict-like of query parameters."""
+        raise NotImplementedError("Filter method must be implemented by subclass")
+
+    def match_expression(self, params):
+        """FTS5 expression used to highlight matches, or None to skip highlighting."""
+        return None
 
 
 # === Concrete Strategies ===
 class TitleSearchStrategy(BookSearchStrategy):
-    def search(self, request):
-        query = request.GET.get("q", "").strip()
+    def filter(self, params):
+        query = params.get("q", "").strip()
         if not query:
             return Book.objects.all()
-        return Book.objects.filter(title__icontains=query).distinct()
+        return Book.objects.filter(title__icontains=query)
+
+    def match_expression(self, params):
+        return column_phrase("title", params.get("q", "").strip())
 
 
 class AuthorSearchStrategy(BookSearchStrategy):
-    def search(self, request):
-        query = request.GET.get("q", "").strip()
+    def filter(self, params):
+        query = params.get("q", "").strip()
         if not query:
             return Book.objects.all()
-        return Book.objects.filter(author__icontains=query).distinct()
+        return Book.objects.filter(author__icontains=query)
+
+    def match_expression(self, params):
+        return column_phrase("author", params.get("q", "").strip())
 
 
 class CourseSearchStrategy(BookSearchStrategy):
-    def search(self, request):
-        query = request.GET.get("q", "").strip()
+    def filter(self, params):
+        query = params.get("q", "").strip()
         if not query:
             return Book.objects.all()
-        return Book.objects.filter(course__icontains=query).distinct()
+        return Book.objects.filter(course__icontains=query)
+
+    def match_expression(self, params):
+        return column_phrase("course", params.get("q", "").strip())
 
 
 class CombinedSearchStrategy(BookSearchStrategy):
-    def search(self, request):
-        query = request.GET.get("q", "").strip()
+    def filter(self, params):
+        query = params.get("q", "").strip()
         if not query:
             return Book.objects.all()
         return Book.objects.filter(
             Q(title__icontains=query) |
             Q(author__icontains=query) |
             Q(course__icontains=query)
-        ).distinct()
+        )
+
+    def match_expression(self, params):
+        query = params.get("q", "").strip()
+        if len(query) < MIN_TERM_LENGTH:
+            return None
+        return phrase(query)
 
 
 class AdvancedSearchStrategy(BookSearchStrategy):
-    def search(self, request):
+    def filter(self, params):
         """Advanced search combining multiple fields conjunctively."""
-        title = request.GET.get("title", "").strip()
-        author = request.GET.get("author", "").strip()
-        course = request.GET.get("course", "").strip()
+        title = params.get("title", "").strip()
+        author = params.get("author", "").strip()
+        course = params.get("course", "").strip()
 
         queryset = Book.objects.all()
         if title:
@@ -61,21 +86,266 @@ class AdvancedSearchStrategy(BookSearchStrategy):
         if course:
             queryset = queryset.filter(course__icontains=course)
 
-        return queryset.distinct()
+        return queryset
+
+    def match_expression(self, params):
+        phrases = [
+            column_phrase(column, params.get(column, "").strip())
+            for column in ("title", "author", "course")
+        ]
+        # Rows already satisfy every filter, so terms too short for the
+        # trigram index can be dropped without changing which rows match.
+        phrases = [p for p in phrases if p]
+        return " AND ".join(phrases) or None
+
+
+# === Sorting ===
+# Each order ends with a unique column so it matches one of the composite
+# indexes declared on Book.Meta and SQLite can walk the index instead of
+# building a temporary B-tree.
+SORT_ORDERS = {
+    "title": ("title", "id"),
+    "author": ("author", "title", "id"),
+    "newest": ("-created_at", "-id"),
+    "most-available": ("-available_count", "-id"),
+}
+SORT_CHOICES = ("relevance", "title", "author", "newest", "most-available")
+DEFAULT_SORT = "relevance"
+
+
+def normalize_sort(sort):
+    """Return ``sort`` if it is one of SORT_CHOICES, else DEFAULT_SORT."""
+    return sort if sort in SORT_CHOICES else DEFAULT_SORT
+
+
+def filter_available(queryset, params):
+    """Keep only books with available copies when ``available=1`` is requested."""
+    if params.get("available") == "1":
+        # Range scan over book_available_idx.
+        return queryset.filter(available_count__gt=0)
+    return queryset
+
+
+def sort_books(queryset, sort, query=""):
+    """
+    Order a Book queryset by one of SORT_CHOICES.
+
+    Args:
+        queryset: Book queryset to order
+        sort: Requested sort name; unknown values fall back to DEFAULT_SORT
+        query: The free-text query, used to rank "relevance" results
+
+    Returns:
+        QuerySet: The ordered queryset
+    """
+    sort = normalize_sort(sort)
+    if sort in SORT_ORDERS:
+        return queryset.order_by(*SORT_ORDERS[sort])
+
+    # Relevance: exact title, then title prefix, then title substring, then
+    # other fields; ties fall back to the newest-first index order.
+    if not query:
+        return queryset.order_by(*SORT_ORDERS["newest"])
+    return queryset.annotate(
+        relevance=Case(
+            When(title__iexact=query, then=Value(0)),
+            When(title__istartswith=query, then=Value(1)),
+            When(title__icontains=query, then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+    ).order_by("relevance", *SORT_ORDERS["newest"])
 
 
 # === Context / Service ===
 class BookSearchService:
     """Context class selecting and delegating to the right search strategy."""
+    # Registry of available strategies, keyed by the ``mode`` parameter.
+    strategies = {
+        "title": TitleSearchStrategy,
+        "author": AuthorSearchStrategy,
+        "course": CourseSearchStrategy,
+        "combined": CombinedSearchStrategy,
+        "advanced": AdvancedSearchStrategy,
+    }
+    default_strategy = "combined"
+
     def __init__(self, strategy_name):
-        strategies = {
-            "title": TitleSearchStrategy(),
-            "author": AuthorSearchStrategy(),
-            "course": CourseSearchStrategy(),
-            "combined": CombinedSearchStrategy(),
-            "advanced": AdvancedSearchStrategy(),
-        }
-        self.strategy = strategies.get(strategy_name, CombinedSearchStrategy())
+        strategy_class = self.strategies.get(strategy_name, self.strategies[self.default_strategy])
+        self.strategy = strategy_class()
 
     def search(self, request):
-        return self.strategy.search(request)
+        return self.search_params(request.GET)
+
+    def search_params(self, params):
+        """Filter and sort books from a dict-like of query parameters."""
+        books = filter_available(self.strategy.filter(params), params)
+        return sort_books(
+            books,
+            params.get("sort", DEFAULT_SORT),
+            params.get("q", "").strip(),
+        )
+
+    def highlight(self, request, books):
+        """
+        Return engine-computed highlights for ``books`` keyed by book id.
+
+        See ``books.fts.highlight_matches`` for the returned structure.
+        """
+        return highlight_matches(self.strategy.match_expression(request.GET), books)
+
+
+# === Batched search ===
+BATCH_MAX_QUERIES = 100
+BATCH_MAX_RESULTS = 50
+BATCH_FIELDS = ("id", "title", "author", "course", "isbn", "created_at", "available_count")
+# Lookup modes merged into a single IN query across the whole batch,
+# mapped to the parameter and column they match on.
+BATCH_LOOKUP_MODES = {
+    "exact": ("title", "title"),
+    "isbn": ("isbn", "isbn"),
+}
+
+
+def _batch_lookup_value(mode, params):
+    param, _ = BATCH_LOOKUP_MODES[mode]
+    value = str(params.get(param, "")).strip()
+    return normalize_isbn(value) if mode == "isbn" else value
+
+
+def batch_search(queries):
+    """
+    Run many searches with a constant number of SQL queries.
+
+    "exact" (title) and "isbn" lookups are merged into one IN query each;
+    every strategy query is combined into a single UNION ALL tagged with
+    its position in the batch; availability is read from the denormalized
+    Book.available_count column.
+
+    Args:
+        queries: List of dicts with ``id``, ``mode`` and ``params`` keys.
+            Ids must be unique; use validate_batch() first for client input.
+
+    Returns:
+        dict: ``{id: {"books": [...], "count": int}}`` or ``{id: {"error": str}}``
+              for queries that could not run. Each book dict holds
+              BATCH_FIELDS, with ``available_count`` as ``available_copies``.
+    """
+    results = {}
+    lookups = {mode: {} for mode in BATCH_LOOKUP_MODES}
+    strategy_querysets = []
+
+    for position, query in enumerate(queries):
+        mode = query.get("mode", BookSearchService.default_strategy)
+        params = query.get("params") or {}
+        if mode in BATCH_LOOKUP_MODES:
+            value = _batch_lookup_value(mode, params)
+            if not value:
+                results[query["id"]] = {"error": "Missing lookup value."}
+                continue
+            lookups[mode].setdefault(value, []).append(query["id"])
+        elif mode in BookSearchService.strategies:
+            if not any(str(value).strip() for value in params.values()):
+                results[query["id"]] = {"error": "Empty query."}
+                continue
+            strategy = BookSearchService.strategies[mode]()
+            strategy_querysets.append(
+                strategy.filter(params)
+                .order_by()
+                .annotate(batch_position=Value(position, output_field=IntegerField()))
+                .values("batch_position", *BATCH_FIELDS)
+            )
+        else:
+            results[query["id"]] = {"error": f"Unknown mode '{mode}'."}
+
+    rows_by_id = {query["id"]: [] for query in queries if query["id"] not in results}
+
+    for mode, values in lookups.items():
+        if not values:
+            continue
+        _, column = BATCH_LOOKUP_MODES[mode]
+        for row in Book.objects.filter(**{f"{column}__in": list(values)}).order_by(
+            *SORT_ORDERS["newest"]
+        ).values(*BATCH_FIELDS):
+            for query_id in values.get(row[column], ()):
+                rows_by_id[query_id].append(row)
+
+    totals = {}
+    if strategy_querysets:
+        for book in _ranked_union(strategy_querysets):
+            query_id = queries[book.batch_position]["id"]
+            totals[query_id] = book.batch_total
+            rows_by_id[query_id].append({field: getattr(book, field) for field in BATCH_FIELDS})
+
+    for query_id, rows in rows_by_id.items():
+        books = []
+        for row in rows[:BATCH_MAX_RESULTS]:
+            book = dict(row)
+            book["available_copies"] = book.pop("available_count")
+            books.append(book)
+        results[query_id] = {"books": books, "count": totals.get(query_id, len(rows))}
+    return results
+
+
+def _ranked_union(querysets):
+    """
+    Run the UNION ALL of the strategy ``querysets`` as one SQL query.
+
+    Each query keeps its newest BATCH_MAX_RESULTS rows in SQL, ranked with
+    ROW_NUMBER() over its ``batch_position``, so a broad term repeated across
+    the batch never fetches more than the page; COUNT() over the same
+    partition reports its total match count.
+
+    Returns:
+        RawQuerySet: Books with ``batch_position`` and ``batch_total``, ordered
+                     by position, then newest first.
+    """
+    combined = querysets[0]
+    if len(querysets) > 1:
+        combined = combined.union(*querysets[1:], all=True)
+    union_sql, params = combined.query.sql_with_params()
+    fields = ", ".join(BATCH_FIELDS)
+    sql = (
+        f"SELECT batch_position, batch_total, {fields} FROM ("
+        f"SELECT *, "
+        f"ROW_NUMBER() OVER (PARTITION BY batch_position ORDER BY created_at DESC, id DESC) AS batch_rank, "
+        f"COUNT(*) OVER (PARTITION BY batch_position) AS batch_total "
+        f"FROM ({union_sql})"
+        f") WHERE batch_rank <= %s ORDER BY batch_position, batch_rank"
+    )
+    return Book.objects.raw(sql, (*params, BATCH_MAX_RESULTS))
+
+
+def validate_batch(payload):
+    """
+    Validate a batch request body.
+
+    Returns:
+        list: The list of queries
+
+    Raises:
+        ValueError: If the payload is malformed
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("queries"), list):
+        raise ValueError("Body must be an object with a 'queries' list.")
+    queries = payload["queries"]
+    if not queries:
+        raise ValueError("At least one query is required.")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise ValueError(f"At most {BATCH_MAX_QUERIES} queries per batch.")
+
+    seen = set()
+    for query in queries:
+        if not isinstance(query, dict) or not isinstance(query.get("id"), str) or not query["id"]:
+            raise ValueError("Each query needs a non-empty string 'id'.")
+        if query["id"] in seen:
+            raise ValueError(f"Duplicate query id '{query['id']}'.")
+        if not isinstance(query.get("mode", ""), str):
+            raise ValueError(f"Query '{query['id']}' mode must be a string.")
+        params = query.get("params", {})
+        if not isinstance(params, dict):
+            raise ValueError(f"Query '{query['id']}' params must be an object.")
+        if not all(isinstance(value, str) for value in params.values()):
+            raise ValueError(f"Query '{query['id']}' params must be strings.")
+        seen.add(query["id"])
+    return queries
@@ -1,10 +1,19 @@
 import json
+import os
+import tempfile
+from io import StringIO
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase, Client
 from django.test.client import RequestFactory
 from django.urls import reverse
 
+from . import fts
 from .models import Book
 from .search_strategies import (
     BookSearchService,
@@ -12,8 +21,11 @@ from .search_strategies import (
     AuthorSearchStrategy,
     CourseSearchStrategy,
     CombinedSearchStrategy,
-    AdvancedSearchStrategy
+    AdvancedSearchStrategy,
+    filter_available,
+    sort_books,
 )
+from donations.models import DonationListing
 
 
 # Create your tests here.
@@ -549,3 +561,432 @@ class BookSearchServiceTestCase(TestCase):
         request = self.factory.get("/books/search/?q=python")
         results = CombinedSearchStrategy().search(request)
         self.assertEqual(list(results), [self.book1])
+
+
+class SearchHighlightTestCase(TestCase):
+    """Tests for engine-computed (FTS5) search highlighting."""
+
+    def setUp(self):
+        self.client = Client()
+        self.factory = RequestFactory()
+        self.test_user = User.objects.create_user(
+            username="testuser",
+            password="testpassword123"
+        )
+        self.book1 = Book.objects.create(
+            title="Python Programming",
+            author="John Smith",
+            course="CS101"
+        )
+        self.book2 = Book.objects.create(
+            title="Data <Structures>",
+            author="Jane Doe",
+            course="CS201"
+        )
+
+    def test_title_highlight_offsets(self):
+        """Title mode highlights only the title column, with offsets."""
+        request = self.factory.get("/books/search/?q=python")
+        service = BookSearchService("title")
+        highlights = service.highlight(request, service.search(request))
+
+        self.assertEqual(set(highlights), {self.book1.id})
+        title = highlights[self.book1.id]["title"]
+        self.assertEqual(title["html"], "<mark>Python</mark> Programming")
+        self.assertEqual(title["offsets"], [[0, 6]])
+        self.assertNotIn("author", highlights[self.book1.id])
+
+    def test_combined_highlight_multiple_columns(self):
+        """Combined mode highlights every column containing the query."""
+        request = self.factory.get("/books/search/?q=cs2")
+        service = BookSearchService("combined")
+        highlights = service.highlight(request, service.search(request))
+
+        self.assertEqual(highlights[self.book2.id]["course"]["html"], "<mark>CS2</mark>01")
+
+    def test_highlight_escapes_html(self):
+        """Highlighted snippets are HTML-escaped outside the marks."""
+        request = self.factory.get("/books/search/?q=struct")
+        service = BookSearchService("title")
+        highlights = service.highlight(request, service.search(request))
+
+        self.assertEqual(
+            highlights[self.book2.id]["title"]["html"],
+            "Data &lt;<mark>Struct</mark>ures&gt;"
+        )
+
+    def test_advanced_highlight_per_field(self):
+        """Advanced mode highlights each filtered field separately."""
+        request = self.factory.get("/books/search/?title=prog&author=smi")
+        service = BookSearchService("advanced")
+        highlights = service.highlight(request, service.search(request))
+
+        self.assertEqual(highlights[self.book1.id]["title"]["offsets"], [[7, 11]])
+        self.assertEqual(highlights[self.book1.id]["author"]["offsets"], [[5, 8]])
+
+    def test_short_query_has_no_highlights(self):
+        """Queries shorter than a trigram still search but are not highlighted."""
+        request = self.factory.get("/books/search/?q=py")
+        service = BookSearchService("title")
+        books = service.search(request)
+
+        self.assertEqual(list(books), [self.book1])
+        self.assertEqual(service.highlight(request, books), {})
+
+    def test_highlight_tracks_book_updates(self):
+        """The FTS index is kept in sync with edits to the books table."""
+        self.book1.title = "Advanced Rust"
+        self.book1.save()
+
+        request = self.factory.get("/books/search/?q=rust")
+        service = BookSearchService("title")
+        highlights = service.highlight(request, service.search(request))
+        self.assertEqual(highlights[self.book1.id]["title"]["html"], "Advanced <mark>Rust</mark>")
+
+    def test_sync_triggers_exist(self):
+        """Every trigger keeping the FTS index in sync is installed."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'books_book'"
+            )
+            triggers = {name for name, in cursor.fetchall()}
+        self.assertTrue(set(fts.TRIGGER_SQL) <= triggers)
+
+        self.book2.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {fts.FTS_TABLE} WHERE {fts.FTS_TABLE} MATCH 'structures'")
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_no_highlights_without_fts_table(self):
+        """fts_available checks for the index itself, not just the backend."""
+        self.assertTrue(fts.fts_available())
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {fts.FTS_TABLE}")
+        self.assertFalse(fts.fts_available())
+
+        request = self.factory.get("/books/search/?q=python")
+        service = BookSearchService("title")
+        self.assertEqual(service.highlight(request, service.search(request)), {})
+
+    def test_search_api_returns_highlights(self):
+        """search_books_api includes the highlight map for each result."""
+        self.client.login(username='testuser', password='testpassword123')
+        response = self.client.get(reverse('search_books_api'), {'q': 'jane'})
+
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(
+            data['books'][0]['highlight'],
+            {'author': {'html': '<mark>Jane</mark> Doe', 'offsets': [[0, 4]]}}
+        )
+
+    def test_search_page_renders_highlights(self):
+        """The search page renders pre-highlighted titles."""
+        self.client.login(username='testuser', password='testpassword123')
+        response = self.client.get(reverse('search_books'), {'q': 'python'})
+
+        self.assertContains(response, "<mark>Python</mark> Programming", html=False)
+
+
+class BookSortTestCase(TestCase):
+    """Tests for the sort= parameter and its supporting indexes."""
+
+    def setUp(self):
+        self.client = Client()
+        self.test_user = User.objects.create_user(
+            username="testuser",
+            password="testpassword123"
+        )
+        self.client.login(username='testuser', password='testpassword123')
+        self.book_b = Book.objects.create(title="Beta Algorithms", author="Carol", course="CS201")
+        self.book_a = Book.objects.create(title="Alpha Algorithms", author="Bob", course="CS101")
+        self.book_c = Book.objects.create(title="Algorithms", author="Alice", course="CS301")
+
+    def _titles(self, response):
+        return [book['title'] for book in response.json()['books']]
+
+    def test_sort_by_title(self):
+        response = self.client.get(reverse('search_books_api'), {'q': 'algo', 'sort': 'title'})
+        self.assertEqual(self._titles(response), ["Algorithms", "Alpha Algorithms", "Beta Algorithms"])
+        self.assertEqual(response.json()['sort'], 'title')
+
+    def test_sort_by_author(self):
+        response = self.client.get(reverse('book_list_api'), {'sort': 'author'})
+        self.assertEqual(self._titles(response), ["Algorithms", "Alpha Algorithms", "Beta Algorithms"])
+
+    def test_sort_by_newest(self):
+        response = self.client.get(reverse('book_list_api'), {'sort': 'newest'})
+        self.assertEqual(self._titles(response), ["Algorithms", "Alpha Algorithms", "Beta Algorithms"])
+
+    def test_sort_by_relevance_ranks_title_prefix_first(self):
+        response = self.client.get(reverse('search_books_api'), {'q': 'alpha', 'sort': 'relevance'})
+        self.assertEqual(self._titles(response), ["Alpha Algorithms"])
+
+        response = self.client.get(reverse('search_books_api'), {'q': 'algorithms'})
+        self.assertEqual(self._titles(response)[0], "Algorithms")
+
+    def test_sort_by_most_available(self):
+        donor = User.objects.create_user(username="donor", password="pass123")
+        other = User.objects.create_user(username="other", password="pass123")
+        DonationListing.add_listing(self.book_b, donor)
+        DonationListing.add_listing(self.book_b, other)
+        DonationListing.add_listing(self.book_a, donor)
+
+        response = self.client.get(reverse('book_list_api'), {'sort': 'most-available'})
+        self.assertEqual(self._titles(response), ["Beta Algorithms", "Alpha Algorithms", "Algorithms"])
+        self.assertEqual([book['available_copies'] for book in response.json()['books']], [2, 1, 0])
+
+    def test_only_available_filter(self):
+        donor = User.objects.create_user(username="donor", password="pass123")
+        DonationListing.add_listing(self.book_b, donor)
+
+        response = self.client.get(reverse('book_list_api'), {'available': '1'})
+        self.assertEqual(self._titles(response), ["Beta Algorithms"])
+        response = self.client.get(reverse('search_books_api'), {'q': 'algo', 'available': '1'})
+        self.assertEqual(self._titles(response), ["Beta Algorithms"])
+        self.assertEqual(response.json()['books'][0]['available_copies'], 1)
+        response = self.client.get(reverse('book_list'), {'available': '1'})
+        self.assertEqual([book.title for book in response.context['books']], ["Beta Algorithms"])
+
+    def test_unknown_sort_falls_back(self):
+        response = self.client.get(reverse('book_list_api'), {'sort': 'bogus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self._titles(response)), 3)
+
+    def test_unknown_sort_is_reported_as_the_default(self):
+        """Search responses echo the sort actually applied, not the raw parameter."""
+        for name in ('search_books_api', 'search_books_api_async'):
+            response = self.client.get(reverse(name), {'q': 'algo', 'sort': 'bogus'})
+            self.assertEqual(response.json()['sort'], 'relevance')
+        response = self.client.get(reverse('search_books'), {'q': 'algo', 'sort': '<b>'})
+        self.assertEqual(response.context['sort'], 'relevance')
+
+    def test_search_page_sort_context(self):
+        response = self.client.get(reverse('search_books'), {'q': 'algo', 'sort': 'title'})
+        self.assertEqual(response.context['sort'], 'title')
+        self.assertEqual(
+            [book.title for book in response.context['books']],
+            ["Algorithms", "Alpha Algorithms", "Beta Algorithms"]
+        )
+
+    def test_sort_orders_use_index_without_filesort(self):
+        """Top-N queries for column sorts walk a composite index."""
+        expected = {
+            "title": "book_title_idx",
+            "author": "book_author_idx",
+            "newest": "book_newest_idx",
+            "most-available": "book_available_idx",
+        }
+        for sort, index in expected.items():
+            with self.subTest(sort=sort):
+                for queryset in (Book.objects.all(), Book.objects.filter(title__icontains="algo")):
+                    plan = sort_books(queryset, sort)[:20].explain()
+                    self.assertIn(index, plan)
+                    self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_only_available_filter_uses_index(self):
+        plan = filter_available(Book.objects.all(), {"available": "1"}).explain()
+        self.assertIn("book_available_idx", plan)
+
+
+class BenchSearchCommandTestCase(TestCase):
+    """Tests for the bench_search management command."""
+
+    def test_report_covers_every_strategy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.json")
+            call_command("bench_search", size=300, queries_count=20, k=5,
+                         output=path, stdout=StringIO(), stderr=StringIO())
+            with open(path) as handle:
+                report = json.load(handle)
+
+        self.assertEqual(report["meta"]["catalog_size"], 300)
+        self.assertEqual(set(report["strategies"]), set(BookSearchService.strategies))
+        combined = report["strategies"]["combined"]
+        self.assertGreater(combined["recall_at_5"], 0)
+        self.assertGreater(combined["mrr"], 0)
+        self.assertEqual(set(combined["latency_ms"]), {"p50", "p95", "p99", "mean"})
+        self.assertEqual(combined["sql_queries"]["per_query"], 1.0)
+
+    def test_catalog_is_rolled_back(self):
+        call_command("bench_search", size=50, queries_count=5,
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(Book.objects.exists())
+
+    def test_refuses_non_empty_catalog(self):
+        Book.objects.create(title="Existing", author="Someone", course="CS101")
+        with self.assertRaises(CommandError):
+            call_command("bench_search", size=50, stdout=StringIO(), stderr=StringIO())
+
+
+class BatchSearchAPITestCase(TestCase):
+    """Tests for the batched multi-query search endpoint."""
+
+    def setUp(self):
+        self.client = Client()
+        self.test_user = User.objects.create_user(username="testuser", password="testpassword123")
+        self.donor = User.objects.create_user(username="donor", password="testpassword123")
+        self.client.login(username='testuser', password='testpassword123')
+        self.url = reverse('search_books_batch_api')
+        self.book1 = Book.objects.create(title="Calculus", author="James Stewart", course="MA111",
+                                         isbn="978-0-596-52068-7")
+        self.book2 = Book.objects.create(title="Linear Algebra", author="Gilbert Strang", course="MA327")
+        self.book3 = Book.objects.create(title="Algorithms", author="Robert Sedgewick", course="MC458")
+        DonationListing.add_listing(self.book2, self.donor)
+
+    def _post(self, payload):
+        return self.client.post(self.url, data=json.dumps(payload), content_type='application/json')
+
+    def test_mixed_batch_keyed_by_client_id(self):
+        response = self._post({"queries": [
+            {"id": "by-isbn", "mode": "isbn", "params": {"isbn": "9780596520687"}},
+            {"id": "by-title", "mode": "exact", "params": {"title": "Linear Algebra"}},
+            {"id": "fuzzy", "mode": "title", "params": {"q": "alg"}},
+            {"id": "author", "mode": "author", "params": {"q": "strang"}},
+            {"id": "missing", "mode": "isbn", "params": {"isbn": "0-596-52068-9"}},
+        ]})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([b["id"] for b in results["by-isbn"]["books"]], [self.book1.id])
+        self.assertEqual([b["id"] for b in results["by-title"]["books"]], [self.book2.id])
+        self.assertEqual(
+            {b["id"] for b in results["fuzzy"]["books"]}, {self.book2.id, self.book3.id}
+        )
+        self.assertEqual(results["author"]["books"][0]["available_copies"], 1)
+        self.assertEqual(results["missing"], {"books": [], "count": 0})
+
+    def test_query_count_is_constant(self):
+        """Thirty lookups cost the same number of SQL queries as three."""
+        def payload(n):
+            queries = []
+            for i in range(n):
+                queries.append({"id": f"e{i}", "mode": "exact", "params": {"title": f"Title {i}"}})
+                queries.append({"id": f"i{i}", "mode": "isbn", "params": {"isbn": "9780596520687"}})
+                queries.append({"id": f"t{i}", "mode": "combined", "params": {"q": f"alg{i % 3}"}})
+            return {"queries": queries}
+
+        from books.search_strategies import batch_search, validate_batch
+        # exact IN, isbn IN, strategy UNION ALL; availability is a column
+        with self.assertNumQueries(3):
+            batch_search(validate_batch(payload(1)))
+        with self.assertNumQueries(3):
+            batch_search(validate_batch(payload(30)))
+
+    def test_per_query_errors(self):
+        response = self._post({"queries": [
+            {"id": "bad-mode", "mode": "telepathy", "params": {"q": "x"}},
+            {"id": "empty", "mode": "title", "params": {"q": "  "}},
+        ]})
+        results = response.json()["results"]
+        self.assertIn("error", results["bad-mode"])
+        self.assertIn("error", results["empty"])
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self._post({"queries": "nope"}).status_code, 400)
+        self.assertEqual(self._post({"queries": [{"mode": "title"}]}).status_code, 400)
+        duplicate = {"id": "a", "mode": "title", "params": {"q": "calc"}}
+        self.assertEqual(self._post({"queries": [duplicate, duplicate]}).status_code, 400)
+        too_many = [{"id": str(i), "mode": "title", "params": {"q": "x"}} for i in range(101)]
+        self.assertEqual(self._post({"queries": too_many}).status_code, 400)
+        response = self.client.post(self.url, data="{", content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_wrongly_typed_queries(self):
+        for query in (
+            {"id": "a", "mode": ["title"]},
+            {"id": "a", "mode": "title", "params": {"q": 123}},
+            {"id": "a", "mode": "advanced", "params": {"title": None}},
+        ):
+            self.assertEqual(self._post({"queries": [query]}).status_code, 400)
+
+    def test_results_capped_per_query_with_full_count(self):
+        from books.search_strategies import BATCH_MAX_RESULTS
+        Book.objects.bulk_create(
+            Book(title=f"Intro {i}", author="Author", course="CS101") for i in range(BATCH_MAX_RESULTS + 5)
+        )
+        response = self._post({"queries": [
+            {"id": "a", "mode": "title", "params": {"q": "intro"}},
+            {"id": "b", "mode": "title", "params": {"q": "intro"}},
+            {"id": "c", "mode": "title", "params": {"q": "calc"}},
+        ]})
+
+        results = response.json()["results"]
+        for query_id in ("a", "b"):
+            self.assertEqual(len(results[query_id]["books"]), BATCH_MAX_RESULTS)
+            self.assertEqual(results[query_id]["count"], BATCH_MAX_RESULTS + 5)
+        newest = Book.objects.filter(title__startswith="Intro").order_by("-created_at", "-id").first()
+        self.assertEqual(results["a"]["books"][0]["id"], newest.id)
+        self.assertEqual(results["c"]["count"], 1)
+        self.assertEqual(results["c"]["books"][0]["title"], "Calculus")
+
+    def test_requires_login_and_post(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.client.logout()
+        response = self._post({"queries": [{"id": "a", "mode": "title", "params": {"q": "calc"}}]})
+        self.assertEqual(response.status_code, 302)
+
+
+class AsyncCatalogAPITestCase(TestCase):
+    """Tests for the ASGI-native catalog views and the ISBN lookup."""
+
+    def setUp(self):
+        cache.clear()
+        self.test_user = User.objects.create_user(username="testuser", password="testpassword123")
+        self.book = Book.objects.create(title="Python Programming", author="John Smith",
+                                        course="CS101", isbn="978-0-596-52068-7")
+        Book.objects.create(title="Data Structures", author="Jane Doe", course="CS201")
+
+    async def test_async_book_list_matches_sync(self):
+        await self.async_client.alogin(username="testuser", password="testpassword123")
+        async_response = await self.async_client.get(reverse('book_list_api_async'), {'sort': 'title'})
+        await sync_to_async(self.client.login)(username="testuser", password="testpassword123")
+        sync_response = await sync_to_async(self.client.get)(reverse('book_list_api'), {'sort': 'title'})
+
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.json(), sync_response.json())
+
+    async def test_async_search_with_highlights(self):
+        await self.async_client.alogin(username="testuser", password="testpassword123")
+        response = await self.async_client.get(reverse('search_books_api_async'), {'q': 'python'})
+
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['books'][0]['highlight']['title']['offsets'], [[0, 6]])
+
+    async def test_async_isbn_lookup(self):
+        await self.async_client.alogin(username="testuser", password="testpassword123")
+        response = await self.async_client.get(
+            reverse('book_by_isbn_api_async', args=['978-0-596-52068-7'])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['book']['id'], self.book.id)
+
+        missing = await self.async_client.get(reverse('book_by_isbn_api_async', args=['0596520689']))
+        self.assertEqual(missing.status_code, 404)
+        invalid = await self.async_client.get(reverse('book_by_isbn_api_async', args=['123']))
+        self.assertEqual(invalid.status_code, 400)
+
+    async def test_async_views_require_login(self):
+        response = await self.async_client.get(reverse('book_list_api_async'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_isbn_lookup_is_cached_until_catalog_changes(self):
+        self.client.login(username="testuser", password="testpassword123")
+        url = reverse('book_by_isbn_api', args=['9780596520687'])
+        self.assertEqual(self.client.get(url).json()['book']['title'], "Python Programming")
+
+        with self.assertNumQueries(2):  # session + user only
+            self.client.get(url)
+
+        self.book.title = "Python Programming, 2nd ed."
+        self.book.save()
+        self.assertEqual(self.client.get(url).json()['book']['title'], "Python Programming, 2nd ed.")
+
+    def test_isbn_lookup_negative_result_invalidated_on_create(self):
+        self.client.login(username="testuser", password="testpassword123")
+        url = reverse('book_by_isbn_api', args=['0-596-52068-9'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        Book.objects.create(title="New", author="A", course="C", isbn="0596520689")
+        self.assertEqual(self.client.get(url).status_code, 200)
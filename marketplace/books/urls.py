@@ -7,6 +7,11 @@ urlpatterns = [
     path('search/', views.search_books, name='search_books'),
     path('api/books/', views.book_list_api, name='book_list_api'),
     path('api/books/register/', views.register_book_api, name='register_book_api'),
+    path('api/books/isbn/<str:isbn>/', views.book_by_isbn_api, name='book_by_isbn_api'),
     path('api/search/', views.search_books_api, name='search_books_api'),
+    path('api/search/batch/', views.search_books_batch_api, name='search_books_batch_api'),
+    path('api/async/books/', views.book_list_api_async, name='book_list_api_async'),
+    path('api/async/books/isbn/<str:isbn>/', views.book_by_isbn_api_async, name='book_by_isbn_api_async'),
+    path('api/async/search/', views.search_books_api_async, name='search_books_api_async'),
     path('add-to-shelf/<int:book_id>/', views.add_to_shelf, name='add_to_shelf'),
 ]
\ No newline at end of file
@@ -127,3 +127,32 @@ def normalize_isbn(isbn: str) -> str:
         return ""
     
     return isbn.replace(" ", "").replace("-", "").upper()
+
+
+def to_isbn13(isbn: str):
+    """
+    Convert an ISBN to its canonical ISBN-13 form.
+
+    ISBN-10s get the 978 prefix and a recomputed check digit, so the two
+    forms of the same edition compare equal.
+
+    Args:
+        isbn: ISBN-10 or ISBN-13, with or without hyphens/spaces.
+
+    Returns:
+        str or None: The 13-digit ISBN, or None if the input is not a valid ISBN.
+
+    Examples:
+        >>> to_isbn13("0-596-52068-9")
+        '9780596520687'
+        >>> to_isbn13("9780596520687")
+        '9780596520687'
+    """
+    if not validate_isbn(isbn):
+        return None
+    normalized = normalize_isbn(isbn)
+    if len(normalized) == 13:
+        return normalized
+    body = "978" + normalized[:9]
+    checksum = sum(int(digit) * (1 if i % 2 == 0 else 3) for i, digit in enumerate(body))
+    return body + str((10 - checksum % 10) % 10)
@@ -1,4 +1,6 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.db.models import Q
 from django.http import JsonResponse
 from django.shortcuts import render, redirect
@@ -8,9 +10,19 @@ from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
 import json
 
+from .cache import ISBN_LOOKUP_TIMEOUT, NOT_FOUND, acatalog_version, catalog_version, isbn_key
 from .models import Book
-from .search_strategies import BookSearchService
-from .utils import validate_isbn
+from .search_strategies import (
+    BookSearchService,
+    SORT_CHOICES,
+    SORT_ORDERS,
+    batch_search,
+    filter_available,
+    normalize_sort,
+    sort_books,
+    validate_batch,
+)
+from .utils import normalize_isbn, validate_isbn
 from bookshelves.models import Bookshelf, BookshelfItem
 
 from donations.models import DonationListing, DonationStatus
@@ -19,9 +31,14 @@ from donations.models import DonationListing, DonationStatus
 @login_required
 def book_list(request):
     """View to display all available books."""
-    books = Book.objects.all()
+    books = filter_available(Book.objects.all(), request.GET).order_by(*SORT_ORDERS["newest"])
     listings = DonationListing.objects.filter(status=DonationStatus.AVAILABLE).exclude(donor=request.user)
-    return render(request, 'books/book_list.html', {'listings': listings, 'books': books})
+    listings = listings.select_related('book', 'donor')
+    return render(request, 'books/book_list.html', {
+        'listings': listings,
+        'books': books,
+        'only_available': request.GET.get('available') == '1',
+    })
 
 
 @login_required
@@ -31,12 +48,23 @@ def search_books(request):
     search_service = BookSearchService(strategy_name=mode)
     books = search_service.search(request)
     listings =  DonationListing.objects.filter(book__in=books, status=DonationStatus.AVAILABLE).exclude(donor=request.user)
+    listings = listings.select_related('book', 'donor')
+
+    highlights = search_service.highlight(request, books)
+    books = list(books)
+    for book in books:
+        book.highlight = {
+            field: match["html"] for field, match in highlights.get(book.id, {}).items()
+        }
 
     context = {
         "books": books,
         "listings": listings,
         "query": request.GET.get("q", "").strip(),
         "mode": mode,
+        "sort": normalize_sort(request.GET.get("sort")),
+        "sort_choices": SORT_CHOICES,
+        "only_available": request.GET.get("available") == "1",
         "is_search": True,
     }
     return render(request, "books/search_books.html", context)
@@ -131,18 +159,8 @@ def add_to_shelf(request, book_id):
 @login_required
 def book_list_api(request):
     """API endpoint to return all books as JSON."""
-    books = Book.objects.all()
-    book_data = []
-    for book in books:
-        book_data.append({
-            'id': book.id,
-            'title': book.title,
-            'author': book.author,
-            'course': book.course,
-            'isbn': book.isbn,
-            'created_at': book.created_at.isoformat(),
-            'updated_at': book.updated_at.isoformat(),
-        })
+    books = sort_books(filter_available(Book.objects.all(), request.GET), request.GET.get("sort", "newest"))
+    book_data = [_serialize_book(book) for book in books]
     return JsonResponse({'books': book_data})
 
 
@@ -154,26 +172,61 @@ def search_books_api(request):
     mode = request.GET.get("mode", "combined")
     search_service = BookSearchService(strategy_name=mode)
     books = search_service.search(request)
+    highlights = search_service.highlight(request, books)
 
-    book_data = [
-        {
-            "id": b.id,
-            "title": b.title,
-            "author": b.author,
-            "course": b.course,
-            "isbn": b.isbn,
-            "created_at": b.created_at.isoformat(),
-        }
-        for b in books
-    ]
+    book_data = [_serialize_search_result(b, highlights) for b in books]
 
     return JsonResponse({
         "books": book_data,
         "count": len(book_data),
         "mode": mode,
+        "sort": normalize_sort(request.GET.get("sort")),
     })
 
 
+@csrf_exempt
+@require_GET
+@login_required
+def book_by_isbn_api(request, isbn):
+    """API endpoint to look up a single book by ISBN (cached per catalog version)."""
+    normalized = normalize_isbn(isbn)
+    if not validate_isbn(normalized):
+        return JsonResponse({'error': 'Invalid ISBN format. Please provide a valid ISBN-10 or ISBN-13.'}, status=400)
+
+    key = isbn_key(catalog_version(), normalized)
+    payload = cache.get(key)
+    if payload is None:
+        try:
+            payload = _serialize_book(Book.objects.get(isbn=normalized), availability=False)
+        except Book.DoesNotExist:
+            payload = NOT_FOUND
+        cache.set(key, payload, ISBN_LOOKUP_TIMEOUT)
+
+    if payload == NOT_FOUND:
+        return JsonResponse({'error': 'Book not found.'}, status=404)
+    return JsonResponse({'book': payload})
+
+
+@csrf_exempt
+@require_POST
+@login_required
+def search_books_batch_api(request):
+    """API endpoint running many searches (e.g. a course reading list) at once."""
+    try:
+        queries = validate_batch(json.loads(request.body))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format in request body.'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    results = batch_search(queries)
+    for result in results.values():
+        for book in result.get("books", ()):
+            book["created_at"] = book["created_at"].isoformat()
+
+    return JsonResponse({"results": results})
+
+
 @csrf_exempt
 @require_POST
 @login_required
@@ -244,3 +297,93 @@ def register_book_api(request):
         return JsonResponse({
             'error': f'Unexpected error: {str(e)}'
         }, status=500)
+
+
+# === Async (ASGI-native) API views ===
+# Same contracts as their sync counterparts, but run on the event loop
+# under ASGI instead of being dispatched to a worker thread per request.
+
+@csrf_exempt
+@require_GET
+@login_required
+async def book_list_api_async(request):
+    """Async version of book_list_api."""
+    books = sort_books(filter_available(Book.objects.all(), request.GET), request.GET.get("sort", "newest"))
+    book_data = [_serialize_book(book) async for book in books.aiterator(chunk_size=500)]
+    return JsonResponse({'books': book_data})
+
+
+@csrf_exempt
+@require_GET
+@login_required
+async def search_books_api_async(request):
+    """Async version of search_books_api."""
+    mode = request.GET.get("mode", "combined")
+    search_service = BookSearchService(strategy_name=mode)
+    books = search_service.search(request)
+    # Highlighting runs a raw FTS5 query, which has no async cursor API.
+    highlights = await sync_to_async(search_service.highlight)(request, books)
+
+    book_data = [
+        _serialize_search_result(b, highlights) async for b in books.aiterator(chunk_size=500)
+    ]
+
+    return JsonResponse({
+        "books": book_data,
+        "count": len(book_data),
+        "mode": mode,
+        "sort": normalize_sort(request.GET.get("sort")),
+    })
+
+
+@csrf_exempt
+@require_GET
+@login_required
+async def book_by_isbn_api_async(request, isbn):
+    """Async version of book_by_isbn_api."""
+    normalized = normalize_isbn(isbn)
+    if not validate_isbn(normalized):
+        return JsonResponse({'error': 'Invalid ISBN format. Please provide a valid ISBN-10 or ISBN-13.'}, status=400)
+
+    key = isbn_key(await acatalog_version(), normalized)
+    payload = await cache.aget(key)
+    if payload is None:
+        try:
+            payload = _serialize_book(await Book.objects.aget(isbn=normalized), availability=False)
+        except Book.DoesNotExist:
+            payload = NOT_FOUND
+        await cache.aset(key, payload, ISBN_LOOKUP_TIMEOUT)
+
+    if payload == NOT_FOUND:
+        return JsonResponse({'error': 'Book not found.'}, status=404)
+    return JsonResponse({'book': payload})
+
+
+def _serialize_book(book, availability=True):
+    data = {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'course': book.course,
+        'isbn': book.isbn,
+        'created_at': book.created_at.isoformat(),
+        'updated_at': book.updated_at.isoformat(),
+    }
+    # Left out of cached payloads: listing transitions don't bump the
+    # catalog version, so a cached count would go stale.
+    if availability:
+        data['available_copies'] = book.available_count
+    return data
+
+
+def _serialize_search_result(book, highlights):
+    return {
+        "id": book.id,
+        "title": book.title,
+        "author": book.author,
+        "course": book.course,
+        "isbn": book.isbn,
+        "created_at": book.created_at.isoformat(),
+        "available_copies": book.available_count,
+        "highlight": highlights.get(book.id, {}),
+    }
@@ -0,0 +1,181 @@
+"""
+Bulk shelf operations.
+
+A bulk request is a list of ``add``, ``retag`` and ``remove`` operations
+keyed by book id. They are applied with a fixed number of set-based
+statements per chunk of ids (one lookup per table, one insert, one update
+per tag and one delete, plus one counter update and one change-log insert)
+inside a single transaction, so importing a reading list costs a handful of
+queries instead of several per book.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from books.models import Book
+from marketplace.utils import CHUNK_SIZE, chunks
+
+from .cache import invalidate_shelf
+from .models import (
+    VALID_TAG_VALUES, Bookshelf, BookshelfItem, BookshelfTag, ShelfChange, deletes_logged_by_caller,
+)
+
+BULK_MAX_OPERATIONS = 5000
+
+BULK_OPERATIONS = ("add", "retag", "remove")
+
+
+def validate_bulk(payload):
+    """
+    Validate a bulk request body.
+
+    Only the envelope is checked here; problems with individual operations
+    are reported in their outcome instead of failing the whole request.
+
+    Returns:
+        list: The list of operations
+
+    Raises:
+        ValueError: If the payload is malformed
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("operations"), list):
+        raise ValueError("Body must be an object with an 'operations' list.")
+    operations = payload["operations"]
+    if not operations:
+        raise ValueError("At least one operation is required.")
+    if len(operations) > BULK_MAX_OPERATIONS:
+        raise ValueError(f"At most {BULK_MAX_OPERATIONS} operations per request.")
+    return operations
+
+
+def _check_operation(operation, seen):
+    """Return an error message for an invalid operation, or None."""
+    if not isinstance(operation, dict):
+        return "Operation must be an object."
+    if operation.get("op") not in BULK_OPERATIONS:
+        return f"'op' must be one of: {', '.join(BULK_OPERATIONS)}."
+    book_id = operation.get("book_id")
+    if not isinstance(book_id, int) or isinstance(book_id, bool):
+        return "'book_id' must be an integer."
+    if book_id in seen:
+        return "Book already appears earlier in this request."
+    if operation["op"] != "remove":
+        tag = operation.get("tag", BookshelfTag.UNTAGGED if operation["op"] == "add" else None)
+        if not isinstance(tag, str) or tag not in VALID_TAG_VALUES:
+            return "Tag must be a valid choice."
+    return None
+
+
+def apply_bulk(bookshelf, operations):
+    """
+    Apply many shelf operations atomically.
+
+    Args:
+        bookshelf: The Bookshelf to modify
+        operations: List of ``{"op", "book_id", "tag"}`` dicts; ``tag`` is
+            required for ``retag`` and defaults to untagged for ``add``
+
+    Returns:
+        list: One outcome per operation, in request order, each a dict with
+              ``op``, ``book_id`` and ``status`` (``created``, ``updated``,
+              ``unchanged``, ``removed`` or ``error``) plus ``error`` when
+              the operation was rejected.
+    """
+    outcomes = []
+    valid = []
+    seen = set()
+    for operation in operations:
+        error = _check_operation(operation, seen)
+        outcome = {
+            "op": operation.get("op") if isinstance(operation, dict) else None,
+            "book_id": operation.get("book_id") if isinstance(operation, dict) else None,
+        }
+        if error:
+            outcome.update(status="error", error=error)
+        else:
+            seen.add(operation["book_id"])
+            valid.append((operation, outcome))
+        outcomes.append(outcome)
+
+    if not valid:
+        return outcomes
+
+    add_ids = [op["book_id"] for op, _ in valid if op["op"] == "add"]
+    with transaction.atomic():
+        # Lock the shelf before reading its items: a concurrent single add
+        # moves the counters first, so it waits here instead of being
+        # counted again from a stale read.
+        Bookshelf.objects.select_for_update().get(pk=bookshelf.pk)
+
+        existing_books = set()
+        for chunk in chunks(add_ids):
+            existing_books.update(Book.objects.filter(id__in=chunk).values_list("id", flat=True))
+
+        current_tags = {}
+        for chunk in chunks(seen):
+            current_tags.update(
+                BookshelfItem.objects.filter(bookshelf=bookshelf, book_id__in=chunk)
+                .values_list("book_id", "tag")
+            )
+
+        to_create = []
+        to_retag = defaultdict(list)
+        to_remove = []
+        deltas = defaultdict(int)
+        for operation, outcome in valid:
+            book_id = operation["book_id"]
+            if operation["op"] == "remove":
+                if book_id in current_tags:
+                    to_remove.append(book_id)
+                    deltas[current_tags[book_id]] -= 1
+                    outcome["status"] = "removed"
+                else:
+                    outcome.update(status="error", error="Book is not on the shelf.")
+                continue
+
+            tag = operation.get("tag", BookshelfTag.UNTAGGED)
+            if book_id in current_tags:
+                if current_tags[book_id] == tag:
+                    outcome["status"] = "unchanged"
+                else:
+                    to_retag[tag].append(book_id)
+                    deltas[current_tags[book_id]] -= 1
+                    deltas[tag] += 1
+                    outcome["status"] = "updated"
+            elif operation["op"] == "retag":
+                outcome.update(status="error", error="Book is not on the shelf.")
+            elif book_id not in existing_books:
+                outcome.update(status="error", error="Book not found.")
+            else:
+                to_create.append(BookshelfItem(book_id=book_id, bookshelf=bookshelf, tag=tag))
+                deltas[tag] += 1
+                outcome["status"] = "created"
+
+        # update_conflicts keeps a concurrent single add from failing the batch.
+        BookshelfItem.objects.bulk_create(
+            to_create,
+            batch_size=CHUNK_SIZE,
+            update_conflicts=True,
+            unique_fields=["book", "bookshelf"],
+            update_fields=["tag"],
+        )
+        for tag, book_ids in to_retag.items():
+            for chunk in chunks(book_ids):
+                BookshelfItem.objects.filter(bookshelf=bookshelf, book_id__in=chunk).update(tag=tag)
+        with deletes_logged_by_caller():
+            for chunk in chunks(to_remove):
+                BookshelfItem.objects.filter(bookshelf=bookshelf, book_id__in=chunk).delete()
+        if to_create or to_retag or to_remove:
+            Bookshelf.shift_tag_counts(bookshelf.pk, deltas=deltas)
+            upserted = [item.book_id for item in to_create]
+            upserted += [book_id for book_ids in to_retag.values() for book_id in book_ids]
+            ShelfChange.objects.bulk_create(
+                [ShelfChange(bookshelf=bookshelf, book_id=book_id, op=ShelfChange.Op.UPSERT)
+                 for book_id in upserted]
+                + [ShelfChange(bookshelf=bookshelf, book_id=book_id, op=ShelfChange.Op.DELETE)
+                   for book_id in to_remove],
+                batch_size=CHUNK_SIZE,
+            )
+            invalidate_shelf(bookshelf.user_id)
+
+    return outcomes
@@ -0,0 +1,85 @@
+"""
+Per-user cache of shelf pages.
+
+Each user has a shelf version in the cache. Cached pages embed that
+version and the catalog version (see books.cache) in their key, so any
+shelf mutation or book update abandons every cached page of the shelf at
+once. Hits and misses are counted in the cache for the
+``shelf_cache_stats`` command.
+"""
+from functools import partial
+
+from django.core.cache import cache
+
+from books.cache import bump_now_and_on_commit, catalog_version
+
+SHELF_PAGE_TIMEOUT = 600
+
+HITS_KEY = "bookshelves:stats:hits"
+MISSES_KEY = "bookshelves:stats:misses"
+
+
+def _version_key(user_id):
+    return f"bookshelves:version:{user_id}"
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+
+def shelf_version(user_id):
+    return cache.get_or_set(_version_key(user_id), 1, timeout=None)
+
+
+def bump_shelf_version(user_id):
+    """Invalidate every cached page of one user's shelf."""
+    _incr(_version_key(user_id))
+
+
+def invalidate_shelf(user_id):
+    bump_now_and_on_commit(partial(bump_shelf_version, user_id))
+
+
+def shelf_page_key(user_id, tag, after, limit):
+    return (
+        f"bookshelves:page:{user_id}:{shelf_version(user_id)}:{catalog_version()}"
+        f":{tag or ''}:{after or ''}:{limit}"
+    )
+
+
+def get_cached_page(key, loader):
+    """Return the page cached under ``key``, calling ``loader`` on a miss."""
+    page = cache.get(key)
+    if page is not None:
+        _incr(HITS_KEY)
+        return page
+    _incr(MISSES_KEY)
+    page = loader()
+    cache.set(key, page, SHELF_PAGE_TIMEOUT)
+    return page
+
+
+def cache_stats():
+    """
+    Return hit/miss counters since the last reset.
+
+    Returns:
+        dict: ``hits``, ``misses`` and ``hit_rate`` (None before any lookup)
+    """
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = counters.get(HITS_KEY, 0)
+    misses = counters.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
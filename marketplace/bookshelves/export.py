@@ -0,0 +1,134 @@
+"""
+Streaming shelf exports.
+
+Rows are read with ``iterator(chunk_size=...)`` (a server-side cursor on
+PostgreSQL) and encoded a batch at a time, so memory stays bounded by
+``EXPORT_CHUNK_SIZE`` rows whatever the size of the export. The output is
+a byte iterator suitable for ``StreamingHttpResponse`` or for writing to a
+file, optionally gzip-compressed on the fly.
+"""
+import csv
+import io
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import BookshelfItem
+from .read_models import TAG_LABELS
+
+EXPORT_FORMATS = ("csv", "json")
+
+EXPORT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {"csv": "text/csv", "json": "application/json"}
+
+# (column, queryset field)
+_COLUMNS = (
+    ("book_id", "book_id"),
+    ("title", "book__title"),
+    ("author", "book__author"),
+    ("course", "book__course"),
+    ("isbn", "book__isbn"),
+    ("tag", "tag"),
+    ("added_at", "added_at"),
+)
+
+# Whole-database dumps identify shelves by user id, not username.
+_ALL_COLUMNS = (("user_id", "bookshelf__user_id"),) + _COLUMNS
+
+
+def export_columns(user=None):
+    """Column names of an export of ``user``'s shelf, or of every shelf."""
+    return [name for name, _ in (_COLUMNS if user is not None else _ALL_COLUMNS)]
+
+
+def export_rows(user=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield export rows as lists, in shelf item order.
+
+    Args:
+        user: Only export this user's shelf; None exports every shelf
+        chunk_size: Rows fetched from the database at a time
+    """
+    columns = _COLUMNS if user is not None else _ALL_COLUMNS
+    items = BookshelfItem.objects.all()
+    if user is not None:
+        items = items.filter(bookshelf__user=user)
+    tag_position = [name for name, _ in columns].index("tag")
+    rows = items.order_by("id").values_list(*(field for _, field in columns))
+    for row in rows.iterator(chunk_size=chunk_size):
+        row = list(row)
+        row[tag_position] = TAG_LABELS[row[tag_position]]
+        yield row
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(columns, rows, batch_size=EXPORT_CHUNK_SIZE):
+    """Yield CSV text, one batch of rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in _batches(rows, batch_size):
+        writer.writerows(
+            [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+            for row in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def json_chunks(columns, rows, batch_size=EXPORT_CHUNK_SIZE):
+    """Yield a JSON array of objects, one batch of rows per chunk."""
+    encoder = DjangoJSONEncoder()
+    yield "["
+    separator = "\n"
+    for batch in _batches(rows, batch_size):
+        yield separator + ",\n".join(encoder.encode(dict(zip(columns, row))) for row in batch)
+        separator = ",\n"
+    yield "\n]\n"
+
+
+def gzip_chunks(chunks):
+    """gzip-compress a byte iterator on the fly."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(fmt, user=None, compress=False):
+    """
+    Return a byte iterator over a shelf export.
+
+    Args:
+        fmt: One of ``EXPORT_FORMATS``
+        user: Only export this user's shelf; None exports every shelf
+        compress: gzip the output
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(EXPORT_FORMATS)}.")
+    encode = csv_chunks if fmt == "csv" else json_chunks
+    chunks = (text.encode("utf-8") for text in encode(export_columns(user), export_rows(user)))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(fmt, compress=False, name="bookshelf"):
+    return f"{name}.{fmt}" + (".gz" if compress else "")
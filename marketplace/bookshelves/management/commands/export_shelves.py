@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from bookshelves.export import EXPORT_FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream shelf items joined to their books as CSV or JSON, with bounded memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument("--gzip", action="store_true", help="gzip the output (requires --output).")
+        parser.add_argument("--output", help="File to write; defaults to standard output.")
+        parser.add_argument("--user", help="Only export this username's shelf.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+        if options["gzip"] and not options["output"]:
+            raise CommandError("--gzip requires --output.")
+
+        chunks = stream_export(options["format"], user=user, compress=options["gzip"])
+        if not options["output"]:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode("utf-8"), ending="")
+            return
+
+        written = 0
+        with open(options["output"], "wb") as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}."))
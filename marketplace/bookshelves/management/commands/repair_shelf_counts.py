@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from bookshelves.models import Bookshelf
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized per-tag counters on every bookshelf with one GROUP BY "
+        "and fix any that drifted (e.g. after books were deleted and their shelf items cascaded)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shelf", type=int, action="append", help="Only check this bookshelf id (repeatable).")
+
+    def handle(self, *args, **options):
+        repaired = Bookshelf.recount_tags(options["shelf"])
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} bookshelf(s)."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from bookshelves.cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the per-user shelf page cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        hit_rate = "n/a" if stats["hit_rate"] is None else f"{stats['hit_rate']:.2%}"
+        self.stdout.write(f"hits={stats['hits']} misses={stats['misses']} hit_rate={hit_rate}")
+        if options["reset"]:
+            reset_cache_stats()
+            self.stdout.write("Counters reset.")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_sort_indexes'),
+        ('bookshelves', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookshelfitem',
+            index=models.Index(fields=['bookshelf', 'tag', '-id'], name='shelf_item_tag_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:03
+
+from django.db import migrations, models
+from django.db.models import Count
+
+TAG_COUNT_FIELDS = {'0': 'untagged_count', '1': 'wanted_count', '2': 'reading_count', '3': 'read_count'}
+
+
+def backfill_tag_counts(apps, schema_editor):
+    Bookshelf = apps.get_model('bookshelves', 'Bookshelf')
+    BookshelfItem = apps.get_model('bookshelves', 'BookshelfItem')
+    counts = {}
+    grouped = BookshelfItem.objects.order_by().values('bookshelf_id', 'tag').annotate(total=Count('id'))
+    for row in grouped:
+        counts.setdefault(row['bookshelf_id'], {})[row['tag']] = row['total']
+
+    shelves = list(Bookshelf.objects.filter(pk__in=counts))
+    for shelf in shelves:
+        for tag, field in TAG_COUNT_FIELDS.items():
+            setattr(shelf, field, counts[shelf.pk].get(tag, 0))
+    Bookshelf.objects.bulk_update(shelves, list(TAG_COUNT_FIELDS.values()), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshelves', '0002_shelf_item_tag_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookshelf',
+            name='read_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bookshelf',
+            name='reading_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bookshelf',
+            name='untagged_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bookshelf',
+            name='wanted_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_tag_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_changes(apps, schema_editor):
+    # Seed the log with one upsert per existing item so a sync from token 0
+    # returns the whole shelf.
+    BookshelfItem = apps.get_model('bookshelves', 'BookshelfItem')
+    ShelfChange = apps.get_model('bookshelves', 'ShelfChange')
+    rows = BookshelfItem.objects.order_by('id').values_list('bookshelf_id', 'book_id')
+    ShelfChange.objects.bulk_create(
+        (ShelfChange(bookshelf_id=bookshelf_id, book_id=book_id, op='upsert')
+         for bookshelf_id, book_id in rows.iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshelves', '0003_bookshelf_tag_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShelfChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_id', models.IntegerField()),
+                ('op', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=6)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bookshelf', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bookshelves.bookshelf')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bookshelf', 'id'], name='shelf_change_since_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, Exists, F, Value, When
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils import timezone
 from books.models import Book
 
+from .cache import invalidate_shelf
+
 
 class BookshelfTag(models.TextChoices):
     UNTAGGED = '0', 'Untagged'
@@ -10,13 +19,114 @@ class BookshelfTag(models.TextChoices):
     READ = '3', 'Read'
 
 
+VALID_TAG_VALUES = frozenset(BookshelfTag.values)
+
+# Denormalized per-tag item counts kept on Bookshelf.
+TAG_COUNT_FIELDS = {
+    BookshelfTag.UNTAGGED: 'untagged_count',
+    BookshelfTag.WANTED: 'wanted_count',
+    BookshelfTag.READING: 'reading_count',
+    BookshelfTag.READ: 'read_count',
+}
+
+
 class Bookshelf(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     books = models.ManyToManyField(Book, through='BookshelfItem')
     created_at = models.DateTimeField(auto_now_add=True)
+    untagged_count = models.PositiveIntegerField(default=0)
+    wanted_count = models.PositiveIntegerField(default=0)
+    reading_count = models.PositiveIntegerField(default=0)
+    read_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user.username}'s shelf"
+
+    def save(self, *args, **kwargs):
+        # Counters are only ever changed with F() updates; never write back
+        # the possibly stale in-memory values.
+        if self.pk is not None and kwargs.get('update_fields') is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in TAG_COUNT_FIELDS.values()
+            ]
+        super().save(*args, **kwargs)
+        invalidate_shelf(self.user_id)
+
+    @property
+    def tag_counts(self):
+        """Dict mapping each tag value to the number of items carrying it."""
+        return {tag: getattr(self, field) for tag, field in TAG_COUNT_FIELDS.items()}
+
+    @classmethod
+    def shift_tag_counts(cls, bookshelf_id, item_filter=None, new_tag=None, deltas=None):
+        """
+        Adjust the tag counters of one shelf with a single F() update.
+
+        Must run in the same transaction as the item change, and before it
+        when ``item_filter`` is given, since the current tag is read there.
+
+        Args:
+            bookshelf_id: Primary key of the shelf
+            item_filter: Lookup kwargs selecting the item being retagged or
+                removed; its current tag is decremented
+            new_tag: Tag being added, or None on removal
+            deltas: Dict of tag value -> count change, for bulk changes
+        """
+        deltas = dict(deltas or {})
+        if new_tag is not None:
+            deltas[new_tag] = deltas.get(new_tag, 0) + 1
+        updates = {}
+        for tag, field in TAG_COUNT_FIELDS.items():
+            expression = F(field) + Value(deltas.get(tag, 0))
+            if item_filter is not None:
+                expression = expression - Case(
+                    When(Exists(BookshelfItem.objects.filter(tag=tag, **item_filter)), then=Value(1)),
+                    default=Value(0),
+                )
+            if item_filter is not None or deltas.get(tag):
+                updates[field] = expression
+        if updates:
+            cls.objects.filter(pk=bookshelf_id).update(**updates)
+
+    @classmethod
+    def recount_tags(cls, bookshelf_ids=None):
+        """
+        Recompute tag counters from BookshelfItem with one GROUP BY query.
+
+        Only shelves whose stored counters drifted are written.
+
+        Args:
+            bookshelf_ids: Optional iterable restricting the shelves checked
+
+        Returns:
+            int: Number of shelves that were repaired
+        """
+        items = BookshelfItem.objects.all()
+        shelves = cls.objects.all()
+        if bookshelf_ids is not None:
+            items = items.filter(bookshelf_id__in=bookshelf_ids)
+            shelves = shelves.filter(pk__in=bookshelf_ids)
+
+        actual = {}
+        grouped = items.order_by().values('bookshelf_id', 'tag').annotate(total=Count('id'))
+        for row in grouped.iterator():
+            actual.setdefault(row['bookshelf_id'], {})[row['tag']] = row['total']
+
+        drifted = []
+        for shelf in shelves.only('pk', 'user_id', *TAG_COUNT_FIELDS.values()).iterator():
+            counts = actual.get(shelf.pk, {})
+            if any(getattr(shelf, field) != counts.get(tag, 0) for tag, field in TAG_COUNT_FIELDS.items()):
+                for tag, field in TAG_COUNT_FIELDS.items():
+                    setattr(shelf, field, counts.get(tag, 0))
+                drifted.append(shelf)
+
+        if drifted:
+            with transaction.atomic():
+                cls.objects.bulk_update(drifted, list(TAG_COUNT_FIELDS.values()), batch_size=500)
+                for shelf in drifted:
+                    invalidate_shelf(shelf.user_id)
+        return len(drifted)
     
     def add_or_update_item(self, book, tag, actor=None):
         """
@@ -39,25 +149,64 @@ class Bookshelf(models.Model):
         if not isinstance(tag, str):
             raise ValueError("Tag must be a valid string")
         
-        # Validate that the tag value is in the allowed choices
-        valid_tag_values = [choice[0] for choice in BookshelfTag.choices]
-        if tag not in valid_tag_values:
-            raise ValueError(f"Tag must be a valid choice: {valid_tag_values}")
-            
-        # Create or update the BookshelfItem
-        bookshelf_item, created = BookshelfItem.objects.get_or_create(
-            book=book,
-            bookshelf=self,
-            defaults={'tag': tag}
+        if tag not in VALID_TAG_VALUES:
+            raise ValueError(f"Tag must be a valid choice: {BookshelfTag.values}")
+
+        # One INSERT ... ON CONFLICT round trip instead of get_or_create()
+        # plus save(); concurrent adds of the same book cannot collide on
+        # unique_together. A row keeps its original added_at on conflict, so
+        # comparing it with the value we tried to insert tells whether the
+        # row was created.
+        added_at = timezone.now()
+        item_table = BookshelfItem._meta.db_table
+        added_at_field = BookshelfItem._meta.get_field('added_at')
+        quote = connection.ops.quote_name
+        db_added_at = added_at_field.get_db_prep_save(added_at, connection)
+        with transaction.atomic(), connection.cursor() as cursor:
+            Bookshelf.shift_tag_counts(
+                self.pk, item_filter={'bookshelf_id': self.pk, 'book_id': book.pk}, new_tag=str(tag)
+            )
+            cursor.execute(
+                f"INSERT INTO {quote(item_table)} "
+                f"({quote('book_id')}, {quote('bookshelf_id')}, {quote('tag')}, {quote('added_at')}) "
+                f"VALUES (%s, %s, %s, %s) "
+                f"ON CONFLICT ({quote('book_id')}, {quote('bookshelf_id')}) "
+                f"DO UPDATE SET {quote('tag')} = EXCLUDED.{quote('tag')} "
+                f"RETURNING {quote('id')}, {quote('added_at')}",
+                [book.pk, self.pk, str(tag), db_added_at],
+            )
+            item_id, stored_added_at = cursor.fetchone()
+            ShelfChange.objects.create(
+                bookshelf_id=self.pk, book_id=book.pk, op=ShelfChange.Op.UPSERT
+            )
+
+        expression = added_at_field.get_col(item_table)
+        for converter in connection.ops.get_db_converters(expression):
+            stored_added_at = converter(stored_added_at, expression, connection)
+        created = stored_added_at == added_at
+
+        bookshelf_item = BookshelfItem(
+            id=item_id, book=book, bookshelf=self, tag=str(tag), added_at=stored_added_at
         )
-        
-        # Update tag if entry already exists
-        if not created:
-            bookshelf_item.tag = tag
-            bookshelf_item.save()
-            
+        bookshelf_item._state.adding = False
+        bookshelf_item._state.db = connection.alias
+        invalidate_shelf(self.user_id)
         return bookshelf_item, created
-    
+
+    def remove_book(self, book):
+        """
+        Remove a book from the shelf.
+
+        Args:
+            book: The Book instance to remove
+
+        Returns:
+            bool: True if the book was on the shelf
+        """
+        # log_item_delete keeps the counters and the change log in step.
+        deleted, _ = BookshelfItem.objects.filter(book=book, bookshelf=self).delete()
+        return bool(deleted)
+
     @classmethod
     def get_or_create_for_user(cls, user):
         """
@@ -83,4 +232,88 @@ class BookshelfItem(models.Model):
     )
 
     class Meta:
-        unique_together = ['book', 'bookshelf']
\ No newline at end of file
+        unique_together = ['book', 'bookshelf']
+        indexes = [
+            # Keyset pagination of a shelf filtered by tag (newest first).
+            models.Index(fields=['bookshelf', 'tag', '-id'], name='shelf_item_tag_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self._state.adding:
+                Bookshelf.shift_tag_counts(self.bookshelf_id, new_tag=self.tag)
+            else:
+                Bookshelf.shift_tag_counts(
+                    self.bookshelf_id, item_filter={'pk': self.pk}, new_tag=self.tag
+                )
+            super().save(*args, **kwargs)
+            ShelfChange.objects.create(
+                bookshelf_id=self.bookshelf_id, book_id=self.book_id, op=ShelfChange.Op.UPSERT
+            )
+        invalidate_shelf(self.bookshelf.user_id)
+
+
+class ShelfChange(models.Model):
+    """
+    Append-only log of shelf item changes, read by the delta sync API.
+
+    The id doubles as the monotonic change token. Every writer first updates
+    the shelf's tag counters, which locks the Bookshelf row, so changes to
+    one shelf get ids in commit order. Rows keep the book id rather than a
+    foreign key so deletions leave a tombstone behind.
+    """
+
+    class Op(models.TextChoices):
+        UPSERT = 'upsert', 'Upsert'
+        DELETE = 'delete', 'Delete'
+
+    bookshelf = models.ForeignKey(Bookshelf, on_delete=models.CASCADE)
+    book_id = models.IntegerField()
+    op = models.CharField(max_length=6, choices=Op.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bookshelf', 'id'], name='shelf_change_since_idx'),
+        ]
+
+
+# Set while a caller deletes items and logs the changes itself.
+_deletes_logged_by_caller = ContextVar('deletes_logged_by_caller', default=False)
+
+
+@contextmanager
+def deletes_logged_by_caller():
+    """
+    Skip log_item_delete for item deletes inside the block.
+
+    For set-based writers such as the bulk API, which shift the counters
+    and write the DELETE changes for a whole batch at once.
+    """
+    token = _deletes_logged_by_caller.set(True)
+    try:
+        yield
+    finally:
+        _deletes_logged_by_caller.reset(token)
+
+
+@receiver(pre_delete, sender=BookshelfItem)
+def log_item_delete(sender, instance, origin=None, **kwargs):
+    """
+    Update the counters and log a DELETE change for every removed item.
+
+    Runs for instance, queryset and admin deletes and for items cascaded
+    from a deleted Book, inside the delete's transaction. Items removed
+    along with their shelf (or its user) are skipped: the change log goes
+    with the shelf.
+    """
+    if _deletes_logged_by_caller.get():
+        return
+    origin_model = origin._meta.model if isinstance(origin, models.Model) else getattr(origin, 'model', None)
+    if origin_model not in (Book, BookshelfItem):
+        return
+    Bookshelf.shift_tag_counts(instance.bookshelf_id, item_filter={'pk': instance.pk})
+    ShelfChange.objects.create(
+        bookshelf_id=instance.bookshelf_id, book_id=instance.book_id, op=ShelfChange.Op.DELETE
+    )
+    invalidate_shelf(instance.bookshelf.user_id)
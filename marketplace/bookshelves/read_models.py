@@ -0,0 +1,181 @@
+"""
+Read models for rendering bookshelves.
+
+Shelf pages are read with a single query joining BookshelfItem to Book and
+paginated by keyset (item id), so the cost of a page does not depend on
+how many books the shelf holds. Pages are cached per user (see
+bookshelves.cache) until the shelf or the catalog changes.
+"""
+from marketplace.utils import is_number
+
+from .cache import get_cached_page, shelf_page_key
+from .models import TAG_COUNT_FIELDS, Bookshelf, BookshelfItem, BookshelfTag, ShelfChange
+
+SHELF_PAGE_SIZE = 50
+MAX_SHELF_PAGE_SIZE = 200
+
+CHANGES_PAGE_SIZE = 500
+
+TAG_LABELS = dict(BookshelfTag.choices)
+
+_ROW_FIELDS = (
+    "id",
+    "tag",
+    "added_at",
+    "book_id",
+    "book__title",
+    "book__author",
+    "book__course",
+    "book__isbn",
+    "book__created_at",
+)
+
+
+def _to_item(row):
+    return {
+        "id": row["id"],
+        "tag": row["tag"],
+        "tag_label": TAG_LABELS[row["tag"]],
+        "added_at": row["added_at"],
+        "book": {
+            "id": row["book_id"],
+            "title": row["book__title"],
+            "author": row["book__author"],
+            "course": row["book__course"],
+            "isbn": row["book__isbn"],
+            "created_at": row["book__created_at"],
+        },
+    }
+
+
+def get_shelf_page(user, tag=None, after=None, limit=SHELF_PAGE_SIZE):
+    """
+    Return one page of a user's shelf, newest additions first, from the cache
+    when possible.
+
+    Args:
+        user: Owner of the shelf
+        tag: Optional BookshelfTag value to filter by
+        after: Keyset cursor; only items with a smaller id are returned
+        limit: Page size
+
+    Returns:
+        dict: ``{"items": [...], "next_cursor": int or None, "tag_counts": {...}}``
+              where each item holds the item fields plus a nested ``book``
+              dict, and ``tag_counts`` maps every tag to the shelf's total.
+    """
+    key = shelf_page_key(user.pk, tag, after, limit)
+    return get_cached_page(key, lambda: load_shelf_page(user, tag, after, limit))
+
+
+def load_shelf_page(user, tag=None, after=None, limit=SHELF_PAGE_SIZE):
+    """Read one shelf page from the database, bypassing the cache."""
+    queryset = BookshelfItem.objects.filter(bookshelf__user=user)
+    if tag is not None:
+        queryset = queryset.filter(tag=tag)
+    if after is not None:
+        queryset = queryset.filter(id__lt=after)
+
+    # Fetch one extra row to know whether another page exists.
+    rows = list(queryset.order_by("-id").values(*_ROW_FIELDS)[:limit + 1])
+    items = [_to_item(row) for row in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+
+    counters = Bookshelf.objects.filter(user=user).values(*TAG_COUNT_FIELDS.values()).first() or {}
+    tag_counts = {tag: counters.get(field, 0) for tag, field in TAG_COUNT_FIELDS.items()}
+    return {"items": items, "next_cursor": next_cursor, "tag_counts": tag_counts}
+
+
+def parse_page_params(params):
+    """
+    Validate ``tag``, ``after`` and ``limit`` query parameters.
+
+    Returns:
+        tuple: (tag or None, after or None, limit)
+
+    Raises:
+        ValueError: If a parameter is invalid
+    """
+    tag = params.get("tag") or None
+    if tag is not None and tag not in TAG_LABELS:
+        raise ValueError("Invalid tag value")
+
+    after = params.get("after") or None
+    if after is not None:
+        if not is_number(after):
+            raise ValueError("Invalid cursor")
+        after = int(after)
+
+    limit = params.get("limit") or SHELF_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid limit")
+    if not 1 <= limit <= MAX_SHELF_PAGE_SIZE:
+        raise ValueError(f"Limit must be between 1 and {MAX_SHELF_PAGE_SIZE}")
+    return tag, after, limit
+
+
+def get_shelf_changes(user, since=0, limit=CHANGES_PAGE_SIZE):
+    """
+    Return shelf changes after a change token, for incremental sync.
+
+    Several changes to the same book within the page collapse into the
+    latest one. Upserts carry the item as it is now, in the same shape as
+    get_shelf_page; deletions carry only the book id. Costs two queries
+    whatever the shelf size: one for the log, one for the upserted items.
+
+    Args:
+        user: Owner of the shelf
+        since: Change token returned by a previous call, or 0 for everything
+        limit: Maximum number of log entries to read
+
+    Returns:
+        dict: ``{"changes": [...], "next_token": int, "has_more": bool}``
+    """
+    entries = list(
+        ShelfChange.objects.filter(bookshelf__user=user, id__gt=since)
+        .order_by("id").values("id", "book_id", "op")[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        latest.pop(entry["book_id"], None)
+        latest[entry["book_id"]] = entry["op"]
+
+    upserted = [book_id for book_id, op in latest.items() if op == ShelfChange.Op.UPSERT]
+    rows = {}
+    if upserted:
+        rows = {
+            row["book_id"]: row
+            for row in BookshelfItem.objects.filter(bookshelf__user=user, book_id__in=upserted)
+            .values(*_ROW_FIELDS)
+        }
+
+    changes = []
+    for book_id, op in latest.items():
+        # A book upserted here but removed by a change beyond this page is
+        # reported as deleted; the next page repeats the deletion harmlessly.
+        if op == ShelfChange.Op.UPSERT and book_id in rows:
+            changes.append({"op": "upsert", "book_id": book_id, "item": _to_item(rows[book_id])})
+        else:
+            changes.append({"op": "delete", "book_id": book_id})
+
+    next_token = entries[-1]["id"] if entries else since
+    return {"changes": changes, "next_token": next_token, "has_more": has_more}
+
+
+def parse_change_token(value):
+    """
+    Validate a ``since`` change token.
+
+    Raises:
+        ValueError: If the token is not a non-negative integer
+    """
+    if not value:
+        return 0
+    if not is_number(value):
+        raise ValueError("Invalid change token")
+    return int(value)
@@ -2,8 +2,18 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth.models import User
 from books.models import Book
-from .models import Bookshelf, BookshelfItem, BookshelfTag
+from django.core.management import call_command
+from .bulk import apply_bulk
+from .export import csv_chunks, gzip_chunks
+from .cache import cache_stats, invalidate_shelf, reset_cache_stats
+from .models import Bookshelf, BookshelfItem, BookshelfTag, ShelfChange
+from .read_models import get_shelf_changes
+from io import StringIO
+import csv
+import gzip
 import json
+import os
+import tempfile
 
 
 class BookshelfViewsTest(TestCase):
@@ -262,6 +272,29 @@ class BookshelfModelTest(TestCase):
             
             self.assertIn("Tag must be a valid", str(context.exception))
     
+    def test_add_or_update_item_constant_statements(self):
+        """Adding and re-tagging each take a fixed number of statements."""
+        # savepoint, counter update, upsert, change log, release
+        with self.assertNumQueries(5):
+            item, created = self.bookshelf.add_or_update_item(book=self.book1, tag=BookshelfTag.WANTED)
+        self.assertTrue(created)
+
+        with self.assertNumQueries(5):
+            updated, created = self.bookshelf.add_or_update_item(book=self.book1, tag=BookshelfTag.READ)
+        self.assertFalse(created)
+        self.assertEqual(updated.id, item.id)
+        self.assertEqual(updated.added_at, item.added_at)
+        self.assertEqual(BookshelfItem.objects.get(id=item.id).tag, BookshelfTag.READ)
+
+    def test_add_or_update_item_returns_saved_instance(self):
+        """The returned item behaves like one loaded from the database."""
+        item, _ = self.bookshelf.add_or_update_item(book=self.book1, tag=BookshelfTag.WANTED)
+        item.tag = BookshelfTag.READING
+        item.save()
+
+        self.assertEqual(BookshelfItem.objects.count(), 1)
+        self.assertEqual(BookshelfItem.objects.get().tag, BookshelfTag.READING)
+
     def test_add_or_update_item_without_actor(self):
         """Test that actor parameter is optional."""
         item, created = self.bookshelf.add_or_update_item(
@@ -418,4 +451,615 @@ class AddToShelfIntegrationTest(TestCase):
             reverse('add_to_shelf', kwargs={'book_id': self.book.id})
         )
         
-        self.assertRedirects(response, reverse('book_list'))
\ No newline at end of file
+        self.assertRedirects(response, reverse('book_list'))
+
+class ShelfPageTest(TestCase):
+    """Tests for the keyset-paginated shelf page and items API."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='reader', password='pass123')
+        self.bookshelf = Bookshelf.objects.create(user=self.user)
+        self.client.login(username='reader', password='pass123')
+
+    def _fill_shelf(self, count, tag=BookshelfTag.UNTAGGED):
+        books = Book.objects.bulk_create(
+            [Book(title=f'Book {i}', author='Author', course='MC102') for i in range(count)]
+        )
+        items = BookshelfItem.objects.bulk_create(
+            [BookshelfItem(book=book, bookshelf=self.bookshelf, tag=tag) for book in books]
+        )
+        # bulk_create skips save(), so drop the cached pages by hand.
+        invalidate_shelf(self.user.pk)
+        return items
+
+    def test_bookshelf_view_query_count_is_constant(self):
+        """Rendering the page costs the same number of queries for 1 or 60 books."""
+        self._fill_shelf(1)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('bookshelves:bookshelf'))
+        self._fill_shelf(59)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('bookshelves:bookshelf'))
+        self.assertEqual(len(response.context['items']), 50)
+        self.assertContains(response, 'Load more')
+
+    def test_items_api_query_count_is_constant(self):
+        """The items API runs one items and one counters query regardless of shelf size."""
+        self._fill_shelf(1)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('bookshelves:shelf_items_api'))
+        self._fill_shelf(120)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('bookshelves:shelf_items_api'), {'limit': 200})
+        self.assertEqual(len(response.json()['items']), 121)
+
+    def test_items_api_keyset_pagination(self):
+        """Pages follow next_cursor without gaps or duplicates."""
+        items = self._fill_shelf(5)
+        url = reverse('bookshelves:shelf_items_api')
+
+        first = self.client.get(url, {'limit': 3}).json()
+        self.assertEqual([i['id'] for i in first['items']], [i.id for i in reversed(items)][:3])
+        self.assertEqual(first['next_cursor'], first['items'][-1]['id'])
+
+        second = self.client.get(url, {'limit': 3, 'after': first['next_cursor']}).json()
+        self.assertEqual([i['id'] for i in second['items']], [i.id for i in reversed(items)][3:])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_items_api_item_shape(self):
+        """Each item carries its tag label and the nested book."""
+        book = Book.objects.create(title='Calculus', author='Stewart', course='MA111', isbn='9780538497817')
+        item = BookshelfItem.objects.create(book=book, bookshelf=self.bookshelf, tag=BookshelfTag.WANTED)
+
+        data = self.client.get(reverse('bookshelves:shelf_items_api')).json()
+
+        self.assertEqual(data['items'][0]['id'], item.id)
+        self.assertEqual(data['items'][0]['tag'], BookshelfTag.WANTED)
+        self.assertEqual(data['items'][0]['tag_label'], 'Wanted')
+        self.assertEqual(data['items'][0]['book']['title'], 'Calculus')
+        self.assertEqual(data['items'][0]['book']['isbn'], '9780538497817')
+
+    def test_tag_filter(self):
+        """Filtering by tag returns only matching items, on the page and in the API."""
+        self._fill_shelf(2, tag=BookshelfTag.WANTED)
+        self._fill_shelf(3, tag=BookshelfTag.READ)
+
+        data = self.client.get(reverse('bookshelves:shelf_items_api'), {'tag': BookshelfTag.WANTED}).json()
+        self.assertEqual(len(data['items']), 2)
+        self.assertTrue(all(i['tag'] == BookshelfTag.WANTED for i in data['items']))
+
+        response = self.client.get(reverse('bookshelves:bookshelf'), {'tag': BookshelfTag.READ})
+        self.assertEqual(len(response.context['items']), 3)
+        self.assertEqual(response.context['tag'], BookshelfTag.READ)
+
+    def test_only_own_items_are_listed(self):
+        """Items on another user's shelf never appear."""
+        other = User.objects.create_user(username='other', password='pass123')
+        other_shelf = Bookshelf.objects.create(user=other)
+        book = Book.objects.create(title='Hidden', author='Author', course='Course')
+        BookshelfItem.objects.create(book=book, bookshelf=other_shelf)
+
+        data = self.client.get(reverse('bookshelves:shelf_items_api')).json()
+        self.assertEqual(data['items'], [])
+
+    def test_items_api_rejects_invalid_params(self):
+        """Bad tag, cursor or limit values return 400."""
+        url = reverse('bookshelves:shelf_items_api')
+        for params in ({'tag': 'bogus'}, {'after': 'abc'}, {'after': '²'}, {'limit': '0'}, {'limit': '500'}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+    def test_bookshelf_view_ignores_invalid_params(self):
+        """The HTML page falls back to the first unfiltered page."""
+        self._fill_shelf(2)
+        response = self.client.get(reverse('bookshelves:bookshelf'), {'tag': 'bogus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['items']), 2)
+
+
+class ShelfBulkAPITest(TestCase):
+    """Tests for /bookshelves/api/bulk/."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='importer', password='pass123')
+        self.client.login(username='importer', password='pass123')
+        self.url = reverse('bookshelves:shelf_bulk_api')
+
+    def _post(self, operations):
+        return self.client.post(self.url, json.dumps({'operations': operations}), content_type='application/json')
+
+    def _books(self, count):
+        return Book.objects.bulk_create(
+            [Book(title=f'Book {i}', author='Author', course='MC102') for i in range(count)]
+        )
+
+    def test_add_retag_and_remove(self):
+        """Each operation kind is applied and reported in request order."""
+        books = self._books(3)
+        shelf = Bookshelf.objects.create(user=self.user)
+        BookshelfItem.objects.create(book=books[1], bookshelf=shelf, tag=BookshelfTag.WANTED)
+        BookshelfItem.objects.create(book=books[2], bookshelf=shelf, tag=BookshelfTag.WANTED)
+
+        response = self._post([
+            {'op': 'add', 'book_id': books[0].id, 'tag': BookshelfTag.READING},
+            {'op': 'retag', 'book_id': books[1].id, 'tag': BookshelfTag.READ},
+            {'op': 'remove', 'book_id': books[2].id},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([r['status'] for r in data['results']], ['created', 'updated', 'removed'])
+        self.assertEqual(data['summary'], {'created': 1, 'updated': 1, 'removed': 1})
+        tags = dict(BookshelfItem.objects.filter(bookshelf=shelf).values_list('book_id', 'tag'))
+        self.assertEqual(tags, {books[0].id: BookshelfTag.READING, books[1].id: BookshelfTag.READ})
+
+    def test_add_existing_book_updates_or_is_unchanged(self):
+        """Adding a book already on the shelf retags it instead of failing."""
+        books = self._books(2)
+        shelf = Bookshelf.objects.create(user=self.user)
+        BookshelfItem.objects.create(book=books[0], bookshelf=shelf, tag=BookshelfTag.WANTED)
+        BookshelfItem.objects.create(book=books[1], bookshelf=shelf, tag=BookshelfTag.READ)
+
+        data = self._post([
+            {'op': 'add', 'book_id': books[0].id, 'tag': BookshelfTag.WANTED},
+            {'op': 'add', 'book_id': books[1].id, 'tag': BookshelfTag.WANTED},
+        ]).json()
+
+        self.assertEqual([r['status'] for r in data['results']], ['unchanged', 'updated'])
+        self.assertEqual(BookshelfItem.objects.filter(bookshelf=shelf).count(), 2)
+
+    def test_per_operation_errors(self):
+        """Invalid operations are reported without blocking the valid ones."""
+        book = self._books(1)[0]
+        data = self._post([
+            {'op': 'add', 'book_id': book.id},
+            {'op': 'add', 'book_id': book.id},
+            {'op': 'add', 'book_id': 999999},
+            {'op': 'retag', 'book_id': 888888, 'tag': BookshelfTag.READ},
+            {'op': 'remove', 'book_id': 777777},
+            {'op': 'retag', 'book_id': 5},
+            {'op': 'shred', 'book_id': 6},
+            {'op': 'add', 'book_id': 'seven'},
+            'not an object',
+        ]).json()
+
+        statuses = [r['status'] for r in data['results']]
+        self.assertEqual(statuses[0], 'created')
+        self.assertTrue(all(status == 'error' for status in statuses[1:]))
+        self.assertEqual(data['results'][2]['error'], 'Book not found.')
+        self.assertEqual(BookshelfItem.objects.get().tag, BookshelfTag.UNTAGGED)
+
+    def test_query_count_does_not_grow_with_operations(self):
+        """Ten or two hundred operations run the same statements."""
+        books = self._books(400)
+        Bookshelf.objects.create(user=self.user)
+        small = [{'op': 'add', 'book_id': b.id, 'tag': BookshelfTag.WANTED} for b in books[:10]]
+        large = [{'op': 'add', 'book_id': b.id, 'tag': BookshelfTag.WANTED} for b in books[200:400]]
+
+        # session, user, shelf, savepoint, shelf lock, books, items, insert, counters, change log, release
+        with self.assertNumQueries(11):
+            self._post(small)
+        with self.assertNumQueries(11):
+            self._post(large)
+
+    def test_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='importer', password='pass123')
+        book = self._books(1)[0]
+        body = json.dumps({'operations': [{'op': 'add', 'book_id': book.id}]})
+        self.assertEqual(client.post(self.url, body, content_type='application/json').status_code, 403)
+        self.assertFalse(BookshelfItem.objects.exists())
+
+    def test_thousands_of_operations(self):
+        """Requests larger than one chunk are applied completely."""
+        books = self._books(1200)
+        data = self._post([{'op': 'add', 'book_id': b.id, 'tag': BookshelfTag.WANTED} for b in books]).json()
+        self.assertEqual(data['summary'], {'created': 1200})
+
+        data = self._post(
+            [{'op': 'retag', 'book_id': b.id, 'tag': BookshelfTag.READ} for b in books[:700]]
+            + [{'op': 'remove', 'book_id': b.id} for b in books[700:]]
+        ).json()
+        self.assertEqual(data['summary'], {'updated': 700, 'removed': 500})
+        self.assertEqual(BookshelfItem.objects.filter(tag=BookshelfTag.READ).count(), 700)
+        self.assertEqual(BookshelfItem.objects.count(), 700)
+
+    def test_rejects_malformed_body(self):
+        """Envelope problems fail the whole request with 400."""
+        for body in ('not json', json.dumps([]), json.dumps({'operations': []})):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        too_many = [{'op': 'remove', 'book_id': i} for i in range(5001)]
+        self.assertEqual(self._post(too_many).status_code, 400)
+
+    def test_requires_login_and_post(self):
+        """Anonymous users are redirected and GET is not allowed."""
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self._post([{'op': 'remove', 'book_id': 1}]).status_code, 302)
+
+
+class ShelfCacheTest(TestCase):
+    """Tests for the per-user shelf page cache."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='cached', password='pass123')
+        self.bookshelf = Bookshelf.objects.create(user=self.user)
+        self.book = Book.objects.create(title='Cached Book', author='Author', course='MC102')
+        self.client.login(username='cached', password='pass123')
+        self.url = reverse('bookshelves:shelf_items_api')
+        reset_cache_stats()
+
+    def _titles(self):
+        return [item['book']['title'] for item in self.client.get(self.url).json()['items']]
+
+    def test_repeated_views_hit_the_cache(self):
+        """The second view skips the shelf query."""
+        self.bookshelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('bookshelves:bookshelf'))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('bookshelves:bookshelf'))
+        self.assertEqual(response.context['items'][0]['book']['title'], 'Cached Book')
+        self.assertEqual(cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_add_or_update_item_invalidates(self):
+        self.assertEqual(self._titles(), [])
+        self.bookshelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self.assertEqual(self._titles(), ['Cached Book'])
+
+    def test_update_tag_invalidates(self):
+        item, _ = self.bookshelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self._titles()
+        self.client.post(
+            reverse('bookshelves:update_tag'),
+            json.dumps({'id': item.id, 'tag': BookshelfTag.READ}),
+            content_type='application/json',
+        )
+        self.assertEqual(self.client.get(self.url).json()['items'][0]['tag'], BookshelfTag.READ)
+
+    def test_remove_invalidates(self):
+        self.bookshelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self._titles()
+        self.client.post(reverse('bookshelves:remove_from_bookshelf', args=[self.book.id]))
+        self.assertEqual(self._titles(), [])
+
+    def test_bulk_invalidates(self):
+        self._titles()
+        self.client.post(
+            reverse('bookshelves:shelf_bulk_api'),
+            json.dumps({'operations': [{'op': 'add', 'book_id': self.book.id}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(self._titles(), ['Cached Book'])
+
+    def test_book_update_invalidates(self):
+        """Editing a book shows up on every shelf holding it."""
+        self.bookshelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self._titles()
+        self.book.title = 'Renamed Book'
+        self.book.save()
+        self.assertEqual(self._titles(), ['Renamed Book'])
+
+    def test_other_users_shelves_are_not_invalidated(self):
+        """A change on one shelf leaves other users' cached pages alone."""
+        self.bookshelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self._titles()
+        other = User.objects.create_user(username='other_reader', password='pass123')
+        Bookshelf.objects.create(user=other).add_or_update_item(self.book, BookshelfTag.READ)
+
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+    def test_stats_command(self):
+        self._titles()
+        self._titles()
+        out = StringIO()
+        call_command('shelf_cache_stats', '--reset', stdout=out)
+        self.assertIn('hits=1 misses=1 hit_rate=50.00%', out.getvalue())
+        self.assertEqual(cache_stats()['hits'], 0)
+
+
+class ShelfTagCountTest(TestCase):
+    """Tests for the denormalized per-tag counters on Bookshelf."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='counter', password='pass123')
+        self.bookshelf = Bookshelf.objects.create(user=self.user)
+        self.books = [Book.objects.create(title=f'Book {i}', author='Author', course='MC102') for i in range(3)]
+
+    def _counts(self):
+        self.bookshelf.refresh_from_db()
+        return self.bookshelf.tag_counts
+
+    def test_add_or_update_item_moves_counts(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.WANTED)
+        self.assertEqual(self._counts(), {'0': 0, '1': 2, '2': 0, '3': 0})
+
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.READ)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.WANTED)
+        self.assertEqual(self._counts(), {'0': 0, '1': 1, '2': 0, '3': 1})
+
+    def test_item_save_and_delete_move_counts(self):
+        item = BookshelfItem.objects.create(book=self.books[0], bookshelf=self.bookshelf, tag=BookshelfTag.READING)
+        self.assertEqual(self._counts()[BookshelfTag.READING], 1)
+
+        item.tag = BookshelfTag.READ
+        item.save()
+        self.assertEqual(self._counts(), {'0': 0, '1': 0, '2': 0, '3': 1})
+
+        item.delete()
+        self.assertEqual(self._counts(), {'0': 0, '1': 0, '2': 0, '3': 0})
+
+    def test_remove_book_moves_counts(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.assertTrue(self.bookshelf.remove_book(self.books[0]))
+        self.assertFalse(self.bookshelf.remove_book(self.books[0]))
+        self.assertEqual(self._counts()[BookshelfTag.WANTED], 0)
+
+    def test_cascaded_deletes_move_counts(self):
+        """Deleting a book or a queryset of items keeps the counters right."""
+        other = Bookshelf.objects.create(user=User.objects.create_user(username='counter2'))
+        for book in self.books:
+            self.bookshelf.add_or_update_item(book, BookshelfTag.WANTED)
+        other.add_or_update_item(self.books[0], BookshelfTag.READ)
+
+        self.books[0].delete()
+        self.assertEqual(self._counts(), {'0': 0, '1': 2, '2': 0, '3': 0})
+        other.refresh_from_db()
+        self.assertEqual(other.tag_counts[BookshelfTag.READ], 0)
+
+        BookshelfItem.objects.filter(book=self.books[1]).delete()
+        self.assertEqual(self._counts(), {'0': 0, '1': 1, '2': 0, '3': 0})
+
+    def test_bulk_operations_move_counts(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.WANTED)
+        apply_bulk(self.bookshelf, [
+            {'op': 'retag', 'book_id': self.books[0].id, 'tag': BookshelfTag.READ},
+            {'op': 'remove', 'book_id': self.books[1].id},
+            {'op': 'add', 'book_id': self.books[2].id, 'tag': BookshelfTag.READING},
+        ])
+        self.assertEqual(self._counts(), {'0': 0, '1': 0, '2': 1, '3': 1})
+
+    def test_save_does_not_overwrite_counters(self):
+        """A stale Bookshelf instance cannot clobber counters on save()."""
+        stale = Bookshelf.objects.get(pk=self.bookshelf.pk)
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        stale.save()
+        self.assertEqual(self._counts()[BookshelfTag.WANTED], 1)
+
+    def test_counts_shown_on_page(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.READ)
+        client = Client()
+        client.login(username='counter', password='pass123')
+        response = client.get(reverse('bookshelves:bookshelf'))
+        self.assertContains(response, 'All (2)')
+        self.assertContains(response, 'Wanted (1)')
+        self.assertContains(response, 'Reading (0)')
+
+    def test_repair_command_fixes_drift(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.READ)
+        Bookshelf.objects.filter(pk=self.bookshelf.pk).update(untagged_count=7, read_count=0)
+
+        out = StringIO()
+        call_command('repair_shelf_counts', stdout=out)
+        self.assertIn('Repaired 1 bookshelf(s).', out.getvalue())
+        self.assertEqual(self._counts(), {'0': 0, '1': 1, '2': 0, '3': 1})
+
+        out = StringIO()
+        call_command('repair_shelf_counts', stdout=out)
+        self.assertIn('Repaired 0 bookshelf(s).', out.getvalue())
+
+    def test_recount_uses_one_group_by(self):
+        """Checking every shelf costs one aggregate query plus one shelf scan."""
+        with self.assertNumQueries(2):
+            Bookshelf.recount_tags()
+
+
+class ShelfChangesAPITest(TestCase):
+    """Tests for the /bookshelves/api/changes/ delta sync endpoint."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='syncer', password='pass123')
+        self.bookshelf = Bookshelf.objects.create(user=self.user)
+        self.books = [Book.objects.create(title=f'Book {i}', author='Author', course='MC102') for i in range(3)]
+        self.client.login(username='syncer', password='pass123')
+        self.url = reverse('bookshelves:shelf_changes_api')
+
+    def _sync(self, since=None):
+        params = {'since': since} if since is not None else {}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_initial_sync_returns_whole_shelf(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.READ)
+
+        data = self._sync()
+
+        self.assertEqual([c['op'] for c in data['changes']], ['upsert', 'upsert'])
+        self.assertEqual(data['changes'][1]['item']['tag'], BookshelfTag.READ)
+        self.assertEqual(data['changes'][1]['item']['book']['title'], 'Book 1')
+        self.assertFalse(data['has_more'])
+
+    def test_delta_returns_only_new_changes(self):
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.WANTED)
+        token = self._sync()['next_token']
+
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.READING)
+        self.bookshelf.remove_book(self.books[1])
+        data = self._sync(token)
+
+        self.assertEqual(data['changes'], [
+            {'op': 'upsert', 'book_id': self.books[0].id, 'item': data['changes'][0]['item']},
+            {'op': 'delete', 'book_id': self.books[1].id},
+        ])
+        self.assertEqual(data['changes'][0]['item']['tag'], BookshelfTag.READING)
+        self.assertEqual(self._sync(data['next_token'])['changes'], [])
+
+    def test_changes_to_one_book_collapse(self):
+        token = self._sync()['next_token']
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.READ)
+        self.bookshelf.remove_book(self.books[0])
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.READING)
+
+        changes = self._sync(token)['changes']
+
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['item']['tag'], BookshelfTag.READING)
+
+    def test_every_write_path_is_logged(self):
+        """Tag updates, item saves/deletes and bulk operations all leave entries."""
+        token = self._sync()['next_token']
+        item = BookshelfItem.objects.create(book=self.books[0], bookshelf=self.bookshelf)
+        self.client.post(
+            reverse('bookshelves:update_tag'),
+            json.dumps({'id': item.id, 'tag': BookshelfTag.READ}),
+            content_type='application/json',
+        )
+        apply_bulk(self.bookshelf, [
+            {'op': 'add', 'book_id': self.books[1].id},
+            {'op': 'add', 'book_id': self.books[2].id},
+        ])
+        BookshelfItem.objects.get(book=self.books[2]).delete()
+
+        changes = self._sync(token)['changes']
+
+        self.assertEqual(
+            [(c['book_id'], c['op']) for c in changes],
+            [(self.books[0].id, 'upsert'), (self.books[1].id, 'upsert'), (self.books[2].id, 'delete')],
+        )
+        self.assertEqual(changes[0]['item']['tag'], BookshelfTag.READ)
+
+    def test_deleted_book_leaves_tombstone(self):
+        """Items cascaded from a deleted book show up as deletes."""
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.bookshelf.add_or_update_item(self.books[1], BookshelfTag.READ)
+        token = self._sync()['next_token']
+
+        book_id = self.books[0].id
+        self.books[0].delete()
+
+        self.assertEqual(self._sync(token)['changes'], [{'op': 'delete', 'book_id': book_id}])
+        self.assertEqual(ShelfChange.objects.filter(op=ShelfChange.Op.DELETE).count(), 1)
+
+    def test_deleting_the_user_drops_the_shelf(self):
+        """A shelf deleted with its user takes its items and change log along."""
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.WANTED)
+        self.user.delete()
+        self.assertFalse(Bookshelf.objects.exists())
+        self.assertFalse(ShelfChange.objects.exists())
+
+    def test_delta_cost_does_not_depend_on_shelf_size(self):
+        apply_bulk(self.bookshelf, [{'op': 'add', 'book_id': b.id} for b in self.books])
+        token = self._sync()['next_token']
+        self.bookshelf.add_or_update_item(self.books[0], BookshelfTag.READ)
+
+        # session, user, change log, upserted items
+        with self.assertNumQueries(4):
+            data = self._sync(token)
+        self.assertEqual(len(data['changes']), 1)
+
+    def test_paging_with_has_more(self):
+        apply_bulk(self.bookshelf, [{'op': 'add', 'book_id': b.id} for b in self.books])
+        page = get_shelf_changes(self.user, since=0, limit=2)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(len(page['changes']), 2)
+
+        page = get_shelf_changes(self.user, since=page['next_token'], limit=2)
+        self.assertFalse(page['has_more'])
+        self.assertEqual([c['book_id'] for c in page['changes']], [self.books[2].id])
+
+    def test_other_users_changes_are_hidden(self):
+        other = User.objects.create_user(username='other_syncer', password='pass123')
+        Bookshelf.objects.create(user=other).add_or_update_item(self.books[0], BookshelfTag.READ)
+        self.assertEqual(self._sync()['changes'], [])
+
+    def test_invalid_token(self):
+        for since in ('abc', '²'):
+            response = self.client.get(self.url, {'since': since})
+            self.assertEqual(response.status_code, 400)
+
+
+class ShelfExportTest(TestCase):
+    """Tests for the streaming shelf exports."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='123')
+        self.other = User.objects.create_user(username='other', password='123')
+        self.staff = User.objects.create_user(username='staff', password='123', is_staff=True)
+        self.book = Book.objects.create(title='Cálculo, Vol. 1', author='Stewart', course='MA111')
+        self.other_book = Book.objects.create(title='Physics', author='Halliday', course='F128')
+        Bookshelf.objects.create(user=self.user).add_or_update_item(self.book, BookshelfTag.WANTED)
+        Bookshelf.objects.create(user=self.other).add_or_update_item(self.other_book, BookshelfTag.READ)
+        self.client.login(username='reader', password='123')
+
+    def _content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_of_own_shelf(self):
+        response = self.client.get(reverse('bookshelves:shelf_export_api'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('filename="bookshelf.csv"', response['Content-Disposition'])
+
+        rows = list(csv.reader(self._content(response).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0], ['book_id', 'title', 'author', 'course', 'isbn', 'tag', 'added_at'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][1:4], ['Cálculo, Vol. 1', 'Stewart', 'MA111'])
+        self.assertEqual(rows[1][5], 'Wanted')
+
+    def test_gzipped_json_export(self):
+        response = self.client.get(reverse('bookshelves:shelf_export_api'), {'format': 'json', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('filename="bookshelf.json.gz"', response['Content-Disposition'])
+
+        data = json.loads(gzip.decompress(self._content(response)))
+        self.assertEqual([row['book_id'] for row in data], [self.book.id])
+        self.assertEqual(data[0]['tag'], 'Wanted')
+
+    def test_invalid_format(self):
+        response = self.client.get(reverse('bookshelves:shelf_export_api'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_export_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('bookshelves:shelf_export_all_api')).status_code, 403)
+
+        self.client.login(username='staff', password='123')
+        response = self.client.get(reverse('bookshelves:shelf_export_all_api'), {'format': 'json'})
+        data = json.loads(self._content(response))
+        self.assertEqual(
+            sorted((row['user_id'], row['book_id']) for row in data),
+            sorted([(self.user.id, self.book.id), (self.other.id, self.other_book.id)]),
+        )
+
+    def test_chunked_encoding(self):
+        rows = ([i, 'x'] for i in range(5))
+        chunks = list(csv_chunks(['id', 'value'], rows, batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks).splitlines(), ['id,value'] + [f'{i},x' for i in range(5)])
+        self.assertEqual(gzip.decompress(b''.join(gzip_chunks([b'ab', b'cd']))), b'abcd')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_shelves', '--user', 'reader', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.json.gz')
+            call_command('export_shelves', '--format', 'json', '--gzip', '--output', path, stderr=StringIO())
+            with gzip.open(path) as dump:
+                self.assertEqual(len(json.load(dump)), 2)
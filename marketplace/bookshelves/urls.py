@@ -8,4 +8,9 @@ urlpatterns = [
     path('bookshelf/', views.bookshelf_view, name='bookshelf'),
     path('bookshelf/remove/<int:book_id>/', views.remove_from_bookshelf, name='remove_from_bookshelf'),
     path('update_tag/', views.update_tag, name='update_tag'),
+    path('api/items/', views.shelf_items_api, name='shelf_items_api'),
+    path('api/bulk/', views.shelf_bulk_api, name='shelf_bulk_api'),
+    path('api/changes/', views.shelf_changes_api, name='shelf_changes_api'),
+    path('api/export/', views.shelf_export_api, name='shelf_export_api'),
+    path('api/export/all/', views.shelf_export_all_api, name='shelf_export_all_api'),
 ]
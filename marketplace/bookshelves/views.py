@@ -1,18 +1,24 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 import json
 
+from .bulk import apply_bulk, validate_bulk
+from .export import CONTENT_TYPES, export_filename, stream_export
 from .models import Bookshelf, BookshelfItem, BookshelfTag
+from .read_models import (
+    SHELF_PAGE_SIZE, get_shelf_changes, get_shelf_page, parse_change_token, parse_page_params,
+)
 from books.models import Book
+from marketplace.utils import status_summary
 
 
 @login_required
 def remove_from_bookshelf(request, book_id):
     book = get_object_or_404(Book, id=book_id)
     bookshelf = get_object_or_404(Bookshelf, user=request.user)
-    BookshelfItem.objects.filter(book=book, bookshelf=bookshelf).delete()
+    bookshelf.remove_book(book)
     return redirect('bookshelves:bookshelf')
 
 
@@ -23,7 +29,9 @@ def update_tag(request):
         item_id = data.get('id')
         new_tag = data.get('tag')
         try:
-            item = BookshelfItem.objects.get(id=item_id, bookshelf__user=request.user)
+            item = BookshelfItem.objects.select_related('bookshelf').get(
+                id=item_id, bookshelf__user=request.user
+            )
             
             # Validate that the tag value is valid
             if new_tag not in [choice[0] for choice in BookshelfTag.choices]:
@@ -38,15 +46,112 @@ def update_tag(request):
 
 @login_required
 def bookshelf_view(request):
-    bookshelf, created = Bookshelf.objects.get_or_create(user=request.user)
-    
+    try:
+        tag, after, limit = parse_page_params(request.GET)
+    except ValueError:
+        tag, after, limit = None, None, SHELF_PAGE_SIZE
+    page = get_shelf_page(request.user, tag=tag, after=after, limit=limit)
+
     # Provide tag choices to template to eliminate shotgun surgery
     context = {
-        'bookshelf': bookshelf,
+        'items': page['items'],
+        'next_cursor': page['next_cursor'],
+        'tag': tag,
+        'tag_filters': [
+            (value, label, page['tag_counts'][value]) for value, label in BookshelfTag.choices
+        ],
+        'total_count': sum(page['tag_counts'].values()),
         'tag_choices': BookshelfTag.choices,
         'tag_choices_json': json.dumps(dict(BookshelfTag.choices))
     }
-    
+
     return render(request, 'bookshelves/bookshelf.html', context)
 
 
+@require_GET
+@login_required
+def shelf_items_api(request):
+    """API endpoint returning one keyset-paginated page of the user's shelf."""
+    try:
+        tag, after, limit = parse_page_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    page = get_shelf_page(request.user, tag=tag, after=after, limit=limit)
+    items = [_serialize_item(item) for item in page['items']]
+    return JsonResponse({'items': items, 'next_cursor': page['next_cursor'], 'tag_counts': page['tag_counts']})
+
+
+@require_GET
+@login_required
+def shelf_changes_api(request):
+    """API endpoint returning shelf changes since a change token (delta sync)."""
+    try:
+        since = parse_change_token(request.GET.get('since'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    result = get_shelf_changes(request.user, since=since)
+    for change in result['changes']:
+        if 'item' in change:
+            change['item'] = _serialize_item(change['item'])
+    return JsonResponse({
+        'changes': result['changes'],
+        'next_token': str(result['next_token']),
+        'has_more': result['has_more'],
+    })
+
+
+@require_POST
+@login_required
+def shelf_bulk_api(request):
+    """API endpoint applying many add/retag/remove operations in one transaction."""
+    try:
+        operations = validate_bulk(json.loads(request.body))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format in request body.'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    bookshelf, _ = Bookshelf.get_or_create_for_user(request.user)
+    results = apply_bulk(bookshelf, operations)
+
+    return JsonResponse({'results': results, 'summary': status_summary(results)})
+
+
+@require_GET
+@login_required
+def shelf_export_api(request):
+    """Download the user's shelf as CSV or JSON (``?format=``, ``?gzip=1``)."""
+    return _export_response(request, user=request.user)
+
+
+@require_GET
+@login_required
+def shelf_export_all_api(request):
+    """Staff-only download of every shelf, for research dumps."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required.'}, status=403)
+    return _export_response(request, user=None, name='bookshelves')
+
+
+def _export_response(request, user, name='bookshelf'):
+    fmt = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') == '1'
+    try:
+        chunks = stream_export(fmt, user=user, compress=compress)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    content_type = 'application/gzip' if compress else f'{CONTENT_TYPES[fmt]}; charset=utf-8'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress, name)}"'
+    return response
+
+
+def _serialize_item(item):
+    return dict(
+        item,
+        added_at=item['added_at'].isoformat(),
+        book=dict(item['book'], created_at=item['book']['created_at'].isoformat()),
+    )
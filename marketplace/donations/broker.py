@@ -0,0 +1,125 @@
+"""
+In-process fan-out of DonationEvent rows to Server-Sent Events streams.
+
+Each open stream owns one bounded ``asyncio.Queue``, registered under the
+id of the user it belongs to, in the state kept for its event loop. An event is put on the queues of its donor
+and of its requester, so an idle connection costs a queue and a suspended
+coroutine, and delivering an event costs a dict lookup per recipient,
+whatever the number of connections.
+
+Events reach the broker from two sources: transitions committed in this
+process publish their events directly (``publish`` is thread-safe, so sync
+views can call it), and donations.streams polls the event log by id to
+pick up events written by other workers and by management commands. The
+broker remembers recently delivered ids, so an event seen by both sources
+is delivered once.
+"""
+import asyncio
+import threading
+import weakref
+from collections import deque
+
+QUEUE_SIZE = 100
+
+# Delivered event ids remembered to drop duplicates.
+RECENT_EVENTS = 10000
+
+
+class LoopState:
+    """Streams of one event loop: their queues, recent ids and log poller."""
+
+    def __init__(self, recent):
+        self.subscribers = {}
+        self.recent = deque(maxlen=recent)
+        self.recent_ids = set()
+        # Set by donations.streams: the event log poller task of this loop
+        # and a future resolved once it has read its start position.
+        self.poller = None
+        self.poller_started = None
+
+
+class EventBroker:
+    def __init__(self, queue_size=QUEUE_SIZE, recent=RECENT_EVENTS):
+        self.queue_size = queue_size
+        self.recent = recent
+        # Queues and pollers belong to the loop that created them; a server
+        # runs one loop, but each async_to_sync call runs its own.
+        self._loops = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def state(self):
+        """The LoopState of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loops.get(loop)
+            if state is None:
+                state = self._loops[loop] = LoopState(self.recent)
+        return state
+
+    def _states(self):
+        with self._lock:
+            return list(self._loops.items())
+
+    @property
+    def active(self):
+        """Whether any stream is subscribed, on any loop."""
+        return any(state.subscribers for _, state in self._states())
+
+    def subscribe(self, user_id):
+        """
+        Register a stream for ``user_id``; must run on the event loop.
+
+        Returns:
+            asyncio.Queue: Receives the user's events. Its ``overflowed``
+                           attribute is set if the stream fell behind and
+                           was dropped.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.overflowed = False
+        self.state().subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        subscribers = self.state().subscribers
+        queues = subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del subscribers[user_id]
+
+    def publish(self, events):
+        """Hand ``events`` to every loop with streams; callable from any thread."""
+        events = list(events)
+        for loop, state in self._states():
+            if not state.subscribers:
+                continue
+            try:
+                loop.call_soon_threadsafe(self.dispatch, events)
+            except RuntimeError:
+                # The loop was closed in the meantime.
+                with self._lock:
+                    self._loops.pop(loop, None)
+
+    def dispatch(self, events):
+        """Put each new event on its donor's and requester's queues; runs on the loop."""
+        state = self.state()
+        for event in events:
+            if event.id in state.recent_ids:
+                continue
+            if len(state.recent) == state.recent.maxlen:
+                state.recent_ids.discard(state.recent[0])
+            state.recent.append(event.id)
+            state.recent_ids.add(event.id)
+
+            for user_id in {event.donor_id, event.requester_id} - {None}:
+                for queue in list(state.subscribers.get(user_id, ())):
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        # A stalled client is dropped rather than buffered
+                        # without bound; it reconnects with Last-Event-ID.
+                        queue.overflowed = True
+                        self.unsubscribe(user_id, queue)
+
+
+broker = EventBroker()
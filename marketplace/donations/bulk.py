@@ -0,0 +1,179 @@
+"""
+Bulk donor actions.
+
+Listing many books, or approving or rejecting many requests, costs a
+fixed number of set-based statements per chunk of ids instead of several
+queries per id: one lookup, one bulk insert or conditional UPDATE, and
+one DonationEvent bulk insert, all in a single transaction. Each id gets
+its own outcome, so one bad id doesn't fail the rest.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from books.models import Book
+from marketplace.utils import chunks
+
+from .models import (
+    DonationEvent,
+    DonationListing,
+    DonationRequest,
+    DonationStatus,
+    adjust_available_counts,
+)
+
+BULK_MAX_IDS = 1000
+
+
+def validate_bulk_ids(payload, key):
+    """
+    Validate a bulk request body of the form ``{key: [id, ...]}``.
+
+    Returns:
+        list: The ids, duplicates removed, in request order
+
+    Raises:
+        ValueError: If the payload is malformed
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get(key), list):
+        raise ValueError(f"Body must be an object with a '{key}' list.")
+    ids = payload[key]
+    if not ids:
+        raise ValueError("At least one id is required.")
+    if len(ids) > BULK_MAX_IDS:
+        raise ValueError(f"At most {BULK_MAX_IDS} ids per request.")
+    if any(not isinstance(value, int) or isinstance(value, bool) for value in ids):
+        raise ValueError("Ids must be integers.")
+    return list(dict.fromkeys(ids))
+
+
+def _insert_listings(user, book_ids):
+    """
+    Insert available listings of ``book_ids`` for ``user``, one statement per chunk.
+
+    Rows that already exist (e.g. from a concurrent single add) are skipped
+    by ON CONFLICT; RETURNING reports only the rows this call inserted.
+
+    Returns:
+        dict: book id -> id of the listing created
+    """
+    table = DonationListing._meta.db_table
+    quote = connection.ops.quote_name
+    added_at = DonationListing._meta.get_field('added_at').get_db_prep_save(timezone.now(), connection)
+    columns = ', '.join(quote(column) for column in ('book_id', 'donor_id', 'status', 'added_at'))
+    created = {}
+    with connection.cursor() as cursor:
+        for chunk in chunks(book_ids):
+            cursor.execute(
+                f"INSERT INTO {quote(table)} ({columns}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))} "
+                f"ON CONFLICT ({quote('book_id')}, {quote('donor_id')}) DO NOTHING "
+                f"RETURNING {quote('book_id')}, {quote('id')}",
+                [value for book_id in chunk for value in (book_id, user.pk, DonationStatus.AVAILABLE, added_at)],
+            )
+            created.update(cursor.fetchall())
+    return created
+
+
+def bulk_add_listings(user, book_ids):
+    """
+    List many books for donation at once.
+
+    Returns:
+        list: One ``{"book_id", "status"}`` dict per id, with status
+              ``created``, ``exists`` or ``error`` (plus ``error``), and
+              ``listing_id`` unless it failed
+    """
+    with transaction.atomic():
+        books = set()
+        listed = {}
+        for chunk in chunks(book_ids):
+            books.update(Book.objects.filter(id__in=chunk).values_list('id', flat=True))
+            listed.update(
+                DonationListing.objects.filter(donor=user, book_id__in=chunk).values_list('book_id', 'id')
+            )
+
+        new = [book_id for book_id in book_ids if book_id in books and book_id not in listed]
+        created = _insert_listings(user, new)
+        # Listed concurrently by a single add, which logged and counted it.
+        raced = [book_id for book_id in new if book_id not in created]
+        for chunk in chunks(raced):
+            listed.update(
+                DonationListing.objects.filter(donor=user, book_id__in=chunk).values_list('book_id', 'id')
+            )
+        DonationEvent.record_many(
+            [(listing_id, book_id, user.pk, None) for book_id, listing_id in created.items()],
+            DonationEvent.Kind.LISTED,
+        )
+        adjust_available_counts({book_id: 1 for book_id in created})
+
+    outcomes = []
+    for book_id in book_ids:
+        if book_id in listed:
+            outcomes.append({'book_id': book_id, 'status': 'exists', 'listing_id': listed[book_id]})
+        elif book_id in created:
+            outcomes.append({'book_id': book_id, 'status': 'created', 'listing_id': created[book_id]})
+        else:
+            outcomes.append({'book_id': book_id, 'status': 'error', 'error': 'Book not found.'})
+    return outcomes
+
+
+def bulk_transition(user, listing_ids, approve):
+    """
+    Approve or reject pending requests on many of ``user``'s listings.
+
+    The pending rows are locked (``select_for_update``; SQLite serializes
+    writers anyway) and then moved with one conditional UPDATE per chunk.
+    Rejected listings with a queue are handed to the next person in line.
+
+    Returns:
+        list: One ``{"listing_id", "status"}`` dict per id, with status
+              ``approved``, ``rejected`` or ``error`` (plus ``error``)
+    """
+    kind = DonationEvent.Kind.APPROVED if approve else DonationEvent.Kind.REJECTED
+    if approve:
+        changes = {'status': DonationStatus.COMPLETED}
+    else:
+        changes = {'status': DonationStatus.AVAILABLE, 'requester': None, 'requested_at': None}
+
+    with transaction.atomic():
+        found = {}
+        for chunk in chunks(listing_ids):
+            found.update(
+                (row[0], row)
+                for row in DonationListing.objects.select_for_update()
+                .filter(id__in=chunk, donor=user)
+                .values_list('id', 'book_id', 'donor_id', 'requester_id', 'status')
+            )
+        pending = [listing_id for listing_id in listing_ids
+                   if listing_id in found and found[listing_id][4] == DonationStatus.PENDING]
+
+        for chunk in chunks(pending):
+            DonationListing.objects.filter(id__in=chunk, status=DonationStatus.PENDING).update(**changes)
+        DonationEvent.record_many([found[listing_id][:4] for listing_id in pending], kind)
+        if not approve:
+            # One listing per book and donor, so each book gains one copy.
+            adjust_available_counts({found[listing_id][1]: 1 for listing_id in pending})
+
+        if approve:
+            for chunk in chunks(pending):
+                DonationRequest.objects.filter(listing_id__in=chunk).delete()
+        else:
+            queued = set()
+            for chunk in chunks(pending):
+                queued.update(
+                    DonationRequest.objects.filter(listing_id__in=chunk).values_list('listing_id', flat=True)
+                )
+            for chunk in chunks(queued):
+                for listing in DonationListing.objects.filter(id__in=chunk):
+                    listing._promote_next()
+
+    done = 'approved' if approve else 'rejected'
+    outcomes = []
+    for listing_id in listing_ids:
+        if listing_id not in found:
+            outcomes.append({'listing_id': listing_id, 'status': 'error', 'error': 'Listing not found.'})
+        elif found[listing_id][4] != DonationStatus.PENDING:
+            outcomes.append({'listing_id': listing_id, 'status': 'error', 'error': 'Listing is not pending.'})
+        else:
+            outcomes.append({'listing_id': listing_id, 'status': done})
+    return outcomes
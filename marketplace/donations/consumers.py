@@ -0,0 +1,165 @@
+"""
+Pull-based consumers of the DonationEvent log.
+
+Each consumer reads events in id order, a batch at a time, and advances
+its own JobCheckpoint (a compare-and-set from the position the batch was
+read at) in the same transaction as its writes, so database writes happen
+exactly once per event, even when two runs overlap. Handlers with outside side effects
+(e.g. sending email) would see a batch again after a crash. Consumers run
+from the run_donation_consumers command, off the request path, and add no
+cost to the transitions themselves.
+"""
+from django.db import transaction
+
+from books.models import Book
+from jobs.models import JobCheckpoint, StaleCheckpoint
+
+from . import stats
+from .models import DonationEvent, DonationMatch, DonationNotification
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class EventConsumer:
+    """Base class: subclasses set ``name`` and implement ``handle``."""
+
+    name = None
+    batch_size = DEFAULT_BATCH_SIZE
+
+    @property
+    def checkpoint(self):
+        return f"donations.events.{self.name}"
+
+    def handle(self, events):
+        """Process one batch of DonationEvent instances, in id order."""
+        raise NotImplementedError
+
+    def run(self, max_batches=None):
+        """
+        Consume events logged since the last checkpoint.
+
+        Args:
+            max_batches: Stop after this many batches; None drains the log
+
+        Returns:
+            int: Number of events processed
+        """
+        position = JobCheckpoint.get_position(self.checkpoint) or 0
+        processed = batches = 0
+        while max_batches is None or batches < max_batches:
+            events = list(DonationEvent.objects.filter(id__gt=position).order_by('id')[:self.batch_size])
+            if not events:
+                break
+            try:
+                with transaction.atomic():
+                    self.handle(events)
+                    JobCheckpoint.advance(self.checkpoint, events[-1].id, expected=position)
+            except StaleCheckpoint:
+                # Another run applied this batch first; the rest is its job.
+                break
+            position = events[-1].id
+            processed += len(events)
+            batches += 1
+        return processed
+
+
+class NotificationConsumer(EventConsumer):
+    """Tell donors and requesters about changes to listings they are part of."""
+
+    name = 'notifications'
+
+    # kind -> (notify the donor?, message template)
+    MESSAGES = {
+        DonationEvent.Kind.REQUESTED: (True, 'Someone requested your copy of "{title}".'),
+        DonationEvent.Kind.CANCELLED: (True, 'A request for your copy of "{title}" was cancelled.'),
+        DonationEvent.Kind.PROMOTED: (False, 'You are next in line: "{title}" is now requested for you.'),
+        DonationEvent.Kind.APPROVED: (False, 'Your request for "{title}" was approved.'),
+        DonationEvent.Kind.REJECTED: (False, 'Your request for "{title}" was rejected.'),
+        DonationEvent.Kind.EXPIRED: (False, 'Your request for "{title}" expired without an answer.'),
+    }
+
+    def handle(self, events):
+        relevant = [event for event in events if event.kind in self.MESSAGES]
+        titles = dict(
+            Book.objects.filter(id__in={event.book_id for event in relevant}).values_list('id', 'title')
+        )
+        notifications = []
+        for event in relevant:
+            to_donor, template = self.MESSAGES[event.kind]
+            user_id = event.donor_id if to_donor else event.requester_id
+            if user_id is None:
+                continue
+            notifications.append(DonationNotification(
+                user_id=user_id,
+                event_id=event.id,
+                kind=event.kind,
+                listing_id=event.listing_id,
+                message=template.format(title=titles.get(event.book_id, 'a book'))[:300],
+            ))
+        DonationNotification.objects.bulk_create(notifications, ignore_conflicts=True)
+
+
+class StatsConsumer(EventConsumer):
+    """Keep the statistics rollups of donations.stats up to date."""
+
+    name = 'stats'
+    track_status = True
+
+    def handle(self, events):
+        stats.apply_events(events, track_status=self.track_status)
+
+
+class MatchingConsumer(EventConsumer):
+    """Drop wishlist matches as soon as their listing is donated."""
+
+    name = 'matching'
+
+    def handle(self, events):
+        done = [event.listing_id for event in events if event.kind == DonationEvent.Kind.APPROVED]
+        if done:
+            DonationMatch.objects.filter(listing_id__in=done).delete()
+
+
+CONSUMERS = {consumer.name: consumer for consumer in (NotificationConsumer, StatsConsumer, MatchingConsumer)}
+
+
+def run_consumers(names=None, max_batches=None):
+    """
+    Run the named consumers (all by default).
+
+    Returns:
+        dict: consumer name -> number of events processed
+    """
+    return {
+        name: CONSUMERS[name]().run(max_batches=max_batches)
+        for name in (names or CONSUMERS)
+    }
+
+
+REBUILD_BATCH_SIZE = 5000
+
+
+def rebuild_stats():
+    """
+    Recompute the statistics rollups from scratch.
+
+    Replays the whole event log into emptied rollup tables, then counts
+    listings per course and status directly, which also covers listings
+    older than the log. Runs in one transaction and leaves the stats
+    consumer's checkpoint at the last event replayed. On databases with
+    concurrent writers (PostgreSQL, READ COMMITTED) run it while listings
+    are quiet, or a transition committed mid-rebuild counts twice in
+    DonationStatusCount.
+
+    Returns:
+        int: Number of events replayed
+    """
+    consumer = StatsConsumer()
+    consumer.track_status = False
+    consumer.batch_size = REBUILD_BATCH_SIZE
+    with transaction.atomic():
+        stats.clear_rollups()
+        JobCheckpoint.advance(consumer.checkpoint, 0)
+        replayed = consumer.run()
+        stats.count_statuses()
+    return replayed
@@ -0,0 +1,68 @@
+"""
+Expiry of stale pending donation requests.
+
+A listing left PENDING because the donor never answered is handed back
+to circulation once its request is older than ``REQUEST_TTL_DAYS``. The
+sweep is set-based, whatever the number of stale rows:
+
+1. one locking SELECT, over the partial (requested_at) WHERE status = 'P'
+   index, collects the stale rows with their requesters;
+2. one conditional UPDATE per chunk of ids moves them to AVAILABLE;
+3. one bulk INSERT logs an ``expired`` DonationEvent per row;
+4. one UPDATE per chunk adds them to their books' available_count.
+
+All of it runs in one transaction. The UPDATE only matches rows still
+PENDING and the rows are locked (SQLite serializes writers anyway), so
+a concurrent sweeper or approve/reject never gets a row expired twice,
+and rerunning the sweep is a no-op. Queued requesters of the listings
+this sweep expired are then promoted one listing at a time.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from marketplace.utils import chunks
+
+from .models import DonationEvent, DonationListing, DonationStatus, adjust_available_counts
+
+REQUEST_TTL_DAYS = 14
+
+
+def expire_pending_requests(days=REQUEST_TTL_DAYS, now=None):
+    """
+    Return PENDING listings requested more than ``days`` ago to AVAILABLE.
+
+    Args:
+        days: Age after which a pending request expires
+        now: Current time (for tests)
+
+    Returns:
+        int: Number of requests expired
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=days)
+
+    with transaction.atomic():
+        stale = list(
+            DonationListing.objects.select_for_update()
+            .filter(status=DonationStatus.PENDING, requested_at__lt=cutoff)
+            .values_list('id', 'book_id', 'donor_id', 'requester_id')
+        )
+        if not stale:
+            return 0
+        expired_ids = [row[0] for row in stale]
+        for chunk in chunks(expired_ids):
+            DonationListing.objects.filter(id__in=chunk, status=DonationStatus.PENDING).update(
+                status=DonationStatus.AVAILABLE, requester=None, requested_at=None
+            )
+        DonationEvent.record_many(stale, DonationEvent.Kind.EXPIRED)
+        # Several donors can list the same book.
+        adjust_available_counts(Counter(row[1] for row in stale))
+
+    for chunk in chunks(expired_ids):
+        for listing in DonationListing.objects.filter(id__in=chunk, queue__isnull=False).distinct():
+            with transaction.atomic():
+                listing._promote_next()
+    return len(stale)
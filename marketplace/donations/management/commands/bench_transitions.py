@@ -0,0 +1,121 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+
+from books.models import Book
+from donations.models import DonationListing
+
+BENCH_PREFIX = "bench-transitions"
+# Lock conflicts retried per attempt before the run is aborted.
+MAX_ATTEMPTS = 100
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark DonationListing state transitions: sequential latency and queries per "
+        "transition, then threads racing to request the same listing. Scratch rows are "
+        "created and deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--threads", type=int, default=4)
+
+    def handle(self, *args, **options):
+        iterations, threads = options["iterations"], options["threads"]
+        donor = User.objects.create_user(username=f"{BENCH_PREFIX}-donor")
+        requesters = [User.objects.create_user(username=f"{BENCH_PREFIX}-{i}") for i in range(max(threads, 1))]
+        book = Book.objects.create(title=BENCH_PREFIX, author=BENCH_PREFIX, course=BENCH_PREFIX)
+        try:
+            listing = DonationListing.add_listing(book, donor)
+            self._sequential(listing, requesters[0], iterations)
+            if threads > 1:
+                self._contended(listing.id, requesters, iterations)
+        finally:
+            book.delete()
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def _sequential(self, listing, requester, iterations):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(iterations):
+                listing.request_donation(requester)
+                listing.cancel_donation(requester)
+        elapsed = time.perf_counter() - start
+        transitions = 2 * iterations
+        self.stdout.write(
+            f"Sequential: {transitions} transitions, {len(queries) / transitions:.2f} queries each, "
+            f"{elapsed / transitions * 1e6:.0f} us each."
+        )
+
+    def _contended(self, listing_id, requesters, rounds):
+        barrier = threading.Barrier(len(requesters) + 1)
+        wins = [0] * len(requesters)
+        failures = [0] * len(requesters)
+        retries = [0] * len(requesters)
+
+        errors = []
+
+        def worker(position, user):
+            try:
+                for _ in range(rounds):
+                    barrier.wait()  # listing reset
+                    listing = DonationListing.objects.get(id=listing_id)
+                    barrier.wait()  # everyone holds an AVAILABLE instance
+                    for _ in range(MAX_ATTEMPTS):
+                        try:
+                            listing.request_donation(user)
+                            wins[position] += 1
+                        except ValueError:
+                            failures[position] += 1
+                        except OperationalError:
+                            # SQLite without a busy timeout (e.g. shared
+                            # in-memory databases) reports lock conflicts.
+                            retries[position] += 1
+                            continue
+                        break
+                    else:
+                        raise CommandError(f"Lock conflicts outlasted {MAX_ATTEMPTS} attempts.")
+                    barrier.wait()  # every attempt made
+            except threading.BrokenBarrierError:
+                pass
+            except Exception as e:
+                errors.append(e)
+                barrier.abort()
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=pair) for pair in enumerate(requesters)]
+        for thread in workers:
+            thread.start()
+        start = time.perf_counter()
+        try:
+            for _ in range(rounds):
+                barrier.wait()
+                barrier.wait()
+                barrier.wait()
+                try:
+                    DonationListing.objects.get(id=listing_id).reject_donation()
+                except ValueError:
+                    pass  # nobody won this round; reported below
+        except threading.BrokenBarrierError:
+            pass
+        except Exception:
+            barrier.abort()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            for thread in workers:
+                thread.join()
+        if errors:
+            raise CommandError(f"Contended run failed: {errors[0]}")
+
+        style = self.style.SUCCESS if sum(wins) == rounds else self.style.ERROR
+        self.stdout.write(style(
+            f"Contended: {rounds} round(s) x {len(requesters)} thread(s), {sum(wins)} granted, "
+            f"{sum(failures)} rejected, {sum(retries)} lock retries, {elapsed / rounds * 1e3:.2f} ms per round."
+        ))
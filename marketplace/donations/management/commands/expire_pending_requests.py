@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from donations.expiry import REQUEST_TTL_DAYS, expire_pending_requests
+
+
+class Command(BaseCommand):
+    help = (
+        "Return listings whose request has been pending too long to AVAILABLE. "
+        "Idempotent and safe to run concurrently; schedule it e.g. hourly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=REQUEST_TTL_DAYS,
+            help=f"Expire requests older than this many days (default {REQUEST_TTL_DAYS}).",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days must not be negative.")
+        expired = expire_pending_requests(days=options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} pending request(s)."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from donations.matching import run_matching
+from donations.swaps import DEFAULT_MAX_LENGTH, expire_proposals, propose_swaps
+
+
+class Command(BaseCommand):
+    help = "Find multi-party book swap cycles and store them as proposals."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-length", type=int, default=DEFAULT_MAX_LENGTH,
+            help=f"Maximum number of users per cycle (default {DEFAULT_MAX_LENGTH}).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report cycles without writing proposals.")
+        parser.add_argument(
+            "--skip-matching", action="store_true",
+            help="Use the current match table instead of running match_wishlists first.",
+        )
+
+    def handle(self, *args, **options):
+        if options["max_length"] < 2:
+            raise CommandError("--max-length must be at least 2.")
+        if not options["skip_matching"]:
+            run_matching()
+        if not options["dry_run"]:
+            expired = expire_proposals()
+            if expired:
+                self.stdout.write(f"Expired {expired} stale proposal(s).")
+
+        cycles = propose_swaps(options["max_length"], dry_run=options["dry_run"])
+        for legs in cycles:
+            self.stdout.write(" -> ".join(str(giver) for giver, _, _ in legs) + f" -> {legs[0][0]}")
+        users = sum(len(legs) for legs in cycles)
+        action = "found" if options["dry_run"] else "proposed"
+        self.stdout.write(self.style.SUCCESS(f"{len(cycles)} swap cycle(s) {action} covering {users} user(s)."))
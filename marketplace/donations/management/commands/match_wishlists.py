@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from donations.matching import prune_matches, run_matching
+
+
+class Command(BaseCommand):
+    help = "Match WANTED shelf items against available donation listings, incrementally."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prune", action="store_true", help="Also delete matches of completed listings.")
+
+    def handle(self, *args, **options):
+        stats = run_matching()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['shelf_changes']} shelf change(s) and {stats['listings']} listing(s); "
+            f"wrote {stats['matches']} match(es)."
+        ))
+        if options["prune"]:
+            self.stdout.write(f"Pruned {prune_matches()} match(es) of completed listings.")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from donations.consumers import rebuild_stats
+from donations.stats import rollup_contents
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Recompute the donation statistics rollups from the event log and the listings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Compare a rebuild with the current rollups and roll it back.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                before = rollup_contents()
+                replayed = rebuild_stats()
+                after = rollup_contents()
+                if options["verify"]:
+                    raise _Rollback
+        except _Rollback:
+            differences = {
+                name: sum(
+                    before[name].get(key) != after[name].get(key)
+                    for key in before[name].keys() | after[name].keys()
+                )
+                for name in after
+            }
+            differences = {name: count for name, count in differences.items() if count}
+            if differences:
+                details = ", ".join(f"{name}: {count}" for name, count in sorted(differences.items()))
+                raise CommandError(f"Rollups differ from a rebuild ({details} row(s)).")
+            self.stdout.write(self.style.SUCCESS(f"Rollups match a rebuild over {replayed} event(s)."))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt statistics from {replayed} event(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from donations.models import recount_available
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Book.available_count from the donation listings, e.g. after "
+        "users were deleted along with their listings."
+    )
+
+    def handle(self, *args, **options):
+        updated = recount_available()
+        self.stdout.write(self.style.SUCCESS(f"Recounted available copies of {updated} book(s)."))
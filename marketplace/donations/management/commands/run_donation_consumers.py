@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from donations.consumers import CONSUMERS, run_consumers
+
+
+class Command(BaseCommand):
+    help = "Process new donation events with the notification, stats and matching consumers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--consumer", action="append", choices=sorted(CONSUMERS),
+            help="Only run this consumer (repeatable).",
+        )
+        parser.add_argument("--max-batches", type=int, help="Stop each consumer after this many batches.")
+
+    def handle(self, *args, **options):
+        processed = run_consumers(options["consumer"], options["max_batches"])
+        for name, count in processed.items():
+            self.stdout.write(self.style.SUCCESS(f"{name}: processed {count} event(s)."))
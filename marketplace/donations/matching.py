@@ -0,0 +1,219 @@
+"""
+Incremental wishlist-to-donation matching.
+
+A match pairs a WANTED shelf item with an open (AVAILABLE or PENDING)
+listing of the same book, or of another book with the same canonical
+ISBN-13. Pending listings are matched too, since a rejected, cancelled or
+expired request puts them back on offer without a new listing. Two inputs
+are replayed from checkpoints:
+
+* the bookshelves ShelfChange log, for items tagged (or no longer tagged)
+  WANTED;
+* new DonationListing rows, by id.
+
+Each batch costs a fixed number of set-based queries. Matches whose
+listing is pending are filtered out when the feed is read; matches of
+completed listings are removed by ``prune_matches``.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from bookshelves.models import Bookshelf, BookshelfItem, BookshelfTag, ShelfChange
+from jobs.models import JobCheckpoint, StaleCheckpoint
+from marketplace.utils import CHUNK_SIZE, chunks
+
+from .models import DonationListing, DonationMatch, DonationStatus
+
+SHELF_CHECKPOINT = "donations.matching.shelves"
+LISTING_CHECKPOINT = "donations.matching.listings"
+
+BATCH_SIZE = 1000
+
+# Listings that can still be donated to someone who wants the book.
+OPEN_STATUSES = (DonationStatus.AVAILABLE, DonationStatus.PENDING)
+
+
+def _match_key_filter(prefix, book_ids, isbns):
+    condition = Q(**{f"{prefix}id__in": book_ids})
+    if isbns:
+        condition |= Q(**{f"{prefix}canonical_isbn__in": isbns})
+    return condition
+
+
+def _pair(wanted, listing):
+    """Return how ``wanted`` matches ``listing``, or None."""
+    if wanted["user_id"] == listing["donor_id"]:
+        return None
+    if wanted["book_id"] == listing["book_id"]:
+        return DonationMatch.MatchedOn.BOOK
+    if wanted["isbn"] and wanted["isbn"] == listing["isbn"]:
+        return DonationMatch.MatchedOn.ISBN
+    return None
+
+
+def _create_matches(wanted_items, listings):
+    by_book = defaultdict(list)
+    by_isbn = defaultdict(list)
+    for listing in listings:
+        by_book[listing["book_id"]].append(listing)
+        if listing["isbn"]:
+            by_isbn[listing["isbn"]].append(listing)
+
+    matches = {}
+    for wanted in wanted_items:
+        candidates = by_book[wanted["book_id"]] + (by_isbn[wanted["isbn"]] if wanted["isbn"] else [])
+        for listing in candidates:
+            matched_on = _pair(wanted, listing)
+            key = (wanted["user_id"], listing["id"])
+            if matched_on and key not in matches:
+                matches[key] = DonationMatch(
+                    wanter_id=wanted["user_id"],
+                    listing_id=listing["id"],
+                    wanted_book_id=wanted["book_id"],
+                    matched_on=matched_on,
+                )
+    DonationMatch.objects.bulk_create(matches.values(), batch_size=CHUNK_SIZE, ignore_conflicts=True)
+    return len(matches)
+
+
+def _wanted_rows(queryset):
+    return [
+        {"user_id": row[0], "book_id": row[1], "isbn": row[2]}
+        for row in queryset.values_list("bookshelf__user_id", "book_id", "book__canonical_isbn")
+    ]
+
+
+def _listing_rows(queryset):
+    return [
+        {"id": row[0], "book_id": row[1], "isbn": row[2], "donor_id": row[3]}
+        for row in queryset.values_list("id", "book_id", "book__canonical_isbn", "donor_id")
+    ]
+
+
+def match_shelf_changes(changes):
+    """
+    Bring matches in line with the current state of changed shelf items.
+
+    Args:
+        changes: Iterable of ``(bookshelf_id, book_id)`` pairs
+
+    Returns:
+        int: Number of matches written (existing ones included)
+    """
+    changed = set(changes)
+    if not changed:
+        return 0
+    shelf_users = dict(
+        Bookshelf.objects.filter(id__in={shelf for shelf, _ in changed}).values_list("id", "user_id")
+    )
+
+    wanted_items = []
+    for chunk in chunks({book for _, book in changed}):
+        wanted_items.extend(_wanted_rows(
+            BookshelfItem.objects.filter(
+                bookshelf_id__in=shelf_users, book_id__in=chunk, tag=BookshelfTag.WANTED
+            )
+        ))
+    wanted_keys = {(item["user_id"], item["book_id"]) for item in wanted_items}
+
+    # Items removed or retagged away from WANTED lose their matches.
+    stale = defaultdict(list)
+    for shelf, book in changed:
+        user_id = shelf_users.get(shelf)
+        if user_id is not None and (user_id, book) not in wanted_keys:
+            stale[user_id].append(book)
+    for user_id, books in stale.items():
+        DonationMatch.objects.filter(wanter_id=user_id, wanted_book_id__in=books).delete()
+
+    if not wanted_items:
+        return 0
+    book_ids = {item["book_id"] for item in wanted_items}
+    isbns = {item["isbn"] for item in wanted_items if item["isbn"]}
+    listings = _listing_rows(
+        DonationListing.objects.filter(status__in=OPEN_STATUSES)
+        .filter(_match_key_filter("book__", book_ids, isbns))
+    )
+    return _create_matches(wanted_items, listings)
+
+
+def match_listings(listing_ids):
+    """
+    Match open listings against every WANTED shelf item.
+
+    Returns:
+        int: Number of matches written (existing ones included)
+    """
+    listings = _listing_rows(
+        DonationListing.objects.filter(id__in=listing_ids, status__in=OPEN_STATUSES)
+    )
+    if not listings:
+        return 0
+    book_ids = {listing["book_id"] for listing in listings}
+    isbns = {listing["isbn"] for listing in listings if listing["isbn"]}
+    wanted_items = _wanted_rows(
+        BookshelfItem.objects.filter(tag=BookshelfTag.WANTED)
+        .filter(_match_key_filter("book__", book_ids, isbns))
+    )
+    return _create_matches(wanted_items, listings)
+
+
+def run_matching():
+    """
+    Process shelf changes and new listings since the last run.
+
+    Returns:
+        dict: ``shelf_changes``, ``listings`` processed and ``matches`` written
+    """
+    stats = {"shelf_changes": 0, "listings": 0, "matches": 0}
+
+    position = JobCheckpoint.get_position(SHELF_CHECKPOINT) or 0
+    while True:
+        changes = list(
+            ShelfChange.objects.filter(id__gt=position).order_by("id")
+            .values_list("id", "bookshelf_id", "book_id")[:BATCH_SIZE]
+        )
+        if not changes:
+            break
+        try:
+            with transaction.atomic():
+                matches = match_shelf_changes((shelf, book) for _, shelf, book in changes)
+                JobCheckpoint.advance(SHELF_CHECKPOINT, changes[-1][0], expected=position)
+        except StaleCheckpoint:
+            # Another run is replaying the same changes.
+            break
+        position = changes[-1][0]
+        stats["matches"] += matches
+        stats["shelf_changes"] += len(changes)
+
+    position = JobCheckpoint.get_position(LISTING_CHECKPOINT) or 0
+    while True:
+        listing_ids = list(
+            DonationListing.objects.filter(id__gt=position).order_by("id")
+            .values_list("id", flat=True)[:BATCH_SIZE]
+        )
+        if not listing_ids:
+            break
+        try:
+            with transaction.atomic():
+                matches = match_listings(listing_ids)
+                JobCheckpoint.advance(LISTING_CHECKPOINT, listing_ids[-1], expected=position)
+        except StaleCheckpoint:
+            break
+        position = listing_ids[-1]
+        stats["matches"] += matches
+        stats["listings"] += len(listing_ids)
+
+    return stats
+
+
+def prune_matches():
+    """
+    Delete matches of completed listings.
+
+    Pending listings keep their matches: a rejected or cancelled request
+    makes them available again without a new listing id.
+    """
+    deleted, _ = DonationMatch.objects.filter(listing__status=DonationStatus.COMPLETED).delete()
+    return deleted
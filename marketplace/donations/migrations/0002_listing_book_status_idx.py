@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_sort_indexes'),
+        ('donations', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='donationlisting',
+            index=models.Index(fields=['book', 'status'], name='listing_book_status_idx'),
+        ),
+    ]
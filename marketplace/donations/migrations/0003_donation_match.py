@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_book_canonical_isbn'),
+        ('donations', '0002_listing_book_status_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DonationMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matched_on', models.CharField(choices=[('book', 'Same book'), ('isbn', 'Same ISBN')], max_length=4)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='donations.donationlisting')),
+                ('wanted_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.book')),
+                ('wanter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='donation_matches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['wanter', '-id'], name='donation_match_feed_idx'), models.Index(fields=['wanter', 'wanted_book'], name='donation_match_wanted_idx')],
+                'constraints': [models.UniqueConstraint(fields=('wanter', 'listing'), name='donation_match_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('donations', '0003_donation_match'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwapProposal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('open', 'Open'), ('expired', 'Expired')], default='open', max_length=7)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status'], name='swap_proposal_status_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SwapProposalLeg',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('giver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swap_legs_given', to=settings.AUTH_USER_MODEL)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swap_legs', to='donations.donationlisting')),
+                ('proposal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='legs', to='donations.swapproposal')),
+                ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swap_legs_received', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['proposal', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('proposal', 'position'), name='swap_leg_position_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_book_canonical_isbn'),
+        ('donations', '0005_donation_request_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='donationlisting',
+            index=models.Index(fields=['donor', 'status', 'added_at'], name='listing_donor_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='donationlisting',
+            index=models.Index(condition=models.Q(('status', 'P')), fields=['requester'], name='listing_requester_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='donationlisting',
+            index=models.Index(condition=models.Q(('status', 'A')), fields=['book'], name='listing_available_idx'),
+        ),
+    ]
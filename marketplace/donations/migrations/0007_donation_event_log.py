@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('donations', '0006_listing_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DonationDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('delisted', 'Delisted')], max_length=9)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'kind'), name='donation_daily_stat_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DonationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_id', models.IntegerField()),
+                ('book_id', models.IntegerField()),
+                ('donor_id', models.IntegerField()),
+                ('requester_id', models.IntegerField(null=True)),
+                ('kind', models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('delisted', 'Delisted')], max_length=9)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing_id', 'id'], name='donation_event_listing_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DonationNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('delisted', 'Delisted')], max_length=9)),
+                ('listing_id', models.IntegerField()),
+                ('message', models.CharField(max_length=300)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='donation_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-id'], name='donation_notification_feed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('event_id', 'user'), name='donation_notification_event_uniq')],
+            },
+        ),
+    ]
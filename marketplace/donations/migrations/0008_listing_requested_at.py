@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_requested_at(apps, schema_editor):
+    # The real request times are unknown; start the clock now so existing
+    # requests get the full time to live instead of expiring at once.
+    DonationListing = apps.get_model('donations', 'DonationListing')
+    DonationListing.objects.filter(status='P').update(requested_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_book_canonical_isbn'),
+        ('donations', '0007_donation_event_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donationlisting',
+            name='requested_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='donationdailystat',
+            name='kind',
+            field=models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('expired', 'Request expired'), ('delisted', 'Delisted')], max_length=9),
+        ),
+        migrations.AlterField(
+            model_name='donationevent',
+            name='kind',
+            field=models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('expired', 'Request expired'), ('delisted', 'Delisted')], max_length=9),
+        ),
+        migrations.AlterField(
+            model_name='donationnotification',
+            name='kind',
+            field=models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('expired', 'Request expired'), ('delisted', 'Delisted')], max_length=9),
+        ),
+        migrations.AddIndex(
+            model_name='donationlisting',
+            index=models.Index(condition=models.Q(('status', 'P')), fields=['requested_at'], name='listing_pending_requested_idx'),
+        ),
+        migrations.RunPython(backfill_requested_at, migrations.RunPython.noop),
+    ]
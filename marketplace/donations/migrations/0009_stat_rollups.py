@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('donations', '0008_listing_requested_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DonationCompletionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('course', models.CharField(blank=True, max_length=100)),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DonationDonorStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('donor_id', models.IntegerField(unique=True)),
+                ('listed', models.PositiveIntegerField(default=0)),
+                ('donated', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DonationStatRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('course', models.CharField(blank=True, max_length=100)),
+                ('kind', models.CharField(choices=[('listed', 'Listed'), ('requested', 'Requested'), ('promoted', 'Promoted from queue'), ('cancelled', 'Request cancelled'), ('approved', 'Donation approved'), ('rejected', 'Request rejected'), ('expired', 'Request expired'), ('delisted', 'Delisted')], max_length=9)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DonationStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('A', 'Available'), ('P', 'Pending'), ('C', 'Completed')], max_length=1)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='DonationDailyStat',
+        ),
+        migrations.AddConstraint(
+            model_name='donationcompletionstat',
+            constraint=models.UniqueConstraint(fields=('day', 'course', 'bucket'), name='donation_completion_stat_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='donationdonorstat',
+            index=models.Index(fields=['-donated', '-listed'], name='donation_top_donors_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='donationstatrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'start', 'course', 'kind'), name='donation_stat_rollup_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='donationstatuscount',
+            constraint=models.UniqueConstraint(fields=('course', 'status'), name='donation_status_count_uniq'),
+        ),
+    ]
@@ -1,12 +1,59 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 from django.contrib.auth.models import User
 from books.models import Book
+from marketplace.utils import CHUNK_SIZE, chunks
+
+from .broker import broker
 
 class DonationStatus(models.TextChoices):
     AVAILABLE = 'A', 'Available'
     PENDING = 'P', 'Pending'
     COMPLETED = 'C', 'Completed'
 
+
+def adjust_available_counts(deltas):
+    """
+    Add ``deltas`` (book id -> change) to Book.available_count.
+
+    Runs one UPDATE per distinct change and chunk of books, so bulk
+    transitions stay set-based. Must run in the transaction that moved the
+    listings.
+    """
+    by_delta = {}
+    for book_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(book_id)
+    for delta, book_ids in by_delta.items():
+        for chunk in chunks(book_ids):
+            Book.objects.filter(id__in=chunk).update(
+                # Clamped so a drifted count can't fail the transition.
+                available_count=Greatest(F('available_count') + delta, 0)
+            )
+
+
+def recount_available():
+    """
+    Recompute every Book.available_count from DonationListing.
+
+    Repairs counts after listings were changed outside the transitions,
+    e.g. deleted along with their donor.
+
+    Returns:
+        int: Number of books updated
+    """
+    available = (
+        DonationListing.objects.filter(book=OuterRef('pk'), status=DonationStatus.AVAILABLE)
+        .order_by()
+        .values('book')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    return Book.objects.update(available_count=Coalesce(Subquery(available), 0))
+
+
 class DonationListing(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     donor = models.ForeignKey(
@@ -27,9 +74,37 @@ class DonationListing(models.Model):
         default=DonationStatus.AVAILABLE
     )
     added_at = models.DateTimeField(auto_now_add=True)
+    # When the current request was made; cleared when the listing becomes
+    # available again. Stale pending requests are expired on it.
+    requested_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('book', 'donor',)  # Same user can't donate multiple copies
+        indexes = [
+            # Per-book availability counts (books "most-available" sort).
+            models.Index(fields=['book', 'status'], name='listing_book_status_idx'),
+            # my_listings: donor's open listings, pending first, newest first.
+            models.Index(fields=['donor', 'status', 'added_at'], name='listing_donor_status_idx'),
+            # pending_requests: a requester's pending listings.
+            models.Index(
+                fields=['requester'],
+                name='listing_requester_pending_idx',
+                condition=models.Q(status='P'),
+            ),
+            # book_list / search_books: available listings, optionally by book.
+            models.Index(
+                fields=['book'],
+                name='listing_available_idx',
+                condition=models.Q(status='A'),
+            ),
+            # expire_pending_requests: pending listings by request age. Partial
+            # on status so it doesn't compete with listing_available_idx.
+            models.Index(
+                fields=['requested_at'],
+                name='listing_pending_requested_idx',
+                condition=models.Q(status='P'),
+            ),
+        ]
 
     @classmethod
     def add_listing(cls, book, user):
@@ -37,41 +112,427 @@ class DonationListing(models.Model):
             raise ValueError('Book cannot be None')
         if user is None:
             raise ValueError('User cannot be None')
-        return DonationListing.objects.get_or_create(book=book, donor=user)[0]
+        with transaction.atomic():
+            listing, created = DonationListing.objects.get_or_create(book=book, donor=user)
+            if created:
+                DonationEvent.record(listing, DonationEvent.Kind.LISTED)
+                adjust_available_counts({book.pk: 1})
+        return listing
+
+    @classmethod
+    def remove_listing(cls, book, user):
+        """Delete ``user``'s listing of ``book``; returns whether one existed."""
+        with transaction.atomic():
+            listing = DonationListing.objects.select_for_update().filter(book=book, donor=user).first()
+            if listing is None:
+                return False
+            DonationEvent.record(listing, DonationEvent.Kind.DELISTED)
+            if listing.status == DonationStatus.AVAILABLE:
+                adjust_available_counts({book.pk: -1})
+            listing.delete()
+        return True
+
+    def _compare_and_set(self, expected_status, event, conditions=None, **changes):
+        """
+        Apply ``changes`` with one conditional UPDATE and log ``event``.
+
+        The row is only written if its status in the database is still
+        ``expected_status`` (and it matches ``conditions``), so concurrent
+        transitions can't both succeed and no row lock is needed. The
+        DonationEvent, and the change to Book.available_count when the
+        listing enters or leaves AVAILABLE, are written in the same
+        transaction. On success the
+        instance is updated to match; on failure it is refreshed so the
+        caller can report why.
+
+        Returns:
+            bool: Whether the transition was applied
+        """
+        # The requester the event is about: the new one, or the one leaving.
+        requester = changes.get('requester')
+        requester_id = requester.pk if requester is not None else self.requester_id
+        with transaction.atomic(savepoint=False):
+            updated = DonationListing.objects.filter(
+                pk=self.pk, status=expected_status, **(conditions or {})
+            ).update(**changes)
+            if updated:
+                for field, value in changes.items():
+                    setattr(self, field, value)
+                DonationEvent.record(self, event, requester_id=requester_id)
+                available = DonationStatus.AVAILABLE
+                delta = (changes.get('status', expected_status) == available) - (expected_status == available)
+                adjust_available_counts({self.book_id: delta})
+        if not updated:
+            self.refresh_from_db(fields=['status', 'requester', 'requested_at'])
+        return bool(updated)
 
     def request_donation(self, requesting_user):
         if requesting_user is None:
             raise ValueError('requesting_user cannot be None')
-        if requesting_user == self.donor:
+        if requesting_user.pk == self.donor_id:
             raise ValueError('Cannot request your own book')
-        if self.status != DonationStatus.AVAILABLE:
-            raise ValueError("Requested book is not available")
 
-        self.requester = requesting_user
-        self.status = DonationStatus.PENDING
-        self.save()
+        if not self._compare_and_set(
+            DonationStatus.AVAILABLE, DonationEvent.Kind.REQUESTED,
+            status=DonationStatus.PENDING, requester=requesting_user, requested_at=timezone.now(),
+        ):
+            raise ValueError("Requested book is not available")
 
     def cancel_donation(self, requesting_user):
         if requesting_user is None:
             raise ValueError('requesting_user cannot be None')
-        if self.status != DonationStatus.PENDING:
-            raise ValueError("Book wasn't requested")
-        if self.requester != requesting_user:
-            raise ValueError('Request was made by another user')
 
-        self.requester = None
-        self.status = DonationStatus.AVAILABLE
-        self.save()
+        with transaction.atomic():
+            if not self._compare_and_set(
+                DonationStatus.PENDING,
+                DonationEvent.Kind.CANCELLED,
+                conditions={'requester': requesting_user},
+                status=DonationStatus.AVAILABLE,
+                requester=None,
+                requested_at=None,
+            ):
+                if self.status != DonationStatus.PENDING:
+                    raise ValueError("Book wasn't requested")
+                raise ValueError('Request was made by another user')
+            self._promote_next()
 
     def approve_donation(self):
-        if self.status != DonationStatus.PENDING:
-            raise ValueError("Only pending donations can be approved")
-        self.status = DonationStatus.COMPLETED
-        self.save()
+        with transaction.atomic():
+            if not self._compare_and_set(
+                DonationStatus.PENDING, DonationEvent.Kind.APPROVED, status=DonationStatus.COMPLETED
+            ):
+                raise ValueError("Only pending donations can be approved")
+            # Nobody else can get this copy any more.
+            self.queue.all().delete()
 
     def reject_donation(self):
-        if self.status != DonationStatus.PENDING:
-            raise ValueError("Only pending donations can be rejected")
-        self.status = DonationStatus.AVAILABLE
-        self.requester = None
-        self.save()
+        with transaction.atomic():
+            if not self._compare_and_set(
+                DonationStatus.PENDING, DonationEvent.Kind.REJECTED,
+                status=DonationStatus.AVAILABLE, requester=None, requested_at=None,
+            ):
+                raise ValueError("Only pending donations can be rejected")
+            self._promote_next()
+
+    def _promote_next(self):
+        """Hand an available listing to the head of its queue, if any."""
+        head = self.queue.order_by('position').select_related('user').first()
+        if head is None:
+            return None
+        if not self._compare_and_set(
+            DonationStatus.AVAILABLE, DonationEvent.Kind.PROMOTED,
+            status=DonationStatus.PENDING, requester=head.user, requested_at=timezone.now(),
+        ):
+            return None
+        head.delete()
+        return head.user
+
+    def join_queue(self, user):
+        """
+        Request the listing, or wait in line for it if it is already requested.
+
+        Returns:
+            DonationRequest: The queue entry, or None if the listing was
+                             requested directly
+
+        Raises:
+            ValueError: If the user is the donor, already holds or is
+                        queued for the listing, or it was already donated
+        """
+        if user is None:
+            raise ValueError('user cannot be None')
+        if user.pk == self.donor_id:
+            raise ValueError('Cannot request your own book')
+        try:
+            self.request_donation(user)
+            return None
+        except ValueError:
+            pass
+        if self.status == DonationStatus.COMPLETED:
+            raise ValueError("Requested book is not available")
+        if self.requester_id == user.pk:
+            raise ValueError('You already requested this book')
+        entry = DonationRequest.enqueue(self, user)
+        # The holder may have cancelled between our attempt and joining.
+        if DonationListing.objects.filter(pk=self.pk, status=DonationStatus.AVAILABLE).exists():
+            self._promote_next()
+        return entry
+
+    def leave_queue(self, user):
+        """Remove ``user`` from the queue; returns whether they were in it."""
+        deleted, _ = self.queue.filter(user=user).delete()
+        return bool(deleted)
+
+
+class DonationEvent(models.Model):
+    """
+    Append-only log of listing state changes.
+
+    One row is inserted in the same transaction as each transition and
+    never updated. Ids are monotonic, so consumers (see
+    donations.consumers) read forward from a checkpointed id. Plain ids
+    rather than foreign keys keep history after a listing is deleted.
+    """
+
+    class Kind(models.TextChoices):
+        LISTED = 'listed', 'Listed'
+        REQUESTED = 'requested', 'Requested'
+        PROMOTED = 'promoted', 'Promoted from queue'
+        CANCELLED = 'cancelled', 'Request cancelled'
+        APPROVED = 'approved', 'Donation approved'
+        REJECTED = 'rejected', 'Request rejected'
+        EXPIRED = 'expired', 'Request expired'
+        DELISTED = 'delisted', 'Delisted'
+
+    listing_id = models.IntegerField()
+    book_id = models.IntegerField()
+    donor_id = models.IntegerField()
+    requester_id = models.IntegerField(null=True)
+    kind = models.CharField(max_length=9, choices=Kind.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing_id', 'id'], name='donation_event_listing_idx'),
+        ]
+
+    @classmethod
+    def record(cls, listing, kind, requester_id=None):
+        event = cls.objects.create(
+            listing_id=listing.pk,
+            book_id=listing.book_id,
+            donor_id=listing.donor_id,
+            requester_id=requester_id,
+            kind=kind,
+        )
+        if broker.active:
+            transaction.on_commit(lambda: broker.publish([event]))
+        return event
+
+    @classmethod
+    def record_many(cls, rows, kind):
+        """
+        Insert one ``kind`` event per ``(listing_id, book_id, donor_id, requester_id)`` row.
+
+        Returns:
+            list: The created events
+        """
+        events = cls.objects.bulk_create(
+            [
+                cls(
+                    listing_id=listing_id, book_id=book_id, donor_id=donor_id,
+                    requester_id=requester_id, kind=kind,
+                )
+                for listing_id, book_id, donor_id, requester_id in rows
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+        if broker.active:
+            transaction.on_commit(lambda: broker.publish(events))
+        return events
+
+    def __str__(self):
+        return f"{self.kind} listing={self.listing_id}"
+
+
+class DonationRequest(models.Model):
+    """
+    A place in line for a listing that someone else has already requested.
+
+    Positions only grow, so the head of the queue is the smallest position
+    and is found with one range read on the (listing, position) index.
+    """
+
+    listing = models.ForeignKey(DonationListing, on_delete=models.CASCADE, related_name='queue')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='donation_queue_entries')
+    position = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Attempts to take the next position before giving up under contention.
+    ENQUEUE_ATTEMPTS = 5
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'position'], name='donation_request_position_uniq'),
+            models.UniqueConstraint(fields=['listing', 'user'], name='donation_request_user_uniq'),
+        ]
+
+    @classmethod
+    def enqueue(cls, listing, user):
+        """
+        Append ``user`` to ``listing``'s queue.
+
+        Raises:
+            ValueError: If the user is already queued
+        """
+        for _ in range(cls.ENQUEUE_ATTEMPTS):
+            tail = cls.objects.filter(listing=listing).aggregate(tail=Max('position'))['tail'] or 0
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(listing=listing, user=user, position=tail + 1)
+            except IntegrityError:
+                if cls.objects.filter(listing=listing, user=user).exists():
+                    raise ValueError('Already in the queue for this book')
+        raise ValueError('Queue is busy, please try again')
+
+    def place(self):
+        """1-based place in line."""
+        return DonationRequest.objects.filter(listing_id=self.listing_id, position__lt=self.position).count() + 1
+
+
+class DonationMatch(models.Model):
+    """
+    A WANTED shelf item that an available listing can satisfy.
+
+    Written by donations.matching; the "matches for you" feed reads it
+    through the (wanter, -id) index instead of joining shelves against
+    listings per request.
+    """
+
+    class MatchedOn(models.TextChoices):
+        BOOK = 'book', 'Same book'
+        ISBN = 'isbn', 'Same ISBN'
+
+    wanter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='donation_matches')
+    listing = models.ForeignKey(DonationListing, on_delete=models.CASCADE, related_name='matches')
+    wanted_book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    matched_on = models.CharField(max_length=4, choices=MatchedOn.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wanter', 'listing'], name='donation_match_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['wanter', '-id'], name='donation_match_feed_idx'),
+            models.Index(fields=['wanter', 'wanted_book'], name='donation_match_wanted_idx'),
+        ]
+
+
+class SwapProposal(models.Model):
+    """
+    A cycle of donors who can each give a listed book to the next.
+
+    Written by donations.swaps; each leg is one listing changing hands.
+    """
+
+    class Status(models.TextChoices):
+        OPEN = 'open', 'Open'
+        EXPIRED = 'expired', 'Expired'
+
+    status = models.CharField(max_length=7, choices=Status.choices, default=Status.OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], name='swap_proposal_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Swap {self.pk} ({self.get_status_display()})"
+
+
+class SwapProposalLeg(models.Model):
+    """One step of a SwapProposal: ``giver`` hands ``listing`` to ``receiver``."""
+
+    proposal = models.ForeignKey(SwapProposal, on_delete=models.CASCADE, related_name='legs')
+    position = models.PositiveSmallIntegerField()
+    giver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='swap_legs_given')
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='swap_legs_received')
+    listing = models.ForeignKey(DonationListing, on_delete=models.CASCADE, related_name='swap_legs')
+
+    class Meta:
+        ordering = ['proposal', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['proposal', 'position'], name='swap_leg_position_uniq'),
+        ]
+
+
+class DonationNotification(models.Model):
+    """A message for a user, written by the notification event consumer."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='donation_notifications')
+    event_id = models.BigIntegerField()
+    kind = models.CharField(max_length=9, choices=DonationEvent.Kind.choices)
+    listing_id = models.IntegerField()
+    message = models.CharField(max_length=300)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Two consumer processes racing over a batch must not notify twice.
+            models.UniqueConstraint(fields=['event_id', 'user'], name='donation_notification_event_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-id'], name='donation_notification_feed_idx'),
+        ]
+
+
+class DonationStatRollup(models.Model):
+    """
+    Number of donation events of one kind, for one course, in one hour or day.
+
+    Kept by the stats consumer (see donations.stats) so dashboards never
+    aggregate over DonationListing or the event log.
+    """
+
+    class Period(models.TextChoices):
+        HOUR = 'hour', 'Hour'
+        DAY = 'day', 'Day'
+
+    period = models.CharField(max_length=4, choices=Period.choices)
+    start = models.DateTimeField()
+    course = models.CharField(max_length=100, blank=True)
+    kind = models.CharField(max_length=9, choices=DonationEvent.Kind.choices)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'start', 'course', 'kind'], name='donation_stat_rollup_uniq'
+            ),
+        ]
+
+
+class DonationCompletionStat(models.Model):
+    """Donations completed on one day for one course, per time-to-completion bucket."""
+
+    day = models.DateField()
+    course = models.CharField(max_length=100, blank=True)
+    # Index into donations.stats.COMPLETION_BUCKETS
+    bucket = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'course', 'bucket'], name='donation_completion_stat_uniq'
+            ),
+        ]
+
+
+class DonationStatusCount(models.Model):
+    """Current number of listings per course and status."""
+
+    course = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=1, choices=DonationStatus.choices)
+    # Signed: a delisting can be seen before a rebuild has counted the listing.
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'status'], name='donation_status_count_uniq'),
+        ]
+
+
+class DonationDonorStat(models.Model):
+    """Books listed and donated per donor, for the top donors table."""
+
+    donor_id = models.IntegerField(unique=True)
+    listed = models.PositiveIntegerField(default=0)
+    donated = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-donated', '-listed'], name='donation_top_donors_idx'),
+        ]
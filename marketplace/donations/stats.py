@@ -0,0 +1,289 @@
+"""
+Precomputed donation statistics.
+
+The stats consumer (donations.consumers.StatsConsumer) folds each batch of
+DonationEvent rows into small rollup tables, so the admin dashboard reads a
+few hundred rows whatever the size of DonationListing:
+
+* DonationStatRollup: events per hour and per day, course and kind;
+* DonationCompletionStat: completed donations per day and course, bucketed
+  by the time from listing to completion (medians are estimated from it);
+* DonationStatusCount: current listings per course and status, moved by
+  the from/to status of each event;
+* DonationDonorStat: books listed and donated per donor.
+
+Increments are not idempotent on their own: each batch is folded once
+because the consumer's checkpoint only advances, by compare-and-set, in
+the transaction that applied it. ``rebuild_stats`` in donations.consumers
+recomputes all of them from scratch.
+"""
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from books.models import Book
+from marketplace.utils import CHUNK_SIZE, chunks
+
+from .models import (
+    DonationCompletionStat,
+    DonationDonorStat,
+    DonationEvent,
+    DonationListing,
+    DonationStatRollup,
+    DonationStatus,
+    DonationStatusCount,
+)
+
+# Upper bounds, in hours, of the time-to-completion buckets; None is open.
+COMPLETION_BUCKETS = (1, 6, 24, 72, 168, 336, 720, None)
+
+# kind -> (status before, status after); None means no listing.
+STATUS_CHANGES = {
+    DonationEvent.Kind.LISTED: (None, DonationStatus.AVAILABLE),
+    DonationEvent.Kind.REQUESTED: (DonationStatus.AVAILABLE, DonationStatus.PENDING),
+    DonationEvent.Kind.PROMOTED: (DonationStatus.AVAILABLE, DonationStatus.PENDING),
+    DonationEvent.Kind.CANCELLED: (DonationStatus.PENDING, DonationStatus.AVAILABLE),
+    DonationEvent.Kind.APPROVED: (DonationStatus.PENDING, DonationStatus.COMPLETED),
+    DonationEvent.Kind.REJECTED: (DonationStatus.PENDING, DonationStatus.AVAILABLE),
+    DonationEvent.Kind.EXPIRED: (DonationStatus.PENDING, DonationStatus.AVAILABLE),
+    # The status a listing was deleted in is read from its previous event.
+    DonationEvent.Kind.DELISTED: (None, None),
+}
+
+TOP_DONORS = 10
+
+
+def completion_bucket(hours):
+    """Index of the COMPLETION_BUCKETS bucket holding ``hours``."""
+    for index, bound in enumerate(COMPLETION_BUCKETS):
+        if bound is None or hours <= bound:
+            return index
+
+
+def estimate_median(histogram):
+    """
+    Estimate the median from ``{bucket index: count}``.
+
+    Interpolates linearly inside the bucket holding the middle value; the
+    open last bucket reports its lower bound.
+
+    Returns:
+        float: Median in hours, or None if the histogram is empty
+    """
+    total = sum(histogram.values())
+    if not total:
+        return None
+    middle = total / 2
+    seen = 0
+    for index, upper in enumerate(COMPLETION_BUCKETS):
+        count = histogram.get(index, 0)
+        lower = COMPLETION_BUCKETS[index - 1] if index else 0
+        if count and seen + count >= middle:
+            if upper is None:
+                return float(lower)
+            return lower + (upper - lower) * (middle - seen) / count
+        seen += count
+
+
+def _increment(model, fields, counts, column='count'):
+    """
+    Add ``counts`` (key tuple -> delta) to ``column`` of the rows keyed by ``fields``.
+
+    Missing rows are inserted first, then keys sharing a delta move together,
+    one UPDATE per distinct delta and chunk of keys, so a batch costs a few
+    statements however many keys it touches. Each key binds one parameter
+    per field, so chunks hold ``CHUNK_SIZE // len(fields)`` keys.
+    """
+    by_delta = {}
+    for key, delta in counts.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(key)
+    if not by_delta:
+        return
+    size = CHUNK_SIZE // len(fields)
+    model.objects.bulk_create(
+        [model(**dict(zip(fields, key))) for keys in by_delta.values() for key in keys],
+        ignore_conflicts=True,
+    )
+    for delta, keys in by_delta.items():
+        for chunk in chunks(keys, size):
+            match = Q()
+            for key in chunk:
+                match |= Q(**dict(zip(fields, key)))
+            model.objects.filter(match).update(**{column: F(column) + delta})
+
+
+def _statuses_before_delisting(events):
+    """Map delisted listing ids to the status their last earlier event left them in."""
+    listing_ids = {event.listing_id for event in events if event.kind == DonationEvent.Kind.DELISTED}
+    if not listing_ids:
+        return {}
+    last = (
+        DonationEvent.objects.filter(listing_id__in=listing_ids)
+        .exclude(kind=DonationEvent.Kind.DELISTED)
+        .values('listing_id')
+        .annotate(last=Max('id'))
+        .values('last')
+    )
+    return {
+        listing_id: STATUS_CHANGES[kind][1]
+        for listing_id, kind in DonationEvent.objects.filter(id__in=last).values_list('listing_id', 'kind')
+    }
+
+
+def _listed_at(listing_ids):
+    """When each listing was listed: its added_at, or its listed event if it is gone."""
+    if not listing_ids:
+        return {}
+    listed = dict(DonationListing.objects.filter(id__in=listing_ids).values_list('id', 'added_at'))
+    missing = set(listing_ids) - set(listed)
+    if missing:
+        listed.update(
+            DonationEvent.objects.filter(listing_id__in=missing, kind=DonationEvent.Kind.LISTED)
+            .values_list('listing_id', 'created_at')
+        )
+    return listed
+
+
+def apply_events(events, track_status=True):
+    """
+    Fold a batch of DonationEvent instances into the rollups.
+
+    Args:
+        events: DonationEvent instances, in id order
+        track_status: Also move DonationStatusCount (off while rebuilding,
+                      which counts listings directly instead)
+    """
+    courses = dict(Book.objects.filter(id__in={event.book_id for event in events}).values_list('id', 'course'))
+    approved = [event for event in events if event.kind == DonationEvent.Kind.APPROVED]
+    listed_at = _listed_at({event.listing_id for event in approved})
+    before_delisting = _statuses_before_delisting(events) if track_status else {}
+
+    rollups = Counter()
+    completions = Counter()
+    statuses = Counter()
+    listed = Counter()
+    donated = Counter()
+    for event in events:
+        course = courses.get(event.book_id, '')
+        local = timezone.localtime(event.created_at)
+        hour = local.replace(minute=0, second=0, microsecond=0)
+        rollups[(DonationStatRollup.Period.HOUR, hour, course, event.kind)] += 1
+        rollups[(DonationStatRollup.Period.DAY, hour.replace(hour=0), course, event.kind)] += 1
+
+        if event.kind == DonationEvent.Kind.LISTED:
+            listed[(event.donor_id,)] += 1
+        elif event.kind == DonationEvent.Kind.APPROVED:
+            donated[(event.donor_id,)] += 1
+            if event.listing_id in listed_at:
+                hours = (event.created_at - listed_at[event.listing_id]).total_seconds() / 3600
+                completions[(local.date(), course, completion_bucket(hours))] += 1
+
+        if track_status:
+            old, new = STATUS_CHANGES[event.kind]
+            if event.kind == DonationEvent.Kind.DELISTED:
+                # Listings older than the event log count as available.
+                old = before_delisting.get(event.listing_id, DonationStatus.AVAILABLE)
+            if old is not None:
+                statuses[(course, old)] -= 1
+            if new is not None:
+                statuses[(course, new)] += 1
+
+    _increment(DonationStatRollup, ('period', 'start', 'course', 'kind'), rollups)
+    _increment(DonationCompletionStat, ('day', 'course', 'bucket'), completions)
+    _increment(DonationStatusCount, ('course', 'status'), statuses)
+    _increment(DonationDonorStat, ('donor_id',), listed, column='listed')
+    _increment(DonationDonorStat, ('donor_id',), donated, column='donated')
+
+
+ROLLUP_MODELS = (DonationStatRollup, DonationCompletionStat, DonationStatusCount, DonationDonorStat)
+
+
+def clear_rollups():
+    for model in ROLLUP_MODELS:
+        model.objects.all().delete()
+
+
+def count_statuses():
+    """Recompute DonationStatusCount with one GROUP BY over DonationListing."""
+    DonationStatusCount.objects.all().delete()
+    DonationStatusCount.objects.bulk_create(
+        DonationStatusCount(course=row['book__course'], status=row['status'], count=row['count'])
+        for row in DonationListing.objects.values('book__course', 'status').annotate(count=Count('id'))
+    )
+
+
+def rollup_contents():
+    """Every rollup row as ``{model name: {key: values}}``, for comparing rebuilds."""
+    contents = {}
+    for model in ROLLUP_MODELS:
+        fields = [field.name for field in model._meta.fields if field.name != 'id']
+        key_fields = [name for name in fields if name not in ('count', 'listed', 'donated')]
+        value_fields = [name for name in fields if name not in key_fields]
+        contents[model.__name__] = {
+            tuple(row[name] for name in key_fields): tuple(row[name] for name in value_fields)
+            for row in model.objects.values(*fields)
+            if any(row[name] for name in value_fields)
+        }
+    return contents
+
+
+def summary(period, since, course=None):
+    """
+    Dashboard statistics, read from the rollups only.
+
+    Args:
+        period: A DonationStatRollup.Period
+        since: Start of the reported window (aware datetime)
+        course: Only report this course (top donors are global)
+
+    Returns:
+        dict: ``status_counts``, ``series``, ``completion`` and ``top_donors``.
+              ``completion.median_hours_estimate`` is interpolated from the
+              COMPLETION_BUCKETS histogram, so it is only as precise as the
+              bucket holding the median.
+    """
+    statuses = DonationStatusCount.objects.exclude(count=0)
+    rollups = DonationStatRollup.objects.filter(period=period, start__gte=since)
+    completions = DonationCompletionStat.objects.filter(day__gte=timezone.localdate(since))
+    if course is not None:
+        statuses = statuses.filter(course=course)
+        rollups = rollups.filter(course=course)
+        completions = completions.filter(course=course)
+
+    status_counts = {}
+    for row_course, status, count in statuses.order_by('course', 'status').values_list('course', 'status', 'count'):
+        status_counts.setdefault(row_course, {})[status] = count
+
+    series = [
+        {'start': row['start'].isoformat(), 'kind': row['kind'], 'count': row['total']}
+        for row in rollups.values('start', 'kind').annotate(total=Sum('count')).order_by('start', 'kind')
+    ]
+
+    histogram = dict(completions.values('bucket').annotate(total=Sum('count')).values_list('bucket', 'total'))
+    completion = {
+        'count': sum(histogram.values()),
+        'median_hours_estimate': estimate_median(histogram),
+        'histogram': [
+            {'le_hours': bound, 'count': histogram.get(index, 0)}
+            for index, bound in enumerate(COMPLETION_BUCKETS)
+        ],
+    }
+
+    donors = list(
+        DonationDonorStat.objects.filter(donated__gt=0)
+        .order_by('-donated', '-listed')
+        .values('donor_id', 'listed', 'donated')[:TOP_DONORS]
+    )
+    usernames = dict(User.objects.filter(id__in=[row['donor_id'] for row in donors]).values_list('id', 'username'))
+    for row in donors:
+        row['username'] = usernames.get(row['donor_id'])
+
+    return {
+        'status_counts': status_counts,
+        'series': series,
+        'completion': completion,
+        'top_donors': donors,
+    }
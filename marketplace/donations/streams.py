@@ -0,0 +1,165 @@
+"""
+Server-Sent Events streams of listing status changes.
+
+``event_stream`` yields the SSE frames for one user: the events they
+missed since ``Last-Event-ID`` (read from the log), then live events from
+the in-process broker (donations.broker), with a comment line as heartbeat
+so proxies keep idle connections open.
+
+With several workers, a transition is published only in the worker that
+ran it, so every worker with subscribers also runs one poller task that
+reads the event log forward by id every ``POLL_INTERVAL`` seconds and feeds
+the broker. That is one query per interval per worker, not per connection.
+
+Streams need the ASGI application (settings.DONATION_EVENT_STREAM). Pages
+served over WSGI poll ``events_after`` every ``CLIENT_POLL_SECONDS``
+instead.
+"""
+import asyncio
+import json
+
+from django.db.models import Max, Q
+
+from .broker import broker
+from .models import DonationEvent
+from .stats import STATUS_CHANGES
+
+POLL_INTERVAL = 2.0
+POLL_BATCH_SIZE = 1000
+
+HEARTBEAT_SECONDS = 15
+
+# Client reconnection delay, sent as the SSE ``retry`` field.
+RETRY_MS = 3000
+
+# Events replayed on reconnection, and how far back the log is searched.
+REPLAY_LIMIT = 100
+REPLAY_WINDOW = 10000
+
+# How often pages without a stream poll for changes.
+CLIENT_POLL_SECONDS = 15
+
+
+def event_data(event, user_id):
+    """What ``user_id`` is told about ``event``."""
+    return {
+        'listing_id': event.listing_id,
+        'book_id': event.book_id,
+        'kind': event.kind,
+        'status': STATUS_CHANGES[event.kind][1],
+        'role': 'donor' if event.donor_id == user_id else 'requester',
+    }
+
+
+def format_event(event, user_id):
+    """Encode ``event`` as an SSE frame for ``user_id``."""
+    return f"id: {event.id}\ndata: {json.dumps(event_data(event, user_id))}\n\n"
+
+
+def _user_events(user_id, after):
+    return DonationEvent.objects.filter(
+        Q(donor_id=user_id) | Q(requester_id=user_id), id__gt=after
+    ).order_by('id')[:REPLAY_LIMIT]
+
+
+def events_after(user_id, last_event_id):
+    """
+    The user's events after ``last_event_id``, for pages polling instead of streaming.
+
+    Args:
+        user_id: Id of the donor or requester polling
+        last_event_id: Id returned by the previous poll; None on the first
+
+    Returns:
+        tuple: ``(events, last_event_id)``: up to REPLAY_LIMIT events,
+               oldest first, within REPLAY_WINDOW (as on reconnection),
+               and the id to poll after next time
+    """
+    latest = DonationEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+    if last_event_id is None:
+        return [], latest
+    events = list(_user_events(user_id, max(last_event_id, latest - REPLAY_WINDOW)))
+    if events:
+        # Events logged after ``latest`` was read.
+        latest = max(latest, events[-1].id)
+    return events, latest
+
+
+async def _latest_event_id():
+    return (await DonationEvent.objects.aaggregate(latest=Max('id')))['latest'] or 0
+
+
+async def _poll(state, started):
+    """Feed the broker with events logged by any process, while anyone on this loop listens."""
+    try:
+        position = await _latest_event_id()
+    finally:
+        started.set_result(None)
+    while state.subscribers:
+        await asyncio.sleep(POLL_INTERVAL)
+        while True:
+            events = [
+                event async for event in
+                DonationEvent.objects.filter(id__gt=position).order_by('id')[:POLL_BATCH_SIZE]
+            ]
+            if not events:
+                break
+            position = events[-1].id
+            broker.dispatch(events)
+            if len(events) < POLL_BATCH_SIZE:
+                break
+
+
+async def _ensure_poller():
+    """
+    Start this loop's poller if it isn't running.
+
+    Returns once the poller knows where the log ends, so events logged
+    after a stream subscribed are never skipped.
+    """
+    if not POLL_INTERVAL:
+        return
+    state = broker.state()
+    if state.poller is None or state.poller.done():
+        state.poller_started = asyncio.get_running_loop().create_future()
+        state.poller = asyncio.create_task(_poll(state, state.poller_started))
+    await state.poller_started
+
+
+async def _missed_events(user_id, last_event_id):
+    """The user's events after ``last_event_id``, oldest first, within the replay bounds."""
+    after = max(last_event_id, await _latest_event_id() - REPLAY_WINDOW)
+    return [event async for event in _user_events(user_id, after)]
+
+
+async def event_stream(user_id, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Yield SSE frames with the status changes of ``user_id``'s listings and requests.
+
+    Args:
+        user_id: Id of the donor or requester listening
+        last_event_id: Replay the user's events after this id first
+        heartbeat: Seconds of silence after which a comment line is sent
+
+    The stream ends if the client falls too far behind; browsers reconnect
+    on their own and catch up through ``Last-Event-ID``.
+    """
+    queue = broker.subscribe(user_id)
+    try:
+        await _ensure_poller()
+        yield f"retry: {RETRY_MS}\n\n"
+        replayed = set()
+        if last_event_id is not None:
+            for event in await _missed_events(user_id, last_event_id):
+                replayed.add(event.id)
+                yield format_event(event, user_id)
+        while not (queue.overflowed and queue.empty()):
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event.id not in replayed:
+                yield format_event(event, user_id)
+    finally:
+        broker.unsubscribe(user_id, queue)
@@ -0,0 +1,253 @@
+"""
+Multi-party book swap detection.
+
+The swap graph has an edge ``giver -> receiver`` whenever ``giver`` has an
+available listing that ``receiver`` wants, read from the DonationMatch
+table kept by donations.matching. A directed cycle of length ``k`` is a
+``k``-party swap in which everybody gives one book and receives one.
+
+Only edges inside a strongly connected component can lie on a cycle, so
+the graph is first split with Tarjan's algorithm and singleton components
+are dropped. Cycles are then searched per component with a bidirectional
+breadth-first search bounded by the maximum cycle length and an expansion
+budget, and accepted greedily, shortest first, so that no user or listing appears in
+two proposals.
+"""
+from collections import deque
+
+from django.db import transaction
+
+from .models import DonationMatch, DonationStatus, SwapProposal, SwapProposalLeg
+
+DEFAULT_MAX_LENGTH = 5
+
+# Nodes each half of a cycle search may visit before giving up on its start
+# node; keeps dense components from turning the search quadratic.
+SEARCH_BUDGET = 10000
+
+
+def build_swap_graph(edges):
+    """
+    Build an adjacency map from ``(giver, receiver, listing)`` triples.
+
+    Self-loops are dropped and only the lowest listing id is kept per
+    ``(giver, receiver)`` pair, so results are deterministic.
+
+    Returns:
+        dict: giver id -> dict of receiver id -> listing id
+    """
+    graph = {}
+    for giver, receiver, listing in edges:
+        if giver == receiver:
+            continue
+        receivers = graph.setdefault(giver, {})
+        if receiver not in receivers or listing < receivers[receiver]:
+            receivers[receiver] = listing
+    return graph
+
+
+def strongly_connected_components(graph):
+    """
+    Return the strongly connected components of ``graph``.
+
+    Iterative Tarjan, so deep graphs don't hit the recursion limit.
+
+    Args:
+        graph: dict of node -> iterable of successor nodes
+
+    Returns:
+        list: One set of nodes per component
+    """
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [(root, iter(sorted(graph.get(root, ()))))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(sorted(graph.get(successor, ())))))
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def _bounded_bfs(graph, start, allowed, max_depth):
+    """Map nodes within ``max_depth`` hops of ``start`` to ``(depth, previous)``."""
+    reached = {start: (0, None)}
+    frontier = [start]
+    for depth in range(1, max_depth + 1):
+        next_frontier = []
+        for node in frontier:
+            for successor in sorted(graph.get(node, ())):
+                if successor not in reached and successor in allowed:
+                    reached[successor] = (depth, node)
+                    next_frontier.append(successor)
+        if len(reached) > SEARCH_BUDGET:
+            break
+        frontier = next_frontier
+    return reached
+
+
+def _shortest_cycle(graph, reverse, start, allowed, max_length):
+    """
+    Return the shortest cycle through ``start`` within ``allowed``, or None.
+
+    Searches forwards from ``start`` for half the length and backwards
+    (over ``reverse``) for the other half, then joins the two at the
+    meeting node with the smallest total depth. With average degree ``d``
+    this visits about ``2 * d ** (max_length / 2)`` nodes instead of
+    ``d ** max_length``.
+    """
+    forward = _bounded_bfs(graph, start, allowed, (max_length + 1) // 2)
+    backward = _bounded_bfs(reverse, start, allowed, max_length // 2)
+    best = None
+    for node, (depth, _) in forward.items():
+        if node != start and node in backward:
+            length = depth + backward[node][0]
+            if length <= max_length and (best is None or (length, node) < best):
+                best = (length, node)
+    if best is None:
+        return None
+
+    # A shortest closed walk can't revisit a node, so the halves are disjoint.
+    meeting = best[1]
+    head = [meeting]
+    while forward[head[-1]][1] is not None:
+        head.append(forward[head[-1]][1])
+    tail = []
+    node = backward[meeting][1]
+    while node is not None and node != start:
+        tail.append(node)
+        node = backward[node][1]
+    return head[::-1] + tail
+
+
+def find_disjoint_cycles(graph, max_length=DEFAULT_MAX_LENGTH):
+    """
+    Find node-disjoint cycles of at most ``max_length`` users.
+
+    Args:
+        graph: Adjacency map as returned by ``build_swap_graph``
+        max_length: Maximum number of users per cycle (at least 2)
+
+    Returns:
+        list: Cycles as lists of user ids; each user gives to the next and
+              the last gives to the first
+    """
+    if max_length < 2:
+        raise ValueError("max_length must be at least 2")
+    reverse = {}
+    for giver, receivers in graph.items():
+        for receiver in receivers:
+            reverse.setdefault(receiver, []).append(giver)
+    cycles = []
+    for component in strongly_connected_components(graph):
+        if len(component) < 2:
+            continue
+        available = set(component)
+        for start in sorted(component):
+            if start not in available:
+                continue
+            cycle = _shortest_cycle(graph, reverse, start, available, max_length)
+            if cycle:
+                cycles.append(cycle)
+                available.difference_update(cycle)
+    cycles.sort(key=len)
+    return cycles
+
+
+def _swap_edges():
+    """Edges from available matches, skipping users and listings already in open proposals."""
+    busy_listings = set()
+    busy_users = set()
+    open_legs = SwapProposalLeg.objects.filter(proposal__status=SwapProposal.Status.OPEN)
+    for listing, giver, receiver in open_legs.values_list("listing_id", "giver_id", "receiver_id"):
+        busy_listings.add(listing)
+        busy_users.update((giver, receiver))
+
+    matches = DonationMatch.objects.filter(listing__status=DonationStatus.AVAILABLE)
+    for giver, receiver, listing in matches.values_list(
+        "listing__donor_id", "wanter_id", "listing_id"
+    ).iterator(chunk_size=5000):
+        if listing not in busy_listings and giver not in busy_users and receiver not in busy_users:
+            yield giver, receiver, listing
+
+
+def expire_proposals():
+    """
+    Expire open proposals with a listing that is no longer available.
+
+    Returns:
+        int: Number of proposals expired
+    """
+    stale = SwapProposalLeg.objects.filter(
+        proposal__status=SwapProposal.Status.OPEN
+    ).exclude(listing__status=DonationStatus.AVAILABLE).values("proposal_id")
+    return SwapProposal.objects.filter(id__in=stale).update(status=SwapProposal.Status.EXPIRED)
+
+
+def propose_swaps(max_length=DEFAULT_MAX_LENGTH, dry_run=False):
+    """
+    Find swap cycles and store them as open proposals.
+
+    Args:
+        max_length: Maximum number of users per cycle
+        dry_run: Only report the cycles, don't write proposals
+
+    Returns:
+        list: Cycles found, each a list of ``(giver, receiver, listing)``
+    """
+    graph = build_swap_graph(_swap_edges())
+    cycles = [
+        [(giver, receiver, graph[giver][receiver])
+         for giver, receiver in zip(cycle, cycle[1:] + cycle[:1])]
+        for cycle in find_disjoint_cycles(graph, max_length)
+    ]
+    if dry_run or not cycles:
+        return cycles
+
+    with transaction.atomic():
+        proposals = SwapProposal.objects.bulk_create([SwapProposal() for _ in cycles])
+        SwapProposalLeg.objects.bulk_create(
+            [
+                SwapProposalLeg(
+                    proposal=proposal, position=position,
+                    giver_id=giver, receiver_id=receiver, listing_id=listing,
+                )
+                for proposal, legs in zip(proposals, cycles)
+                for position, (giver, receiver, listing) in enumerate(legs)
+            ],
+            batch_size=500,
+        )
+    return cycles
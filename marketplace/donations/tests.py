@@ -1,9 +1,54 @@
-from django.test import TestCase
-from django.urls import reverse
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase, TransactionTestCase
+from django.urls import NoReverseMatch, reverse
 from django.contrib.auth.models import User
 
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
 from books.models import Book
-from donations.models import DonationListing, DonationStatus
+from books.utils import to_isbn13
+from bookshelves.models import Bookshelf, BookshelfTag
+from donations.matching import prune_matches, run_matching
+from donations.broker import EventBroker, broker
+from donations.bulk import bulk_add_listings, bulk_transition
+from donations.consumers import StatsConsumer, rebuild_stats, run_consumers
+from donations.expiry import expire_pending_requests
+from donations.models import (
+    DonationDonorStat,
+    DonationEvent,
+    DonationListing,
+    DonationMatch,
+    DonationNotification,
+    DonationRequest,
+    DonationStatRollup,
+    DonationStatus,
+    DonationStatusCount,
+    SwapProposal,
+)
+from donations.stats import _increment, completion_bucket, estimate_median
+from donations.streams import event_stream
+from donations import views
+from donations.swaps import (
+    build_swap_graph,
+    find_disjoint_cycles,
+    propose_swaps,
+    strongly_connected_components,
+)
 
 
 class DonationViewsTest(TestCase):
@@ -204,3 +249,1194 @@ class DonationViewsTest(TestCase):
 
         self.assertEqual(len(listings), 2)
         # APPROVED or REJECTED should not appear
+
+
+class WishlistMatchingTest(TestCase):
+    """Tests for donations.matching and the matches feed."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='giver', password='123')
+        self.student = User.objects.create_user(username='wanter', password='123')
+        self.shelf = Bookshelf.objects.create(user=self.student)
+        self.book = Book.objects.create(title='Calculus', author='Stewart', course='MA111')
+        # Same edition registered twice, once per ISBN form.
+        self.isbn10_book = Book.objects.create(title='Learning Python', author='Lutz', course='MC102', isbn='0596520689')
+        self.isbn13_book = Book.objects.create(title='Learning Python (13)', author='Lutz', course='MC102', isbn='9780596520687')
+
+    def _feed(self, user='wanter'):
+        self.client.login(username=user, password='123')
+        response = self.client.get(reverse('donations:matches_api'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['matches']
+
+    def test_canonical_isbn(self):
+        self.assertEqual(to_isbn13('0-596-52068-9'), '9780596520687')
+        self.assertEqual(to_isbn13('043942089X'), '9780439420891')
+        self.assertIsNone(to_isbn13('invalid'))
+        self.assertEqual(self.isbn10_book.canonical_isbn, self.isbn13_book.canonical_isbn)
+        self.assertIsNone(self.book.canonical_isbn)
+
+    def test_new_listing_matches_existing_wish(self):
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        run_matching()
+        self.assertEqual(self._feed(), [])
+
+        listing = DonationListing.add_listing(self.book, self.donor)
+        stats = run_matching()
+
+        self.assertEqual(stats['matches'], 1)
+        feed = self._feed()
+        self.assertEqual(len(feed), 1)
+        self.assertEqual(feed[0]['listing_id'], listing.id)
+        self.assertEqual(feed[0]['matched_on'], 'book')
+        self.assertEqual(feed[0]['donor'], 'giver')
+
+    def test_wish_on_pending_listing_matches_once_it_is_back(self):
+        bob = User.objects.create_user(username='bob', password='123')
+        rejected = DonationListing.add_listing(self.book, self.donor)
+        cancelled = DonationListing.add_listing(self.isbn13_book, self.donor)
+        run_matching()
+        rejected.request_donation(bob)
+        cancelled.request_donation(bob)
+
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self.shelf.add_or_update_item(self.isbn10_book, BookshelfTag.WANTED)
+        run_matching()
+        self.assertEqual(self._feed(), [])
+
+        rejected.reject_donation()
+        cancelled.cancel_donation(bob)
+        run_matching()
+        run_consumers()
+        self.assertEqual({m['listing_id'] for m in self._feed()}, {rejected.id, cancelled.id})
+
+    def test_new_wish_matches_existing_listing_by_isbn(self):
+        DonationListing.add_listing(self.isbn13_book, self.donor)
+        run_matching()
+
+        self.shelf.add_or_update_item(self.isbn10_book, BookshelfTag.WANTED)
+        run_matching()
+
+        feed = self._feed()
+        self.assertEqual(len(feed), 1)
+        self.assertEqual(feed[0]['matched_on'], 'isbn')
+        self.assertEqual(feed[0]['wanted_book_id'], self.isbn10_book.id)
+        self.assertEqual(feed[0]['book']['id'], self.isbn13_book.id)
+
+    def test_untagging_removes_matches(self):
+        DonationListing.add_listing(self.book, self.donor)
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        run_matching()
+        self.assertEqual(DonationMatch.objects.count(), 1)
+
+        self.shelf.add_or_update_item(self.book, BookshelfTag.READ)
+        run_matching()
+        self.assertEqual(DonationMatch.objects.count(), 0)
+
+    def test_own_listings_and_other_tags_do_not_match(self):
+        DonationListing.add_listing(self.book, self.student)
+        other = Book.objects.create(title='Physics', author='Halliday', course='F128')
+        DonationListing.add_listing(other, self.donor)
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self.shelf.add_or_update_item(other, BookshelfTag.READING)
+
+        run_matching()
+        self.assertEqual(DonationMatch.objects.count(), 0)
+
+    def test_feed_hides_unavailable_listings_and_prune_drops_completed(self):
+        listing = DonationListing.add_listing(self.book, self.donor)
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        run_matching()
+
+        listing.request_donation(self.student)
+        self.assertEqual(self._feed(), [])
+        self.assertEqual(prune_matches(), 0)
+
+        listing.approve_donation()
+        self.assertEqual(prune_matches(), 1)
+
+    def test_matching_is_incremental(self):
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        DonationListing.add_listing(self.book, self.donor)
+        first = run_matching()
+        self.assertEqual((first['shelf_changes'], first['listings']), (1, 1))
+        self.assertEqual(run_matching(), {'shelf_changes': 0, 'listings': 0, 'matches': 0})
+
+    def test_feed_query_count_and_pagination(self):
+        DonationListing.add_listing(self.book, self.donor)
+        DonationListing.add_listing(self.isbn13_book, self.donor)
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        self.shelf.add_or_update_item(self.isbn10_book, BookshelfTag.WANTED)
+        run_matching()
+
+        self.client.login(username='wanter', password='123')
+        # session, user, matches
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('donations:matches_api'))
+        self.assertEqual(len(response.json()['matches']), 2)
+
+        newest = response.json()['matches'][0]['id']
+        response = self.client.get(reverse('donations:matches_api'), {'after': newest})
+        self.assertEqual(len(response.json()['matches']), 1)
+        for after in ('x', '²'):
+            self.assertEqual(self.client.get(reverse('donations:matches_api'), {'after': after}).status_code, 400)
+
+    def test_command(self):
+        self.shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        DonationListing.add_listing(self.book, self.donor)
+        out = StringIO()
+        call_command('match_wishlists', '--prune', stdout=out)
+        self.assertIn('Processed 1 shelf change(s) and 1 listing(s)', out.getvalue())
+        self.assertEqual(DonationMatch.objects.count(), 1)
+        self.assertIn('Pruned 0 match(es)', out.getvalue())
+
+
+class SwapCycleTest(TestCase):
+    """Tests for donations.swaps."""
+
+    def test_strongly_connected_components(self):
+        graph = {1: [2], 2: [3], 3: [1, 4], 4: [5], 5: [4], 6: [1]}
+        components = sorted(sorted(c) for c in strongly_connected_components(graph))
+        self.assertEqual(components, [[1, 2, 3], [4, 5], [6]])
+
+    def test_deep_chain_does_not_recurse(self):
+        graph = {node: [node + 1] for node in range(5000)}
+        graph[5000] = [0]
+        self.assertEqual(len(strongly_connected_components(graph)), 1)
+
+    def test_disjoint_cycles_respect_max_length(self):
+        graph = build_swap_graph([
+            (1, 2, 10), (2, 1, 11),                     # two-way swap
+            (3, 4, 12), (4, 5, 13), (5, 3, 14),         # three-way swap
+            (6, 7, 15), (7, 8, 16), (8, 9, 17), (9, 10, 18), (10, 11, 19), (11, 6, 20),
+            (2, 3, 21),                                 # bridge, not on a cycle
+        ])
+        self.assertEqual(find_disjoint_cycles(graph, max_length=5), [[1, 2], [3, 4, 5]])
+        self.assertEqual(len(find_disjoint_cycles(graph, max_length=6)), 3)
+
+    def test_cycles_share_no_user(self):
+        # 1 sits on both 1-2 and 1-3-4; only one of them can be proposed.
+        graph = build_swap_graph([(1, 2, 1), (2, 1, 2), (1, 3, 3), (3, 4, 4), (4, 1, 5), (3, 4, 6)])
+        cycles = find_disjoint_cycles(graph)
+        users = [user for cycle in cycles for user in cycle]
+        self.assertEqual(len(users), len(set(users)))
+        self.assertEqual(cycles, [[1, 2]])
+
+    def test_lowest_listing_kept_per_pair(self):
+        self.assertEqual(build_swap_graph([(1, 2, 9), (1, 2, 3), (1, 1, 4)]), {1: {2: 3}})
+
+
+class SwapProposalTest(TestCase):
+    """Proposals built from listings and WANTED shelf items."""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'u{i}', password='123') for i in range(3)]
+        self.books = [
+            Book.objects.create(title=f'Book {i}', author='Author', course='MC000') for i in range(3)
+        ]
+        # u0 gives book 0 to u1, u1 gives book 1 to u2, u2 gives book 2 to u0.
+        self.listings = []
+        for i, user in enumerate(self.users):
+            self.listings.append(DonationListing.add_listing(self.books[i], user))
+            shelf = Bookshelf.objects.create(user=user)
+            shelf.add_or_update_item(self.books[i - 1], BookshelfTag.WANTED)
+        run_matching()
+
+    def test_three_way_swap_proposed_once(self):
+        cycles = propose_swaps()
+        self.assertEqual(len(cycles), 1)
+        proposal = SwapProposal.objects.get()
+        legs = list(proposal.legs.values_list('giver_id', 'receiver_id', 'listing_id'))
+        self.assertEqual(len(legs), 3)
+        for giver, receiver, listing in legs:
+            self.assertEqual(DonationListing.objects.get(id=listing).donor_id, giver)
+            self.assertTrue(DonationMatch.objects.filter(wanter_id=receiver, listing_id=listing).exists())
+
+        # Users in an open proposal aren't proposed again.
+        self.assertEqual(propose_swaps(), [])
+
+    def test_command_expires_stale_proposals(self):
+        propose_swaps()
+        self.listings[0].request_donation(self.users[2])
+
+        out = StringIO()
+        call_command('find_swap_cycles', stdout=out)
+        self.assertIn('Expired 1 stale proposal(s).', out.getvalue())
+        self.assertIn('0 swap cycle(s) proposed', out.getvalue())
+        self.assertEqual(SwapProposal.objects.get().status, SwapProposal.Status.EXPIRED)
+
+    def test_command_dry_run(self):
+        out = StringIO()
+        call_command('find_swap_cycles', '--dry-run', stdout=out)
+        self.assertIn('1 swap cycle(s) found covering 3 user(s).', out.getvalue())
+        self.assertFalse(SwapProposal.objects.exists())
+
+
+class DonationTransitionTest(TestCase):
+    """Transitions are conditional UPDATEs, so stale instances can't overwrite newer state."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.bob = User.objects.create_user(username='bob', password='123')
+        book = Book.objects.create(title='Algorithms', author='Cormen', course='MC458')
+        self.listing = DonationListing.add_listing(book, self.donor)
+
+    def test_request_is_one_update_plus_event_and_count(self):
+        # listing UPDATE, event INSERT, Book.available_count UPDATE
+        with self.assertNumQueries(3):
+            self.listing.request_donation(self.alice)
+        self.assertEqual(self.listing.status, DonationStatus.PENDING)
+        self.assertEqual(self.listing.requester, self.alice)
+
+    def test_stale_instance_cannot_request(self):
+        stale = DonationListing.objects.get(id=self.listing.id)
+        self.listing.request_donation(self.alice)
+
+        with self.assertRaisesMessage(ValueError, 'not available'):
+            stale.request_donation(self.bob)
+        # The failed attempt refreshed the instance instead of overwriting the row.
+        self.assertEqual(stale.requester, self.alice)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.requester, self.alice)
+
+    def test_stale_instance_cannot_approve_cancelled_request(self):
+        self.listing.request_donation(self.alice)
+        stale = DonationListing.objects.get(id=self.listing.id)
+        self.listing.cancel_donation(self.alice)
+
+        with self.assertRaises(ValueError):
+            stale.approve_donation()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.status, DonationStatus.AVAILABLE)
+
+    def test_cancel_reports_reason(self):
+        with self.assertRaisesMessage(ValueError, "Book wasn't requested"):
+            self.listing.cancel_donation(self.alice)
+        self.listing.request_donation(self.alice)
+        with self.assertRaisesMessage(ValueError, 'another user'):
+            self.listing.cancel_donation(self.bob)
+
+    def test_reject_then_request_again(self):
+        self.listing.request_donation(self.alice)
+        self.listing.reject_donation()
+        self.assertIsNone(self.listing.requester)
+        self.listing.request_donation(self.bob)
+        self.listing.approve_donation()
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.status, self.listing.requester), (DonationStatus.COMPLETED, self.bob))
+
+
+class DonationContentionTest(TransactionTestCase):
+    """Many users requesting the same listing at once: exactly one wins."""
+
+    THREADS = 8
+    # Lock conflicts retried per thread before the test gives up.
+    MAX_ATTEMPTS = 100
+
+    def test_concurrent_requests(self):
+        donor = User.objects.create_user(username='donor', password='123')
+        requesters = [User.objects.create_user(username=f'student{i}', password='123') for i in range(self.THREADS)]
+        book = Book.objects.create(title='Popular', author='Author', course='MC000')
+        listing_id = DonationListing.add_listing(book, donor).id
+
+        barrier = threading.Barrier(self.THREADS)
+        outcomes = []
+        exhausted = []
+
+        def attempt(user):
+            try:
+                listing = DonationListing.objects.get(id=listing_id)
+                barrier.wait()
+                for _ in range(self.MAX_ATTEMPTS):
+                    try:
+                        listing.request_donation(user)
+                        outcomes.append(user.id)
+                    except ValueError:
+                        outcomes.append(None)
+                    except OperationalError:
+                        # The shared in-memory test database reports lock
+                        # conflicts instead of waiting for the writer.
+                        time.sleep(0.001)
+                        continue
+                    break
+                else:
+                    exhausted.append(user.id)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(user,)) for user in requesters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(exhausted, [], f'lock conflicts outlasted {self.MAX_ATTEMPTS} attempts')
+        winners = [user_id for user_id in outcomes if user_id is not None]
+        self.assertEqual(len(outcomes), self.THREADS)
+        self.assertEqual(len(winners), 1)
+        listing = DonationListing.objects.get(id=listing_id)
+        self.assertEqual((listing.status, listing.requester_id), (DonationStatus.PENDING, winners[0]))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_transitions', '--iterations', '3', '--threads', '2', stdout=out)
+        self.assertIn('Sequential: 6 transitions', out.getvalue())
+        self.assertIn('3 granted, 3 rejected', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench-transitions').exists())
+
+
+class DonationQueueTest(TestCase):
+    """Tests for the per-listing request queue (waitlist)."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.students = [User.objects.create_user(username=f's{i}', password='123') for i in range(3)]
+        book = Book.objects.create(title='Linear Algebra', author='Strang', course='MA327')
+        self.listing = DonationListing.add_listing(book, self.donor)
+
+    def _join(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('donations:join_queue'), {'listing_id': self.listing.id})
+
+    def test_first_join_requests_directly(self):
+        response = self._join(self.students[0])
+        self.assertEqual(response.json(), {'status': 'requested'})
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.requester, self.students[0])
+
+    def test_later_joins_queue_in_order(self):
+        self._join(self.students[0])
+        self.assertEqual(self._join(self.students[1]).json(), {'status': 'queued', 'place': 1})
+        self.assertEqual(self._join(self.students[2]).json(), {'status': 'queued', 'place': 2})
+        self.assertEqual(self._join(self.students[2]).status_code, 400)
+        self.assertEqual(self._join(self.students[0]).status_code, 400)
+
+    def test_reject_and_cancel_promote_head(self):
+        self.listing.request_donation(self.students[0])
+        self.listing.join_queue(self.students[1])
+        self.listing.join_queue(self.students[2])
+
+        self.listing.reject_donation()
+        self.assertEqual((self.listing.status, self.listing.requester), (DonationStatus.PENDING, self.students[1]))
+
+        self.listing.cancel_donation(self.students[1])
+        self.assertEqual(self.listing.requester, self.students[2])
+        self.assertFalse(DonationRequest.objects.exists())
+
+        self.listing.cancel_donation(self.students[2])
+        self.assertEqual((self.listing.status, self.listing.requester), (DonationStatus.AVAILABLE, None))
+
+    def test_leave_queue(self):
+        self.listing.request_donation(self.students[0])
+        self.listing.join_queue(self.students[1])
+        self.listing.join_queue(self.students[2])
+
+        self.client.force_login(self.students[1])
+        response = self.client.post(reverse('donations:leave_queue'), {'listing_id': self.listing.id})
+        self.assertEqual(response.json(), {'status': 'left'})
+        response = self.client.post(reverse('donations:leave_queue'), {'listing_id': self.listing.id})
+        self.assertEqual(response.status_code, 400)
+
+        self.listing.reject_donation()
+        self.assertEqual(self.listing.requester, self.students[2])
+
+    def test_approve_clears_queue(self):
+        self.listing.request_donation(self.students[0])
+        self.listing.join_queue(self.students[1])
+        self.listing.approve_donation()
+        self.assertFalse(DonationRequest.objects.exists())
+        with self.assertRaises(ValueError):
+            self.listing.join_queue(self.students[2])
+
+    def test_donor_cannot_join(self):
+        self.assertEqual(self._join(self.donor).status_code, 400)
+
+    def test_head_lookup_uses_position_index(self):
+        self.listing.request_donation(self.students[0])
+        self.listing.join_queue(self.students[1])
+        # savepoint, status update + event + count, head read, promotion update + event + count,
+        # head delete, release
+        with self.assertNumQueries(10):
+            self.listing.reject_donation()
+
+
+class ListingQueryPlanTest(TestCase):
+    """The donations pages' listing queries are served by matching indexes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='planner', password='123')
+        self.client.login(username='planner', password='123')
+        # book_list only renders listings when the catalog isn't empty.
+        Book.objects.create(title='Compilers', author='Aho', course='MC910')
+
+    def _listing_plans(self, url):
+        """EXPLAIN QUERY PLAN for every listing query a page runs."""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if query['sql'].startswith('SELECT') and 'FROM "donations_donationlisting"' in query['sql']:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append(' '.join(row[-1] for row in cursor.fetchall()))
+        self.assertTrue(plans)
+        return plans
+
+    def test_my_listings_uses_donor_status_index_without_sort(self):
+        for plan in self._listing_plans(reverse('donations:my_listings')):
+            self.assertIn('listing_donor_status_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_pending_requests_uses_partial_index(self):
+        for plan in self._listing_plans(reverse('donations:pending_requests')):
+            self.assertIn('listing_requester_pending_idx', plan)
+
+    def test_book_list_scans_only_available_listings(self):
+        for plan in self._listing_plans(reverse('book_list')):
+            self.assertIn('listing_available_idx', plan)
+
+
+class DonationEventTest(TestCase):
+    """Tests for the donation event log and its consumers."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.bob = User.objects.create_user(username='bob', password='123')
+        self.book = Book.objects.create(title='Operating Systems', author='Tanenbaum', course='MC504')
+        self.listing = DonationListing.add_listing(self.book, self.donor)
+
+    def _kinds(self):
+        return list(DonationEvent.objects.order_by('id').values_list('kind', 'requester_id'))
+
+    def test_every_transition_is_logged(self):
+        self.listing.request_donation(self.alice)
+        self.listing.join_queue(self.bob)
+        self.listing.reject_donation()
+        self.listing.approve_donation()
+        DonationListing.add_listing(self.book, self.donor)  # already listed: no event
+
+        self.assertEqual(self._kinds(), [
+            ('listed', None),
+            ('requested', self.alice.id),
+            ('rejected', self.alice.id),
+            ('promoted', self.bob.id),
+            ('approved', self.bob.id),
+        ])
+
+    def test_failed_transition_logs_nothing(self):
+        with self.assertRaises(ValueError):
+            self.listing.approve_donation()
+        self.assertEqual(self._kinds(), [('listed', None)])
+
+    def test_delisting_keeps_history(self):
+        self.client.login(username='donor', password='123')
+        self.client.post(reverse('donations:delete_listing'), {'book_id': self.book.id})
+        self.assertFalse(DonationListing.objects.exists())
+        self.assertEqual(self._kinds(), [('listed', None), ('delisted', None)])
+
+    def test_consumers_process_each_event_once(self):
+        self.listing.request_donation(self.alice)
+        self.listing.cancel_donation(self.alice)
+        self.listing.request_donation(self.bob)
+        self.listing.approve_donation()
+
+        self.assertEqual(run_consumers(), {'notifications': 5, 'stats': 5, 'matching': 5})
+        self.assertEqual(run_consumers(), {'notifications': 0, 'stats': 0, 'matching': 0})
+
+        self.assertEqual(
+            list(DonationNotification.objects.filter(user=self.donor).values_list('kind', flat=True)),
+            ['requested', 'cancelled', 'requested'],
+        )
+        approved = DonationNotification.objects.get(user=self.bob)
+        self.assertEqual(approved.message, 'Your request for "Operating Systems" was approved.')
+        self.assertEqual(
+            dict(DonationStatRollup.objects.filter(period='day').values_list('kind', 'count')),
+            {'listed': 1, 'requested': 2, 'cancelled': 1, 'approved': 1},
+        )
+
+    def test_batches_and_checkpoint(self):
+        self.listing.request_donation(self.alice)
+        self.listing.cancel_donation(self.alice)
+        consumer = StatsConsumer()
+        consumer.batch_size = 2
+        self.assertEqual(consumer.run(max_batches=1), 2)
+        self.assertEqual(consumer.run(), 1)
+        self.assertEqual(sum(DonationStatRollup.objects.filter(period='hour').values_list('count', flat=True)), 3)
+
+    def test_concurrent_run_does_not_apply_a_batch_twice(self):
+        self.listing.request_donation(self.alice)
+        StatsConsumer().run()
+        # A second run that read the checkpoint before the first committed.
+        with mock.patch('donations.consumers.JobCheckpoint.get_position', return_value=0):
+            self.assertEqual(StatsConsumer().run(), 0)
+        self.assertEqual(sum(DonationStatRollup.objects.filter(period='hour').values_list('count', flat=True)), 2)
+
+    def test_matching_consumer_drops_matches_of_donated_listing(self):
+        shelf = Bookshelf.objects.create(user=self.alice)
+        shelf.add_or_update_item(self.book, BookshelfTag.WANTED)
+        run_matching()
+        self.assertEqual(DonationMatch.objects.count(), 1)
+
+        self.listing.request_donation(self.bob)
+        self.listing.approve_donation()
+        run_consumers(['matching'])
+        self.assertEqual(DonationMatch.objects.count(), 0)
+
+    def test_notifications_api_and_command(self):
+        self.listing.request_donation(self.alice)
+        out = StringIO()
+        call_command('run_donation_consumers', '--consumer', 'notifications', stdout=out)
+        self.assertIn('notifications: processed 2 event(s).', out.getvalue())
+
+        self.client.login(username='donor', password='123')
+        data = self.client.get(reverse('donations:notifications_api')).json()
+        self.assertEqual([n['kind'] for n in data['notifications']], ['requested'])
+        self.assertIsNone(data['next_cursor'])
+
+
+class RequestExpiryTest(TestCase):
+    """Tests for expiring stale pending requests."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.bob = User.objects.create_user(username='bob', password='123')
+        self.listings = [
+            DonationListing.add_listing(
+                Book.objects.create(title=f'Book {i}', author='Author', course='MC000'), self.donor
+            )
+            for i in range(3)
+        ]
+        self.later = timezone.now() + timedelta(days=15)
+
+    def test_request_sets_and_clears_requested_at(self):
+        listing = self.listings[0]
+        listing.request_donation(self.alice)
+        self.assertIsNotNone(listing.requested_at)
+        listing.cancel_donation(self.alice)
+        listing.refresh_from_db()
+        self.assertIsNone(listing.requested_at)
+
+    def test_expires_only_stale_requests(self):
+        stale, fresh, _ = self.listings
+        stale.request_donation(self.alice)
+        fresh.request_donation(self.alice)
+        DonationListing.objects.filter(id=fresh.id).update(requested_at=self.later - timedelta(days=1))
+
+        # locking SELECT, status UPDATE, event INSERT, available_count
+        # UPDATE, queue lookup (+ savepoint and release)
+        with self.assertNumQueries(7):
+            self.assertEqual(expire_pending_requests(days=14, now=self.later), 1)
+
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.requester, stale.requested_at), (DonationStatus.AVAILABLE, None, None))
+        fresh.refresh_from_db()
+        self.assertEqual((fresh.status, fresh.requester), (DonationStatus.PENDING, self.alice))
+
+        event = DonationEvent.objects.get(kind=DonationEvent.Kind.EXPIRED)
+        self.assertEqual(
+            (event.listing_id, event.book_id, event.donor_id, event.requester_id),
+            (stale.id, stale.book_id, self.donor.id, self.alice.id),
+        )
+
+    def test_idempotent(self):
+        self.listings[0].request_donation(self.alice)
+        self.assertEqual(expire_pending_requests(now=self.later), 1)
+        self.assertEqual(expire_pending_requests(now=self.later), 0)
+        self.assertEqual(DonationEvent.objects.filter(kind=DonationEvent.Kind.EXPIRED).count(), 1)
+
+    def test_expiry_promotes_queue(self):
+        listing = self.listings[0]
+        listing.request_donation(self.alice)
+        listing.join_queue(self.bob)
+
+        expire_pending_requests(now=self.later)
+        listing.refresh_from_db()
+        self.assertEqual((listing.status, listing.requester), (DonationStatus.PENDING, self.bob))
+        self.assertEqual(
+            list(DonationEvent.objects.filter(listing_id=listing.id).values_list('kind', flat=True)),
+            ['listed', 'requested', 'expired', 'promoted'],
+        )
+
+    def test_promotes_only_listings_it_expired(self):
+        """A queue left behind on another available listing is not touched."""
+        self.listings[0].request_donation(self.alice)
+        DonationRequest.objects.create(listing=self.listings[1], user=self.bob, position=1)
+
+        expire_pending_requests(now=self.later)
+        self.listings[1].refresh_from_db()
+        self.assertEqual(self.listings[1].status, DonationStatus.AVAILABLE)
+        self.assertTrue(DonationRequest.objects.filter(listing=self.listings[1]).exists())
+
+    def test_counts_every_expired_copy_of_a_book(self):
+        other_donor = User.objects.create_user(username='other_donor', password='123')
+        book = self.listings[0].book
+        DonationListing.add_listing(book, other_donor).request_donation(self.bob)
+        self.listings[0].request_donation(self.alice)
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 0)
+
+        self.assertEqual(expire_pending_requests(now=self.later), 2)
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 2)
+
+    def test_requester_is_notified(self):
+        self.listings[0].request_donation(self.alice)
+        expire_pending_requests(now=self.later)
+        run_consumers(['notifications'])
+        self.assertTrue(
+            DonationNotification.objects.filter(user=self.alice, kind=DonationEvent.Kind.EXPIRED).exists()
+        )
+
+    def test_sweep_uses_pending_requested_index(self):
+        plan = DonationListing.objects.filter(
+            status=DonationStatus.PENDING, requested_at__lt=self.later
+        ).explain()
+        self.assertIn('listing_pending_requested_idx', plan)
+
+    def test_command(self):
+        self.listings[0].request_donation(self.alice)
+        DonationListing.objects.update(requested_at=timezone.now() - timedelta(days=3))
+        out = StringIO()
+        call_command('expire_pending_requests', '--days', '2', stdout=out)
+        self.assertIn('Expired 1 pending request(s).', out.getvalue())
+
+
+class ListingAPITest(TestCase):
+    """Tests for the keyset-paginated listing APIs and the pages' query counts."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123', email='donor@x.com')
+        self.student = User.objects.create_user(username='student', password='123', email='s@x.com')
+        self.listings = [
+            DonationListing.add_listing(
+                Book.objects.create(title=f'Book {i}', author='Author', course='MC000'), self.donor
+            )
+            for i in range(6)
+        ]
+        for listing in self.listings[:3]:
+            listing.request_donation(self.student)
+
+    def _get(self, name, user='donor', **params):
+        self.client.login(username=user, password='123')
+        response = self.client.get(reverse(f'donations:{name}'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_my_listings_pages(self):
+        first = self._get('my_listings_api', limit=4)
+        self.assertEqual([row['id'] for row in first['listings']], [l.id for l in self.listings[::-1][:4]])
+        self.assertEqual(first['next_cursor'], self.listings[2].id)
+
+        second = self._get('my_listings_api', limit=4, after=first['next_cursor'])
+        self.assertEqual([row['id'] for row in second['listings']], [self.listings[1].id, self.listings[0].id])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(second['listings'][0]['requester'], {'username': 'student', 'email': 's@x.com'})
+        self.assertEqual(second['listings'][0]['book']['title'], 'Book 1')
+
+        available = self._get('my_listings_api', status='A')
+        self.assertEqual(len(available['listings']), 3)
+        self.assertIsNone(available['listings'][0]['requester'])
+
+    def test_pending_and_available(self):
+        pending = self._get('pending_requests_api', user='student')
+        self.assertEqual(len(pending['listings']), 3)
+        self.assertEqual(pending['listings'][0]['donor'], {'username': 'donor', 'email': 'donor@x.com'})
+        self.assertIsNotNone(pending['listings'][0]['requested_at'])
+
+        available = self._get('available_listings_api', user='student')
+        self.assertEqual({row['id'] for row in available['listings']}, {l.id for l in self.listings[3:]})
+        self.assertEqual(self._get('available_listings_api', user='donor')['listings'], [])
+
+        one_book = self._get('available_listings_api', user='student', book=self.listings[4].book_id)
+        self.assertEqual([row['id'] for row in one_book['listings']], [self.listings[4].id])
+
+    def test_invalid_params(self):
+        self.client.login(username='donor', password='123')
+        for name, params in [
+            ('my_listings_api', {'after': 'x'}),
+            ('my_listings_api', {'after': '²'}),
+            ('notifications_api', {'after': '²'}),
+            ('my_listings_api', {'limit': '0'}),
+            ('my_listings_api', {'status': 'C'}),
+            ('available_listings_api', {'book': 'x'}),
+        ]:
+            with self.subTest(name=name, params=params):
+                self.assertEqual(self.client.get(reverse(f'donations:{name}'), params).status_code, 400)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.client.login(username='donor', password='123')
+        for limit in (1, 200):
+            with self.subTest(limit=limit):
+                # session, user, listings
+                with self.assertNumQueries(3):
+                    self.client.get(reverse('donations:my_listings_api'), {'limit': limit})
+
+    def test_pages_have_no_per_listing_queries(self):
+        self.client.login(username='donor', password='123')
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('donations:my_listings'))
+        for i in range(6, 12):
+            DonationListing.add_listing(
+                Book.objects.create(title=f'Book {i}', author='Author', course='MC000'), self.donor
+            ).request_donation(self.student)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('donations:my_listings'))
+        self.assertEqual(len(few), len(many))
+
+        self.client.login(username='student', password='123')
+        with CaptureQueriesContext(connection) as pending:
+            self.client.get(reverse('donations:pending_requests'))
+        self.assertEqual(len(pending), len(few))
+
+
+class BulkDonorActionsTest(TestCase):
+    """Tests for the bulk add/approve/reject endpoints."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.bob = User.objects.create_user(username='bob', password='123')
+        self.books = [Book.objects.create(title=f'Book {i}', author='Author', course='MC000') for i in range(5)]
+        self.client.login(username='donor', password='123')
+
+    def _post(self, name, body):
+        return self.client.post(reverse(f'donations:{name}'), json.dumps(body), content_type='application/json')
+
+    def test_bulk_add(self):
+        existing = DonationListing.add_listing(self.books[0], self.donor)
+        ids = [book.id for book in self.books] + [9999]
+
+        response = self._post('bulk_add_listings', {'book_ids': ids})
+
+        data = response.json()
+        self.assertEqual(data['summary'], {'exists': 1, 'created': 4, 'error': 1})
+        self.assertEqual(data['results'][0], {'book_id': self.books[0].id, 'status': 'exists', 'listing_id': existing.id})
+        self.assertEqual(data['results'][-1]['error'], 'Book not found.')
+        self.assertEqual(DonationListing.objects.filter(donor=self.donor).count(), 5)
+        self.assertEqual(DonationEvent.objects.filter(kind=DonationEvent.Kind.LISTED).count(), 5)
+
+    def test_bulk_add_query_count_is_fixed(self):
+        # session, user, savepoint, books, listings, insert returning, events, counts, release
+        with self.assertNumQueries(9):
+            self._post('bulk_add_listings', {'book_ids': [book.id for book in self.books]})
+
+    def test_bulk_add_racing_a_single_add(self):
+        from donations import bulk
+        insert = bulk._insert_listings
+
+        def racing_insert(user, book_ids):
+            # A single add commits between the pre-read and the insert.
+            DonationListing.add_listing(self.books[0], user)
+            return insert(user, book_ids)
+
+        with mock.patch('donations.bulk._insert_listings', racing_insert):
+            data = self._post('bulk_add_listings', {'book_ids': [self.books[0].id, self.books[1].id]}).json()
+
+        self.assertEqual(data['summary'], {'exists': 1, 'created': 1})
+        self.assertEqual(
+            DonationEvent.objects.filter(kind=DonationEvent.Kind.LISTED, book_id=self.books[0].id).count(), 1
+        )
+        self.assertEqual(Book.objects.get(id=self.books[0].id).available_count, 1)
+
+    def test_bulk_approve_and_reject(self):
+        listings = [DonationListing.add_listing(book, self.donor) for book in self.books]
+        for listing in listings[:4]:
+            listing.request_donation(self.alice)
+        listings[1].join_queue(self.bob)
+        other = DonationListing.add_listing(self.books[0], self.alice)
+
+        data = self._post('bulk_approve', {'listing_ids': [listings[0].id, listings[4].id, other.id]}).json()
+        self.assertEqual([r['status'] for r in data['results']], ['approved', 'error', 'error'])
+        self.assertEqual(data['results'][1]['error'], 'Listing is not pending.')
+        self.assertEqual(data['results'][2]['error'], 'Listing not found.')
+
+        data = self._post('bulk_reject', {'listing_ids': [listings[1].id, listings[2].id, listings[3].id]}).json()
+        self.assertEqual(data['summary'], {'rejected': 3})
+
+        statuses = dict(DonationListing.objects.filter(donor=self.donor).values_list('id', 'status'))
+        self.assertEqual(statuses[listings[0].id], DonationStatus.COMPLETED)
+        self.assertEqual(statuses[listings[2].id], DonationStatus.AVAILABLE)
+        # The queued user got the rejected listing.
+        listings[1].refresh_from_db()
+        self.assertEqual((listings[1].status, listings[1].requester), (DonationStatus.PENDING, self.bob))
+        self.assertEqual(
+            DonationEvent.objects.filter(kind__in=['approved', 'rejected', 'promoted']).count(), 5
+        )
+
+    def test_invalid_bodies(self):
+        for body in [{}, {'book_ids': []}, {'book_ids': ['1']}, {'book_ids': list(range(1001))}]:
+            with self.subTest(body=body):
+                self.assertEqual(self._post('bulk_add_listings', body).status_code, 400)
+        response = self.client.post(reverse('donations:bulk_reject'), 'nope', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='donor', password='123')
+        url = reverse('donations:bulk_add_listings')
+        body = json.dumps({'book_ids': [self.books[0].id]})
+
+        self.assertEqual(client.post(url, body, content_type='application/json').status_code, 403)
+
+        DonationListing.add_listing(self.books[1], self.donor)
+        client.get(reverse('donations:my_listings'))
+        token = client.cookies['csrftoken'].value
+        response = client.post(url, body, content_type='application/json', headers={'X-CSRFToken': token})
+        self.assertEqual(response.json()['summary'], {'created': 1})
+
+
+class DonationStatsTest(TestCase):
+    """Tests for the statistics rollups and the stats API."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.admin = User.objects.create_user(username='admin', password='123', is_staff=True)
+        self.os_book = Book.objects.create(title='Operating Systems', author='Tanenbaum', course='MC504')
+        self.db_book = Book.objects.create(title='Databases', author='Elmasri', course='MC536')
+
+        self.donated = DonationListing.add_listing(self.os_book, self.donor)
+        self.pending = DonationListing.add_listing(self.db_book, self.donor)
+        self.kept = DonationListing.add_listing(self.os_book, self.alice)
+        DonationListing.objects.filter(id=self.donated.id).update(added_at=timezone.now() - timedelta(hours=10))
+        self.donated.request_donation(self.alice)
+        self.donated.approve_donation()
+        self.pending.request_donation(self.alice)
+
+    def _status_counts(self):
+        return set(DonationStatusCount.objects.exclude(count=0).values_list('course', 'status', 'count'))
+
+    def test_consumer_rollups(self):
+        DonationListing.remove_listing(self.db_book, self.donor)
+        run_consumers(['stats'])
+
+        self.assertEqual(self._status_counts(), {('MC504', 'C', 1), ('MC504', 'A', 1)})
+        self.assertEqual(
+            dict(DonationStatRollup.objects.filter(period='hour', course='MC504').values_list('kind', 'count')),
+            {'listed': 2, 'requested': 1, 'approved': 1},
+        )
+        self.assertEqual(
+            list(DonationDonorStat.objects.filter(donated__gt=0).values_list('donor_id', 'listed', 'donated')),
+            [(self.donor.id, 2, 1)],
+        )
+
+    def test_rebuild_matches_incremental_rollups(self):
+        run_consumers(['stats'])
+        out = StringIO()
+        call_command('rebuild_donation_stats', '--verify', stdout=out)
+        self.assertIn('Rollups match a rebuild over 6 event(s).', out.getvalue())
+
+    def test_rebuild_counts_listings_older_than_the_log(self):
+        run_consumers(['stats'])
+        DonationListing.objects.create(book=self.db_book, donor=self.alice)
+        with self.assertRaisesMessage(CommandError, 'DonationStatusCount: 1 row(s)'):
+            call_command('rebuild_donation_stats', '--verify', stdout=StringIO())
+
+        self.assertEqual(rebuild_stats(), 6)
+        self.assertIn(('MC536', 'A', 1), self._status_counts())
+        # New events carry on from the rebuilt checkpoint.
+        self.kept.request_donation(self.donor)
+        self.assertEqual(run_consumers(['stats']), {'stats': 1})
+
+    def test_increments_are_grouped_per_batch(self):
+        donors = User.objects.bulk_create(User(username=f'donor{i}') for i in range(30))
+        counts = {(donor.id,): 1 + i % 2 for i, donor in enumerate(donors)}
+        # insert missing rows, then one update per distinct delta
+        with self.assertNumQueries(3):
+            _increment(DonationDonorStat, ('donor_id',), counts, column='listed')
+        with self.assertNumQueries(3):
+            _increment(DonationDonorStat, ('donor_id',), counts, column='listed')
+        self.assertEqual(DonationDonorStat.objects.get(donor_id=donors[1].id).listed, 4)
+
+    def test_increment_chunks_keep_parameters_bounded(self):
+        """Keys of several fields share the per-statement parameter budget."""
+        counts = {('MC%03d' % i, DonationStatus.AVAILABLE): 1 for i in range(300)}
+        with CaptureQueriesContext(connection) as queries:
+            _increment(DonationStatusCount, ('course', 'status'), counts)
+        updates = [query for query in queries if query['sql'].startswith('UPDATE')]
+        # 300 keys of two fields, CHUNK_SIZE // 2 keys per UPDATE
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(DonationStatusCount.objects.filter(count=1).count(), 300)
+
+    def test_completion_median(self):
+        self.assertEqual(completion_bucket(0.5), 0)
+        self.assertEqual(completion_bucket(10), 2)
+        self.assertEqual(completion_bucket(10000), 7)
+        self.assertIsNone(estimate_median({}))
+        self.assertEqual(estimate_median({2: 2}), 15.0)
+        self.assertEqual(estimate_median({0: 1, 7: 3}), 720.0)
+
+    def test_stats_api(self):
+        run_consumers(['stats'])
+        self.client.login(username='admin', password='123')
+
+        # session, user, statuses, series, histogram, donors, usernames
+        with self.assertNumQueries(7):
+            data = self.client.get(reverse('donations:stats_api')).json()
+        self.assertEqual(data['period'], 'day')
+        self.assertEqual(data['status_counts'], {'MC504': {'A': 1, 'C': 1}, 'MC536': {'P': 1}})
+        self.assertEqual(
+            {row['kind']: row['count'] for row in data['series']},
+            {'listed': 3, 'requested': 2, 'approved': 1},
+        )
+        self.assertEqual(data['completion']['count'], 1)
+        self.assertEqual(data['completion']['histogram'][2], {'le_hours': 24, 'count': 1})
+        self.assertEqual(data['top_donors'], [
+            {'donor_id': self.donor.id, 'listed': 2, 'donated': 1, 'username': 'donor'},
+        ])
+
+        data = self.client.get(reverse('donations:stats_api'), {'period': 'hour', 'course': 'MC536'}).json()
+        self.assertEqual(data['status_counts'], {'MC536': {'P': 1}})
+        self.assertEqual(sum(row['count'] for row in data['series']), 2)
+        self.assertEqual(data['completion']['count'], 0)
+
+    def test_stats_api_validation(self):
+        self.client.login(username='alice', password='123')
+        self.assertEqual(self.client.get(reverse('donations:stats_api')).status_code, 403)
+        self.client.login(username='admin', password='123')
+        for params in [{'period': 'week'}, {'days': '0'}, {'period': 'hour', 'days': '30'}, {'days': 'x'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('donations:stats_api'), params).status_code, 400)
+
+
+class ListingEventStreamTest(TestCase):
+    """Tests for the Server-Sent Events stream and the in-process broker."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.book = Book.objects.create(title='Operating Systems', author='Tanenbaum', course='MC504')
+        self.listing = DonationListing.add_listing(self.book, self.donor)
+
+    def _request(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.request_donation(self.alice)
+
+    async def _frame(self, stream):
+        return await asyncio.wait_for(anext(stream), 2)
+
+    async def _close(self, *streams):
+        for stream in streams:
+            await stream.aclose()
+        self.assertFalse(broker.active)
+        if broker.state().poller is not None:
+            await asyncio.wait_for(broker.state().poller, 2)
+
+    def _data(self, frame):
+        return json.loads(frame.split('data: ', 1)[1])
+
+    async def test_live_events_reach_donor_and_requester_once(self):
+        donor_stream = event_stream(self.donor.id, heartbeat=0.3)
+        alice_stream = event_stream(self.alice.id, heartbeat=0.3)
+        self.assertEqual(await self._frame(donor_stream), 'retry: 3000\n\n')
+        await self._frame(alice_stream)
+
+        with mock.patch('donations.streams.POLL_INTERVAL', 0.05):
+            await sync_to_async(self._request)()
+            frame = await self._frame(donor_stream)
+            event_id = await DonationEvent.objects.filter(kind='requested').values_list('id', flat=True).aget()
+            self.assertTrue(frame.startswith(f'id: {event_id}\n'))
+            self.assertEqual(self._data(frame), {
+                'listing_id': self.listing.id, 'book_id': self.book.id,
+                'kind': 'requested', 'status': 'P', 'role': 'donor',
+            })
+            self.assertEqual(self._data(await self._frame(alice_stream))['role'], 'requester')
+            # The poller saw the same event but didn't deliver it again.
+            self.assertEqual(await self._frame(donor_stream), ': keepalive\n\n')
+            await self._close(donor_stream, alice_stream)
+
+    async def test_poller_delivers_events_from_other_processes(self):
+        with mock.patch('donations.streams.POLL_INTERVAL', 0.05):
+            stream = event_stream(self.donor.id)
+            await self._frame(stream)
+            # Written without publishing, as another worker or a command would.
+            await DonationEvent.objects.acreate(
+                listing_id=self.listing.id, book_id=self.book.id, donor_id=self.donor.id,
+                requester_id=None, kind=DonationEvent.Kind.DELISTED,
+            )
+            self.assertEqual(self._data(await self._frame(stream))['kind'], 'delisted')
+            await self._close(stream)
+
+    async def test_reconnect_replays_missed_events(self):
+        await sync_to_async(self.listing.request_donation)(self.alice)
+        listed = await DonationEvent.objects.filter(kind='listed').values_list('id', flat=True).aget()
+
+        with mock.patch('donations.streams.POLL_INTERVAL', 0):
+            stream = event_stream(self.donor.id, last_event_id=listed)
+            await self._frame(stream)
+            self.assertEqual(self._data(await self._frame(stream))['kind'], 'requested')
+            await self._close(stream)
+
+            stream = event_stream(self.alice.id, last_event_id=0)
+            await self._frame(stream)
+            self.assertEqual(self._data(await self._frame(stream))['role'], 'requester')
+            await self._close(stream)
+
+    async def test_broker_drops_duplicates_and_stalled_streams(self):
+        local = EventBroker(queue_size=1)
+        queue = local.subscribe(1)
+        event = SimpleNamespace(id=1, donor_id=1, requester_id=2)
+        local.dispatch([event, event])
+        self.assertEqual(queue.qsize(), 1)
+        self.assertFalse(queue.overflowed)
+
+        local.dispatch([SimpleNamespace(id=2, donor_id=3, requester_id=1)])
+        self.assertTrue(queue.overflowed)
+        self.assertFalse(local.active)
+
+    def test_broker_keeps_state_per_loop(self):
+        local = EventBroker()
+
+        async def subscribe(user_id):
+            return local.subscribe(user_id)
+
+        first, second = asyncio.new_event_loop(), asyncio.new_event_loop()
+        try:
+            queue = first.run_until_complete(subscribe(1))
+            # A stream on another loop doesn't drop the first loop's streams.
+            second.run_until_complete(subscribe(2))
+            local.publish([SimpleNamespace(id=1, donor_id=1, requester_id=None)])
+            first.run_until_complete(asyncio.sleep(0))
+            self.assertEqual(queue.qsize(), 1)
+        finally:
+            first.close()
+            second.close()
+
+    def _stream_request(self, factory, **headers):
+        request = factory.get('/donations/api/events/', headers=headers)
+        request.user = self.donor
+
+        async def auser():
+            return self.donor
+        request.auser = auser
+        return request
+
+    def test_stream_is_not_routed_by_default(self):
+        with self.assertRaises(NoReverseMatch):
+            reverse('donations:listing_events')
+        self.client.login(username='donor', password='123')
+        self.assertNotContains(self.client.get(reverse('donations:my_listings')), 'EventSource(')
+
+    async def test_view_refuses_wsgi_requests(self):
+        response = await views.listing_events(self._stream_request(RequestFactory()))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_view(self):
+        factory = AsyncRequestFactory()
+        response = await views.listing_events(self._stream_request(factory, last_event_id='abc'))
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch('donations.streams.POLL_INTERVAL', 0):
+            response = await views.listing_events(self._stream_request(factory))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            frames = response.streaming_content
+            self.assertEqual(await anext(frames), b'retry: 3000\n\n')
+            # A client disconnecting cancels the task reading the stream.
+            reader = asyncio.ensure_future(anext(frames))
+            await asyncio.sleep(0.05)
+            reader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await reader
+            self.assertFalse(broker.active)
+
+
+class ListingEventPollTest(TestCase):
+    """Tests for the short-polling fallback of the event stream."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.book = Book.objects.create(title='Operating Systems', author='Tanenbaum', course='MC504')
+        self.listing = DonationListing.add_listing(self.book, self.donor)
+        self.url = reverse('donations:listing_events_poll')
+
+    def test_poll(self):
+        self.client.login(username='donor', password='123')
+        first = self.client.get(self.url).json()
+        self.assertEqual(first['events'], [])
+        self.assertEqual(self.client.get(self.url, {'after': first['last_event_id']}).json()['events'], [])
+
+        self.listing.request_donation(self.alice)
+        data = self.client.get(self.url, {'after': first['last_event_id']}).json()
+        self.assertEqual([(e['kind'], e['role']) for e in data['events']], [('requested', 'donor')])
+        self.assertGreater(data['last_event_id'], first['last_event_id'])
+
+        self.client.login(username='alice', password='123')
+        data = self.client.get(self.url, {'after': first['last_event_id']}).json()
+        self.assertEqual(data['events'][0]['role'], 'requester')
+
+    def test_page_polls_and_bad_cursor(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.login(username='donor', password='123')
+        self.assertContains(self.client.get(reverse('donations:my_listings')), self.url)
+        self.assertEqual(self.client.get(self.url, {'after': '²'}).status_code, 400)
+
+
+class AvailableCountTest(TestCase):
+    """Tests for Book.available_count upkeep by the listing transitions."""
+
+    def setUp(self):
+        self.donor = User.objects.create_user(username='donor', password='123')
+        self.alice = User.objects.create_user(username='alice', password='123')
+        self.bob = User.objects.create_user(username='bob', password='123')
+        self.book = Book.objects.create(title='Algorithms', author='Cormen', course='MC458')
+
+    def _count(self):
+        return Book.objects.values_list('available_count', flat=True).get(id=self.book.id)
+
+    def test_single_transitions(self):
+        listing = DonationListing.add_listing(self.book, self.donor)
+        DonationListing.add_listing(self.book, self.alice)
+        self.assertEqual(self._count(), 2)
+
+        listing.request_donation(self.alice)
+        self.assertEqual(self._count(), 1)
+        listing.join_queue(self.bob)
+        listing.reject_donation()  # bob is promoted: still requested
+        self.assertEqual(self._count(), 1)
+        listing.cancel_donation(self.bob)
+        self.assertEqual(self._count(), 2)
+        listing.request_donation(self.bob)
+        listing.approve_donation()
+        self.assertEqual(self._count(), 1)
+
+        DonationListing.remove_listing(self.book, self.donor)
+        self.assertEqual(self._count(), 1)
+        DonationListing.remove_listing(self.book, self.alice)
+        self.assertEqual(self._count(), 0)
+
+    def test_bulk_and_expiry(self):
+        other = Book.objects.create(title='Compilers', author='Aho', course='MC910')
+        bulk_add_listings(self.donor, [self.book.id, other.id])
+        self.assertEqual(self._count(), 1)
+
+        listings = list(DonationListing.objects.filter(donor=self.donor))
+        for listing in listings:
+            listing.request_donation(self.alice)
+        self.assertEqual(self._count(), 0)
+        bulk_transition(self.donor, [listing.id for listing in listings], approve=False)
+        self.assertEqual(self._count(), 1)
+
+        for listing in listings:
+            listing.refresh_from_db()
+            listing.request_donation(self.bob)
+        expire_pending_requests(days=14, now=timezone.now() + timedelta(days=15))
+        self.assertEqual(
+            dict(Book.objects.values_list('title', 'available_count')),
+            {'Algorithms': 1, 'Compilers': 1},
+        )
+
+    def test_recount_repairs_drift(self):
+        DonationListing.add_listing(self.book, self.donor)
+        DonationListing.add_listing(self.book, self.alice)
+        self.alice.delete()  # cascades past the transitions
+        self.assertEqual(self._count(), 2)
+
+        out = StringIO()
+        call_command('recount_available', stdout=out)
+        self.assertIn('1 book(s)', out.getvalue())
+        self.assertEqual(self._count(), 1)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -15,4 +16,22 @@ urlpatterns = [
     path("cancel/", views.cancel_request, name="cancel_request"),
     path("approve/", views.approve_donation, name="approve_donation"),
     path("reject/", views.reject_donation, name="reject_donation"),
-]
\ No newline at end of file
+    path("queue/join/", views.join_queue, name="join_queue"),
+    path("queue/leave/", views.leave_queue, name="leave_queue"),
+    path("bulk/add/", views.bulk_add_listings_api, name="bulk_add_listings"),
+    path("bulk/approve/", views.bulk_approve_api, name="bulk_approve"),
+    path("bulk/reject/", views.bulk_reject_api, name="bulk_reject"),
+
+    # API
+    path("api/matches/", views.matches_api, name="matches_api"),
+    path("api/notifications/", views.notifications_api, name="notifications_api"),
+    path("api/listings/mine/", views.my_listings_api, name="my_listings_api"),
+    path("api/listings/available/", views.available_listings_api, name="available_listings_api"),
+    path("api/requests/pending/", views.pending_requests_api, name="pending_requests_api"),
+    path("api/stats/", views.stats_api, name="stats_api"),
+    path("api/events/poll/", views.listing_events_poll, name="listing_events_poll"),
+]
+
+# Server-Sent Events need the ASGI server; see settings.DONATION_EVENT_STREAM.
+if settings.DONATION_EVENT_STREAM:
+    urlpatterns.append(path("api/events/", views.listing_events, name="listing_events"))
\ No newline at end of file
@@ -1,16 +1,36 @@
 from django.db import IntegrityError
 from django.shortcuts import get_object_or_404, redirect, render
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseBadRequest
-from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_POST
+import json
 
-from .models import DonationListing, DonationStatus
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .bulk import bulk_add_listings, bulk_transition, validate_bulk_ids
+from .models import DonationListing, DonationMatch, DonationNotification, DonationStatRollup, DonationStatus
+from .stats import summary
+from .streams import CLIENT_POLL_SECONDS, event_data, event_stream, events_after
 from books.models import Book
+from marketplace.utils import is_number, status_summary
+
+def _event_updates(request):
+    """Template context for _listing_events.html: stream changes, or poll for them."""
+    return {
+        'event_stream': settings.DONATION_EVENT_STREAM and isinstance(request, ASGIRequest),
+        'event_poll_ms': CLIENT_POLL_SECONDS * 1000,
+    }
+
 
 @login_required
 def my_listings(request):
     listings = DonationListing.objects.filter(donor=request.user, status__in=('A','P')).order_by('-status', '-added_at')
-    return render(request, 'donations/my_listings.html', {'listings': listings})
+    listings = listings.select_related('book', 'requester')
+    return render(request, 'donations/my_listings.html', {'listings': listings, **_event_updates(request)})
 
 
 @login_required
@@ -18,8 +38,8 @@ def pending_requests(request):
     listings = DonationListing.objects.filter(
         requester=request.user,
         status=DonationStatus.PENDING
-    )
-    return render(request, 'donations/pending_requests.html', {'listings': listings})
+    ).select_related('book', 'donor')
+    return render(request, 'donations/pending_requests.html', {'listings': listings, **_event_updates(request)})
 
 
 @login_required
@@ -39,7 +59,7 @@ def delete_listing(request):
     book_id = request.POST.get("book_id")
     book = get_object_or_404(Book, id=book_id)
 
-    DonationListing.objects.filter(book=book, donor=request.user).delete()
+    DonationListing.remove_listing(book, request.user)
     return redirect('donations:my_listings')
 
 
@@ -69,7 +89,6 @@ def approve_donation(request):
     listing = get_object_or_404(DonationListing, id=listing_id, donor=request.user)
 
     listing.approve_donation()
-    listing.save()
 
     return redirect('donations:my_listings')
 
@@ -81,6 +100,307 @@ def reject_donation(request):
     listing = get_object_or_404(DonationListing, id=listing_id, donor=request.user)
 
     listing.reject_donation()
-    listing.save()
 
     return redirect('donations:my_listings')
+
+
+@login_required
+@require_POST
+def join_queue(request):
+    """Request a listing, or join its waitlist if someone else holds the request."""
+    listing_id = request.POST.get("listing_id")
+    listing = get_object_or_404(DonationListing, id=listing_id)
+    try:
+        entry = listing.join_queue(request.user)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if entry is None or listing.requester_id == request.user.pk:
+        return JsonResponse({'status': 'requested'})
+    return JsonResponse({'status': 'queued', 'place': entry.place()})
+
+
+@login_required
+@require_POST
+def leave_queue(request):
+    listing_id = request.POST.get("listing_id")
+    listing = get_object_or_404(DonationListing, id=listing_id)
+    if not listing.leave_queue(request.user):
+        return JsonResponse({'error': 'Not in the queue for this book'}, status=400)
+    return JsonResponse({'status': 'left'})
+
+
+def _bulk_response(request, key, action):
+    try:
+        ids = validate_bulk_ids(json.loads(request.body), key)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format in request body.'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    results = action(ids)
+    return JsonResponse({'results': results, 'summary': status_summary(results)})
+
+
+@require_POST
+@login_required
+def bulk_add_listings_api(request):
+    """List many books at once: ``{"book_ids": [...]}``."""
+    return _bulk_response(request, 'book_ids', lambda ids: bulk_add_listings(request.user, ids))
+
+
+@require_POST
+@login_required
+def bulk_approve_api(request):
+    """Approve the pending requests on many listings: ``{"listing_ids": [...]}``."""
+    return _bulk_response(request, 'listing_ids', lambda ids: bulk_transition(request.user, ids, approve=True))
+
+
+@require_POST
+@login_required
+def bulk_reject_api(request):
+    """Reject the pending requests on many listings: ``{"listing_ids": [...]}``."""
+    return _bulk_response(request, 'listing_ids', lambda ids: bulk_transition(request.user, ids, approve=False))
+
+
+MATCHES_PAGE_SIZE = 50
+
+
+@login_required
+@require_GET
+def matches_api(request):
+    """"Matches for you" feed: available listings of books the user wants, newest first."""
+    after = request.GET.get('after')
+    if after is not None and not is_number(after):
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    matches = DonationMatch.objects.filter(
+        wanter=request.user, listing__status=DonationStatus.AVAILABLE
+    )
+    if after is not None:
+        matches = matches.filter(id__lt=int(after))
+    rows = list(matches.order_by('-id').values(
+        'id', 'matched_on', 'created_at', 'wanted_book_id', 'listing_id',
+        'listing__book_id', 'listing__book__title', 'listing__book__author',
+        'listing__book__isbn', 'listing__donor__username',
+    )[:MATCHES_PAGE_SIZE + 1])
+
+    results = [
+        {
+            'id': row['id'],
+            'matched_on': row['matched_on'],
+            'created_at': row['created_at'].isoformat(),
+            'wanted_book_id': row['wanted_book_id'],
+            'listing_id': row['listing_id'],
+            'donor': row['listing__donor__username'],
+            'book': {
+                'id': row['listing__book_id'],
+                'title': row['listing__book__title'],
+                'author': row['listing__book__author'],
+                'isbn': row['listing__book__isbn'],
+            },
+        }
+        for row in rows[:MATCHES_PAGE_SIZE]
+    ]
+    next_cursor = results[-1]['id'] if len(rows) > MATCHES_PAGE_SIZE else None
+    return JsonResponse({'matches': results, 'next_cursor': next_cursor})
+
+
+NOTIFICATIONS_PAGE_SIZE = 50
+
+
+@login_required
+@require_GET
+def notifications_api(request):
+    """The user's donation notifications, newest first."""
+    after = request.GET.get('after')
+    if after is not None and not is_number(after):
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    notifications = DonationNotification.objects.filter(user=request.user)
+    if after is not None:
+        notifications = notifications.filter(id__lt=int(after))
+    rows = list(notifications.order_by('-id').values(
+        'id', 'kind', 'listing_id', 'message', 'created_at'
+    )[:NOTIFICATIONS_PAGE_SIZE + 1])
+    results = [dict(row, created_at=row['created_at'].isoformat()) for row in rows[:NOTIFICATIONS_PAGE_SIZE]]
+    next_cursor = results[-1]['id'] if len(rows) > NOTIFICATIONS_PAGE_SIZE else None
+    return JsonResponse({'notifications': results, 'next_cursor': next_cursor})
+
+
+LISTINGS_PAGE_SIZE = 50
+MAX_LISTINGS_PAGE_SIZE = 200
+
+_LISTING_FIELDS = (
+    'id', 'status', 'added_at', 'requested_at',
+    'book_id', 'book__title', 'book__author', 'book__course', 'book__isbn',
+)
+
+
+def _parse_listing_page(params):
+    """
+    Parse ``after`` (listing id cursor) and ``limit`` query parameters.
+
+    Raises:
+        ValueError: If either is not a positive integer
+    """
+    after = params.get('after')
+    if after is not None and not is_number(after):
+        raise ValueError('Invalid cursor')
+    limit = params.get('limit', str(LISTINGS_PAGE_SIZE))
+    if not is_number(limit) or int(limit) < 1:
+        raise ValueError('limit must be a positive integer')
+    return (int(after) if after is not None else None), min(int(limit), MAX_LISTINGS_PAGE_SIZE)
+
+
+def _listing_page(request, listings, user_fields):
+    """
+    One keyset page (newest first) of ``listings`` as a JSON response.
+
+    Rows are projected with ``values()``; the book and the ``donor`` /
+    ``requester`` columns named in ``user_fields`` come from joins in the
+    same query, so a page costs one query whatever its size.
+    """
+    try:
+        after, limit = _parse_listing_page(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if after is not None:
+        listings = listings.filter(id__lt=after)
+    rows = list(listings.order_by('-id').values(*_LISTING_FIELDS, *user_fields)[:limit + 1])
+
+    results = []
+    for row in rows[:limit]:
+        result = {
+            'id': row['id'],
+            'status': row['status'],
+            'added_at': row['added_at'].isoformat(),
+            'requested_at': row['requested_at'].isoformat() if row['requested_at'] else None,
+            'book': {
+                'id': row['book_id'],
+                'title': row['book__title'],
+                'author': row['book__author'],
+                'course': row['book__course'],
+                'isbn': row['book__isbn'],
+            },
+        }
+        for role in ('donor', 'requester'):
+            if f'{role}__username' in row:
+                username = row[f'{role}__username']
+                result[role] = {'username': username, 'email': row[f'{role}__email']} if username else None
+        results.append(result)
+    next_cursor = results[-1]['id'] if len(rows) > limit else None
+    return JsonResponse({'listings': results, 'next_cursor': next_cursor})
+
+
+@login_required
+@require_GET
+def my_listings_api(request):
+    """The user's open listings (``?status=A`` or ``P`` to narrow), newest first."""
+    statuses = (DonationStatus.AVAILABLE, DonationStatus.PENDING)
+    status = request.GET.get('status')
+    if status is not None:
+        if status not in statuses:
+            return JsonResponse({'error': 'status must be A or P'}, status=400)
+        statuses = (status,)
+    listings = DonationListing.objects.filter(donor=request.user, status__in=statuses)
+    return _listing_page(request, listings, ('requester__username', 'requester__email'))
+
+
+@login_required
+@require_GET
+def pending_requests_api(request):
+    """Listings the user has requested and is waiting on, newest first."""
+    listings = DonationListing.objects.filter(requester=request.user, status=DonationStatus.PENDING)
+    return _listing_page(request, listings, ('donor__username', 'donor__email'))
+
+
+@login_required
+@require_GET
+def available_listings_api(request):
+    """Other users' available listings (``?book=<id>`` to narrow), newest first."""
+    listings = DonationListing.objects.filter(status=DonationStatus.AVAILABLE).exclude(donor=request.user)
+    book = request.GET.get('book')
+    if book is not None:
+        if not is_number(book):
+            return JsonResponse({'error': 'Invalid book id'}, status=400)
+        listings = listings.filter(book_id=int(book))
+    return _listing_page(request, listings, ('donor__username', 'donor__email'))
+
+
+# period -> (default window, maximum window) in days
+STATS_WINDOWS = {
+    DonationStatRollup.Period.HOUR: (2, 14),
+    DonationStatRollup.Period.DAY: (30, 366),
+}
+
+
+@login_required
+@require_GET
+def stats_api(request):
+    """Staff-only donation statistics, read from the precomputed rollups."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required.'}, status=403)
+
+    period = request.GET.get('period', DonationStatRollup.Period.DAY)
+    if period not in STATS_WINDOWS:
+        return JsonResponse({'error': 'Period must be hour or day.'}, status=400)
+    default_days, max_days = STATS_WINDOWS[period]
+    days = request.GET.get('days', str(default_days))
+    if not is_number(days) or not 1 <= int(days) <= max_days:
+        return JsonResponse({'error': f'days must be between 1 and {max_days}.'}, status=400)
+
+    now = timezone.localtime()
+    if period == DonationStatRollup.Period.DAY:
+        current, step = now.replace(hour=0, minute=0, second=0, microsecond=0), timedelta(days=1)
+    else:
+        current, step = now.replace(minute=0, second=0, microsecond=0), timedelta(hours=1)
+    # The window ends with the current (partial) hour or day.
+    since = current + step - timedelta(days=int(days))
+    data = summary(period, since, course=request.GET.get('course'))
+    return JsonResponse(dict(data, period=period, since=since.isoformat()))
+
+
+@login_required
+@require_GET
+async def listing_events(request):
+    """
+    Server-Sent Events stream of status changes on the user's listings and requests.
+
+    Long-lived, so only routed with settings.DONATION_EVENT_STREAM and only
+    answered through the ASGI application (marketplace.asgi), where an idle
+    stream holds no thread. listing_events_poll serves the other setups.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a worker thread while the page is open.
+        return JsonResponse({'error': 'Event streams need the ASGI server.'}, status=404)
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id is not None and not is_number(last_event_id):
+        return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+    user = await request.auser()
+    stream = event_stream(user.pk, int(last_event_id) if last_event_id is not None else None)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_GET
+def listing_events_poll(request):
+    """
+    Status changes of the user's listings and requests after ``?after=<event id>``.
+
+    The short-polling counterpart of listing_events. Without ``after`` no
+    events are returned, only the id to poll after.
+    """
+    after = request.GET.get('after')
+    if after is not None and not is_number(after):
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    events, last_event_id = events_after(request.user.pk, int(after) if after is not None else None)
+    return JsonResponse({
+        'events': [event_data(event, request.user.pk) for event in events],
+        'last_event_id': last_event_id,
+    })
@@ -0,0 +1,58 @@
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+
+class StaleCheckpoint(Exception):
+    """Another run moved the checkpoint since this one read it."""
+
+
+class JobCheckpoint(models.Model):
+    """Last log position processed by a named background job."""
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}@{self.position}"
+
+    @classmethod
+    def get_position(cls, name):
+        """Return the saved position for ``name``, or None if it never ran."""
+        return cls.objects.filter(name=name).values_list('position', flat=True).first()
+
+    @classmethod
+    def advance(cls, name, position, expected=None):
+        """
+        Record that ``name`` has processed everything up to ``position``.
+
+        Call it in the transaction that applied the batch. With ``expected``
+        it is a compare-and-set: the checkpoint only moves if it still holds
+        ``expected`` (or, for 0, does not exist yet), so when two runs read
+        the same batch only the first to commit keeps its writes.
+
+        Args:
+            name: Checkpoint name
+            position: Log position processed up to
+            expected: Position the batch was read from; None overwrites
+
+        Raises:
+            StaleCheckpoint: If another run moved the checkpoint first; the
+                             caller's transaction must be rolled back
+        """
+        if expected is None:
+            cls.objects.update_or_create(name=name, defaults={'position': position})
+            return
+        moved = cls.objects.filter(name=name, position=expected).update(
+            position=position, updated_at=timezone.now()
+        )
+        if moved:
+            return
+        if expected == 0:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, position=position)
+                return
+            except IntegrityError:
+                pass
+        raise StaleCheckpoint(name)
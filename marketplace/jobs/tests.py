@@ -0,0 +1,26 @@
+from django.test import TestCase
+
+from .models import JobCheckpoint, StaleCheckpoint
+
+
+class JobCheckpointTest(TestCase):
+    """Tests for checkpoint reads and compare-and-set advances."""
+
+    def test_advance_overwrites_without_expected_position(self):
+        self.assertIsNone(JobCheckpoint.get_position('job'))
+        JobCheckpoint.advance('job', 10)
+        JobCheckpoint.advance('job', 4)
+        self.assertEqual(JobCheckpoint.get_position('job'), 4)
+
+    def test_advance_from_expected_position(self):
+        JobCheckpoint.advance('job', 10, expected=0)
+        JobCheckpoint.advance('job', 20, expected=10)
+        self.assertEqual(JobCheckpoint.get_position('job'), 20)
+
+    def test_stale_advance_is_refused(self):
+        JobCheckpoint.advance('job', 10, expected=0)
+        with self.assertRaises(StaleCheckpoint):
+            JobCheckpoint.advance('job', 10, expected=0)
+        with self.assertRaises(StaleCheckpoint):
+            JobCheckpoint.advance('job', 30, expected=20)
+        self.assertEqual(JobCheckpoint.get_position('job'), 10)
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
     'accounts',
     'bookshelves',
     'donations',
+    'recommendations',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -129,3 +131,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/books/'
 LOGOUT_REDIRECT_URL = '/'
+
+# Push listing status changes to open pages over Server-Sent Events.
+# Each open stream is a long-lived response, so only enable this when
+# serving marketplace.asgi (e.g. uvicorn); under WSGI (runserver) it would
+# hold a worker thread per open page, and pages poll for changes instead.
+DONATION_EVENT_STREAM = False
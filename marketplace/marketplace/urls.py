@@ -21,6 +21,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('books/', include('books.urls')),
+    path('books/', include('recommendations.urls')),
     path('bookshelves/', include('bookshelves.urls')),
     path("donations/", include("donations.urls")),
     path('', include('accounts.urls')),  # Make landing page the default
@@ -0,0 +1,24 @@
+"""Small helpers shared by the marketplace apps."""
+from collections import Counter
+
+
+def is_number(value):
+    """Whether ``value`` is a plain decimal integer; ``str.isdigit`` also accepts e.g. "²"."""
+    return value.isascii() and value.isdecimal()
+
+
+# Ids per IN (...) list and rows per bulk statement: keeps the bound
+# parameters of one statement well below SQLite's limit.
+CHUNK_SIZE = 500
+
+
+def chunks(values, size=CHUNK_SIZE):
+    """Split ``values`` into lists of at most ``size`` items."""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def status_summary(results):
+    """Count bulk operation outcomes (dicts with a ``status`` key) per status."""
+    return dict(Counter(result['status'] for result in results))
@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import BookNeighbor
+
+
+@admin.register(BookNeighbor)
+class BookNeighborAdmin(admin.ModelAdmin):
+    list_display = ['book', 'rank', 'neighbor', 'score', 'co_occurrences']
+    raw_id_fields = ['book', 'neighbor']
+    ordering = ['book', 'rank']
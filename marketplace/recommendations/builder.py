@@ -0,0 +1,159 @@
+"""
+Build and maintain the BookNeighbor table.
+
+``rebuild`` recomputes every book from BookshelfItem. ``update`` replays
+the bookshelves ShelfChange log from the last checkpoint and recomputes
+only books on shelves that changed: their co-occurrence counts are the
+only ones that moved; a batch that would re-read more than
+INCREMENTAL_MAX_SHELVES shelves runs a full rebuild instead. Scores of
+other books drift slightly as shelf counts change, so run a full rebuild
+now and then (e.g. nightly).
+"""
+from django.db import transaction
+from django.db.models import Count, Max
+
+from bookshelves.models import BookshelfItem, ShelfChange
+from jobs.models import JobCheckpoint, StaleCheckpoint
+from marketplace.utils import CHUNK_SIZE, chunks
+
+from .cooccurrence import DEFAULT_TOP_K, MAX_SHELF_SIZE, CSRMatrix, top_neighbors
+from .models import BookNeighbor
+
+CHECKPOINT_NAME = "recommendations.neighbors"
+
+# Maximum number of change log entries replayed per update() batch.
+CHANGES_BATCH_SIZE = 10000
+
+# A batch whose changes would re-read more shelves than this is applied
+# with a full rebuild instead, which reads each shelf once.
+INCREMENTAL_MAX_SHELVES = 5000
+
+# Rows fetched per round trip while streaming BookshelfItem.
+PAIRS_CHUNK_SIZE = 5000
+
+
+def _store(neighbors):
+    """Insert the ranked neighbors of every book in ``neighbors``; callers clear old rows."""
+    BookNeighbor.objects.bulk_create(
+        [
+            BookNeighbor(book_id=book, neighbor_id=neighbor, rank=rank, score=score, co_occurrences=co)
+            for book, ranked in neighbors.items()
+            for rank, (neighbor, score, co) in enumerate(ranked)
+        ],
+        batch_size=CHUNK_SIZE,
+    )
+
+
+def rebuild(k=DEFAULT_TOP_K, max_shelf_size=MAX_SHELF_SIZE):
+    """
+    Recompute neighbors for every shelved book.
+
+    Returns:
+        int: Number of books with stored neighbors
+    """
+    # Take the log position first: changes racing the read are replayed by
+    # the next update(), which is idempotent.
+    position = ShelfChange.objects.aggregate(last=Max("id"))["last"] or 0
+
+    # Both orientations are streamed from the database already sorted, so
+    # the item table is never held as Python tuples.
+    shelf_books = CSRMatrix.from_sorted_pairs(
+        BookshelfItem.objects.order_by("bookshelf_id", "book_id")
+        .values_list("bookshelf_id", "book_id").iterator(chunk_size=PAIRS_CHUNK_SIZE)
+    )
+    book_shelves = CSRMatrix.from_sorted_pairs(
+        BookshelfItem.objects.order_by("book_id", "bookshelf_id")
+        .values_list("book_id", "bookshelf_id").iterator(chunk_size=PAIRS_CHUNK_SIZE)
+    )
+    book_counts = {book: len(book_shelves.row(book)) for book in book_shelves.row_ids}
+    neighbors = top_neighbors(
+        shelf_books, book_counts, book_counts, k, max_shelf_size, book_shelves=book_shelves
+    )
+
+    with transaction.atomic():
+        BookNeighbor.objects.all().delete()
+        _store({book: ranked for book, ranked in neighbors.items() if ranked})
+        JobCheckpoint.advance(CHECKPOINT_NAME, position)
+    return sum(1 for ranked in neighbors.values() if ranked)
+
+
+def update(k=DEFAULT_TOP_K, max_shelf_size=MAX_SHELF_SIZE):
+    """
+    Apply shelf changes logged since the last run.
+
+    Falls back to a full rebuild when no checkpoint exists yet.
+
+    Returns:
+        int: Number of books whose neighbors were recomputed
+    """
+    position = JobCheckpoint.get_position(CHECKPOINT_NAME)
+    if position is None:
+        return rebuild(k, max_shelf_size)
+
+    recomputed = 0
+    while True:
+        changes = list(
+            ShelfChange.objects.filter(id__gt=position).order_by("id")
+            .values_list("id", "bookshelf_id", "book_id")[:CHANGES_BATCH_SIZE]
+        )
+        if not changes:
+            return recomputed
+        targets, target_shelves = _affected(
+            shelves={shelf for _, shelf, _ in changes},
+            books={book for _, _, book in changes},
+        )
+        if len(target_shelves) > INCREMENTAL_MAX_SHELVES:
+            return recomputed + rebuild(k, max_shelf_size)
+        try:
+            with transaction.atomic():
+                batch = _recompute(targets, target_shelves, k, max_shelf_size)
+                JobCheckpoint.advance(CHECKPOINT_NAME, changes[-1][0], expected=position)
+        except StaleCheckpoint:
+            # Another update (or a rebuild) moved the checkpoint meanwhile.
+            return recomputed
+        position = changes[-1][0]
+        recomputed += batch
+
+
+def _affected(shelves, books):
+    """
+    Books whose co-occurrence rows changed, and the shelves holding them.
+
+    Returns:
+        tuple: ``(targets, target_shelves)``: ``books`` plus every book on
+               ``shelves``, and every shelf holding one of those books
+    """
+    targets = set(books)
+    for chunk in chunks(shelves):
+        targets.update(
+            BookshelfItem.objects.filter(bookshelf_id__in=chunk).values_list("book_id", flat=True)
+        )
+    target_shelves = set()
+    for chunk in chunks(targets):
+        target_shelves.update(
+            BookshelfItem.objects.filter(book_id__in=chunk).values_list("bookshelf_id", flat=True)
+        )
+    return targets, target_shelves
+
+
+def _recompute(targets, target_shelves, k, max_shelf_size):
+    """Recompute neighbors of ``targets`` from the books on ``target_shelves``."""
+    pairs = []
+    for chunk in chunks(target_shelves):
+        pairs.extend(
+            BookshelfItem.objects.filter(bookshelf_id__in=chunk).values_list("bookshelf_id", "book_id")
+        )
+    shelf_books = CSRMatrix.from_pairs(pairs)
+
+    book_counts = {}
+    for chunk in chunks({book for _, book in pairs}):
+        book_counts.update(
+            BookshelfItem.objects.filter(book_id__in=chunk).order_by().values("book_id")
+            .annotate(total=Count("id")).values_list("book_id", "total")
+        )
+
+    neighbors = top_neighbors(shelf_books, book_counts, targets, k, max_shelf_size)
+    for chunk in chunks(targets):
+        BookNeighbor.objects.filter(book_id__in=chunk).delete()
+    _store(neighbors)
+    return len(targets)
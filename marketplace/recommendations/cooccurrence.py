@@ -0,0 +1,132 @@
+"""
+Sparse co-occurrence of books on shelves.
+
+The shelf x book matrix is kept in a compact CSR (compressed sparse row)
+layout built on the standard ``array`` module: ``indptr[i]:indptr[i + 1]``
+slices ``indices`` to give the columns of row ``i``. Multiplying the
+book -> shelves matrix by the shelf -> books matrix one row at a time gives
+each book's co-occurrence counts without materialising the full product.
+"""
+import heapq
+import math
+from array import array
+from collections import defaultdict
+
+DEFAULT_TOP_K = 10
+
+# Shelves larger than this (e.g. bulk imports of a whole catalogue) say
+# little about relatedness and cost quadratic work, so they are skipped
+# when counting co-occurrences.
+MAX_SHELF_SIZE = 500
+
+
+class CSRMatrix:
+    """Read-only sparse 0/1 matrix addressed by arbitrary integer row ids."""
+
+    def __init__(self, row_ids, indptr, indices):
+        self.row_ids = row_ids
+        self.indptr = indptr
+        self.indices = indices
+        self._positions = {row_id: position for position, row_id in enumerate(row_ids)}
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build a matrix from ``(row, column)`` pairs in any order; duplicates are dropped."""
+        return cls.from_sorted_pairs(sorted(set(pairs)))
+
+    @classmethod
+    def from_sorted_pairs(cls, pairs):
+        """
+        Build a matrix from ``(row, column)`` pairs sorted by row, then column.
+
+        ``pairs`` is consumed as a stream (e.g. a database cursor ordered by
+        both columns), so only the arrays being built are held in memory.
+        Repeated pairs are dropped.
+        """
+        row_ids = array("q")
+        indptr = array("q", [0])
+        indices = array("q")
+        previous_row = previous_column = None
+        for row, column in pairs:
+            if row != previous_row:
+                if previous_row is not None:
+                    indptr.append(len(indices))
+                row_ids.append(row)
+                previous_row = row
+            elif column == previous_column:
+                continue
+            indices.append(column)
+            previous_column = column
+        if previous_row is not None:
+            indptr.append(len(indices))
+        return cls(row_ids, indptr, indices)
+
+    def row(self, row_id):
+        position = self._positions.get(row_id)
+        if position is None:
+            return self.indices[0:0]
+        return self.indices[self.indptr[position]:self.indptr[position + 1]]
+
+    def transpose(self):
+        # Rows are visited in id order, so each column's row list comes out sorted.
+        columns = defaultdict(lambda: array("q"))
+        for position, row_id in enumerate(self.row_ids):
+            for column in self.indices[self.indptr[position]:self.indptr[position + 1]]:
+                columns[column].append(row_id)
+        row_ids = array("q")
+        indptr = array("q", [0])
+        indices = array("q")
+        for column in sorted(columns):
+            row_ids.append(column)
+            indices.extend(columns.pop(column))
+            indptr.append(len(indices))
+        return CSRMatrix(row_ids, indptr, indices)
+
+
+def top_neighbors(
+    shelf_books, book_counts, targets, k=DEFAULT_TOP_K, max_shelf_size=MAX_SHELF_SIZE, book_shelves=None
+):
+    """
+    Rank the most co-shelved books for each target book.
+
+    Scores are cosine similarities of the books' shelf vectors,
+    ``co(a, b) / sqrt(n(a) * n(b))``, where ``n`` counts shelves holding a
+    book. Ties go to the lower book id so results are deterministic.
+
+    Args:
+        shelf_books: CSRMatrix of shelf id -> book ids; must contain every
+            shelf holding a target book
+        book_counts: Dict of book id -> number of shelves holding it
+        targets: Book ids to rank neighbors for
+        k: Number of neighbors to keep per book
+        max_shelf_size: Shelves with more books are ignored
+        book_shelves: CSRMatrix of book id -> shelf ids; transposed from
+            ``shelf_books`` when not given
+
+    Returns:
+        dict: book id -> list of ``(neighbor_id, score, co_occurrences)``
+    """
+    if book_shelves is None:
+        book_shelves = shelf_books.transpose()
+    result = {}
+    for book in targets:
+        counts = defaultdict(int)
+        for shelf in book_shelves.row(book):
+            books = shelf_books.row(shelf)
+            if len(books) > max_shelf_size:
+                continue
+            for other in books:
+                if other != book:
+                    counts[other] += 1
+
+        n_book = book_counts.get(book, 0)
+        scored = (
+            (co / math.sqrt(n_book * book_counts[other]), -other, co)
+            for other, co in counts.items()
+            if n_book and book_counts.get(other)
+        )
+        result[book] = [
+            (-negative_id, score, co)
+            for score, negative_id, co in heapq.nlargest(k, scored)
+        ]
+    return result
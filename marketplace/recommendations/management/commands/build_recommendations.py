@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from recommendations import builder
+from recommendations.cooccurrence import DEFAULT_TOP_K, MAX_SHELF_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the 'also shelved' book neighbors from shelf changes since the last run, "
+        "or rebuild them all with --full."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recompute every book from scratch.")
+        parser.add_argument("--k", type=int, default=DEFAULT_TOP_K, help="Neighbors kept per book.")
+        parser.add_argument("--max-shelf-size", type=int, default=MAX_SHELF_SIZE,
+                            help="Ignore shelves with more books than this when counting co-occurrences.")
+
+    def handle(self, *args, **options):
+        if options["full"]:
+            count = builder.rebuild(options["k"], options["max_shelf_size"])
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt neighbors for {count} book(s)."))
+        else:
+            count = builder.update(options["k"], options["max_shelf_size"])
+            self.stdout.write(self.style.SUCCESS(f"Recomputed neighbors for {count} book(s)."))
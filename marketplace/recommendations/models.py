@@ -0,0 +1,26 @@
+from django.db import models
+
+from books.models import Book
+
+
+class BookNeighbor(models.Model):
+    """
+    One precomputed "also shelved" neighbor of a book.
+
+    Rows are rewritten by recommendations.builder; ``rank`` 0 is the most
+    similar neighbor, so the related-books API is a single index range read.
+    """
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    co_occurrences = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'rank'], name='book_neighbor_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.neighbor_id} ({self.score:.3f})"
@@ -0,0 +1,159 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from books.models import Book
+from bookshelves.models import Bookshelf, BookshelfTag
+from jobs.models import JobCheckpoint
+
+from . import builder
+from .cooccurrence import CSRMatrix, top_neighbors
+from .models import BookNeighbor
+
+
+class CSRMatrixTest(TestCase):
+    """Tests for the in-house sparse matrix."""
+
+    def test_rows_and_transpose(self):
+        matrix = CSRMatrix.from_pairs([(10, 3), (10, 1), (20, 3), (10, 3)])
+        self.assertEqual(list(matrix.row(10)), [1, 3])
+        self.assertEqual(list(matrix.row(20)), [3])
+        self.assertEqual(list(matrix.row(99)), [])
+
+        transposed = matrix.transpose()
+        self.assertEqual(list(transposed.row(3)), [10, 20])
+        self.assertEqual(list(transposed.row(1)), [10])
+
+    def test_from_sorted_pairs_streams_and_drops_repeats(self):
+        matrix = CSRMatrix.from_sorted_pairs(iter([(10, 1), (10, 3), (10, 3), (20, 3)]))
+        self.assertEqual(list(matrix.row_ids), [10, 20])
+        self.assertEqual(list(matrix.row(10)), [1, 3])
+        self.assertEqual(list(matrix.transpose().row(3)), [10, 20])
+
+    def test_top_neighbors_cosine(self):
+        # Shelf 1: books 1, 2, 3; shelf 2: books 1, 2; shelf 3: book 3.
+        matrix = CSRMatrix.from_pairs([(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (3, 3)])
+        counts = {1: 2, 2: 2, 3: 2}
+        neighbors = top_neighbors(matrix, counts, [1, 3], k=5)
+
+        self.assertEqual(neighbors[1], [(2, 1.0, 2), (3, 0.5, 1)])
+        self.assertEqual([n for n, _, _ in neighbors[3]], [1, 2])
+
+    def test_top_neighbors_skips_oversized_shelves(self):
+        matrix = CSRMatrix.from_pairs([(1, 1), (1, 2), (1, 3)])
+        neighbors = top_neighbors(matrix, {1: 1, 2: 1, 3: 1}, [1], max_shelf_size=2)
+        self.assertEqual(neighbors[1], [])
+
+
+class RecommendationBuildTest(TestCase):
+    """Tests for building neighbors and the related-books API."""
+
+    def setUp(self):
+        self.books = [Book.objects.create(title=f'Book {i}', author='Author', course='MC102') for i in range(4)]
+        self.users = [User.objects.create_user(username=f'student{i}', password='pass123') for i in range(3)]
+        self.shelves = [Bookshelf.objects.create(user=user) for user in self.users]
+        self._shelve(0, [0, 1, 2])
+        self._shelve(1, [0, 1])
+        self._shelve(2, [2, 3])
+
+    def _shelve(self, shelf, books):
+        for index in books:
+            self.shelves[shelf].add_or_update_item(self.books[index], BookshelfTag.WANTED)
+
+    def _neighbors(self, book):
+        return list(
+            BookNeighbor.objects.filter(book=self.books[book]).order_by('rank')
+            .values_list('neighbor_id', flat=True)
+        )
+
+    def test_rebuild(self):
+        builder.rebuild()
+        self.assertEqual(self._neighbors(0), [self.books[1].id, self.books[2].id])
+        self.assertEqual(self._neighbors(3), [self.books[2].id])
+        self.assertIsNotNone(JobCheckpoint.get_position(builder.CHECKPOINT_NAME))
+
+    def test_incremental_update_matches_rebuild(self):
+        builder.rebuild()
+        self._shelve(2, [0])
+        self.shelves[0].remove_book(self.books[2])
+
+        recomputed = builder.update()
+        self.assertGreater(recomputed, 0)
+        incremental = {i: self._neighbors(i) for i in range(4)}
+
+        builder.rebuild()
+        self.assertEqual(incremental, {i: self._neighbors(i) for i in range(4)})
+        self.assertEqual(builder.update(), 0)
+
+    def test_rebuild_clears_the_table_once(self):
+        builder.rebuild()
+        with CaptureQueriesContext(connection) as queries:
+            builder.rebuild()
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+
+    def test_update_clears_books_left_without_neighbors(self):
+        builder.rebuild()
+        self.shelves[2].remove_book(self.books[3])
+
+        builder.update()
+        self.assertEqual(self._neighbors(3), [])
+        self.assertEqual(self._neighbors(2), [self.books[0].id, self.books[1].id])
+
+    def test_large_update_falls_back_to_rebuild(self):
+        builder.rebuild()
+        self._shelve(2, [0])
+        with mock.patch.object(builder, 'INCREMENTAL_MAX_SHELVES', 1), \
+                mock.patch.object(builder, '_recompute') as recompute:
+            self.assertEqual(builder.update(), 4)
+        recompute.assert_not_called()
+        self.assertIn(self.books[3].id, self._neighbors(0))
+        self.assertEqual(builder.update(), 0)
+
+    def test_update_without_checkpoint_rebuilds(self):
+        builder.update()
+        self.assertEqual(self._neighbors(1), [self.books[0].id, self.books[2].id])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('build_recommendations', '--full', stdout=out)
+        self.assertIn('Rebuilt neighbors for 4 book(s).', out.getvalue())
+
+        self._shelve(1, [3])
+        out = StringIO()
+        call_command('build_recommendations', stdout=out)
+        self.assertIn('Recomputed neighbors for', out.getvalue())
+        self.assertIn(self.books[3].id, self._neighbors(0))
+
+    def test_related_api_single_read(self):
+        builder.rebuild()
+        client = Client()
+        client.login(username='student0', password='pass123')
+        url = reverse('recommendations:related_books_api', args=[self.books[0].id])
+
+        # session, user, neighbors
+        with self.assertNumQueries(3):
+            response = client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        related = response.json()['related']
+        self.assertEqual([book['id'] for book in related], [self.books[1].id, self.books[2].id])
+        self.assertEqual(related[0]['title'], 'Book 1')
+        self.assertEqual(related[0]['co_occurrences'], 2)
+
+    def test_related_api_empty_and_missing(self):
+        client = Client()
+        client.login(username='student0', password='pass123')
+
+        response = client.get(reverse('recommendations:related_books_api', args=[self.books[0].id]))
+        self.assertEqual(response.json()['related'], [])
+
+        response = client.get(reverse('recommendations:related_books_api', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(client.get('/books/api/999999/related/').status_code, 404)
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+app_name = 'recommendations'
+
+urlpatterns = [
+    path('api/<int:book_id>/related/', views.related_books_api, name='related_books_api'),
+]
@@ -0,0 +1,33 @@
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from books.models import Book
+
+from .models import BookNeighbor
+
+
+@require_GET
+@login_required
+def related_books_api(request, book_id):
+    """API endpoint listing the books most often shelved together with a book."""
+    rows = BookNeighbor.objects.filter(book_id=book_id).order_by('rank').values(
+        'neighbor_id', 'neighbor__title', 'neighbor__author', 'neighbor__course',
+        'neighbor__isbn', 'score', 'co_occurrences',
+    )
+    related = [
+        {
+            'id': row['neighbor_id'],
+            'title': row['neighbor__title'],
+            'author': row['neighbor__author'],
+            'course': row['neighbor__course'],
+            'isbn': row['neighbor__isbn'],
+            'score': round(row['score'], 4),
+            'co_occurrences': row['co_occurrences'],
+        }
+        for row in rows
+    ]
+    # Only books without neighbors pay for the existence check.
+    if not related and not Book.objects.filter(id=book_id).exists():
+        return JsonResponse({'error': 'Book not found.'}, status=404)
+    return JsonResponse({'book_id': book_id, 'related': related})